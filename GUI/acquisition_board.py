@@ -3,42 +3,89 @@
 # Copyright (c) Thomas Akam 2018-2023.
 # Licenced under the GNU General Public License v3.
 
+import os
+import ast
 import numpy as np
 import json
 import time
+import struct
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 from inspect import getsource
 from datetime import datetime
 from time import sleep
 
 from GUI.pyboard import Pyboard, PyboardError
+from GUI.chunk_parser import Chunk_parser
+from GUI.data_writer import Data_writer, encode_csv
+from GUI.metrics import Latency_histogram, Chunk_timing
 from GUI.dir_paths import upy_dir
-from config.GUI_config import VERSION, update_interval
+from config.GUI_config import (
+    VERSION,
+    update_interval,
+    fsync_interval,
+    metrics_log_interval,
+    compress_data,
+    chunk_timestamps,
+    firmware_buffer_ms,
+)
+
+reader_interval = 2  # How often the reader thread checks for new data (ms).
+reader_queue_length = 200  # Maximum number of reads held for the GUI by the reader thread.
+
+# Opcodes of binary commands executed by Photometry.serve on the pyboard.
+command_opcodes = {
+    "ping": 0,
+    "set_mode": 1,
+    "set_LED_current": 2,
+    "unique_id": 3,
+    "mem_free": 4,
+    "benchmark": 5,
+    "start": 6,
+}
 
 
 class Acquisition_board(Pyboard):
     """Class for aquiring data from a micropython photometry system on a host computer."""
 
-    def __init__(self, port, device_config):
+    def __init__(self, port, device_config, threaded=False):
         """Open connection to pyboard and instantiate Photometry class on pyboard with
-        provided parameters."""
+        provided parameters.  If threaded is True, data is read from the board and saved
+        to disk by a background thread while running, and get_new_data() returns the signals
+        read since it was last called."""
         self.config = device_config
+        self.threaded = threaded
         self.mode = None
         self.data_file = None
+        self.data_writer = None  # Writes data to data_file from a background thread.
+        self.metrics_file = None  # File acquisition metrics are logged to while recording.
+        self.timing_file = None  # File chunk timestamps are saved to while recording.
+        self.chunk_parser = None
+        self.file_lock = threading.Lock()  # Held while data file is being written.
         self.running = False
+        self.reader_thread = None
         self.LED_current = [0, 0]
+        self.request_id = 0  # ID of last command sent to pyboard, modulo 256.
+        self.command_batch = None  # Commands queued inside a batch() block.
         self.file_type = None
         self.port = port
         self.clipping_threshold = int(self.config["ADC_max_value"] * 0.98)
         super().__init__(port, baudrate=115200)
+        self.load_firmware()
+
+    def load_firmware(self):
+        """Reset pyboard, transfer firmware if not already on board, instantiate Photometry class
+        and start its command loop, which recieves all further commands from the host."""
         self.enter_raw_repl()  # Reset pyboard.
         # Transfer firmware if not already on board.
-        self.exec(getsource(_djb2_file))  # Define djb2 hashing function on board.
-        self.exec(getsource(_receive_file))  # Define recieve file function on board.
+        self.exec(getsource(_djb2_file) + getsource(_receive_file))  # Define hashing and recieve file functions.
         self.transfer_file(Path(upy_dir, "photometry_upy.py"))
-        # Import firmware and instantiate photometry class.
-        self.exec("import photometry_upy")
-        self.exec(f"p = photometry_upy.Photometry({repr(device_config)})")
+        # Import firmware, instantiate photometry class and serve commands.
+        self.exec(f"import photometry_upy\np = photometry_upy.Photometry({repr(self.config)})")
+        self.exec_raw_no_follow("p.serve()")
+        self.command("ping")
 
     # -----------------------------------------------------------------------
     # Data acquisition.
@@ -56,12 +103,13 @@ class Acquisition_board(Pyboard):
         self.n_analog_signals = 3 if mode == "3EX_2EM_pulsed" else 2
         self.n_digital_signals = 1 if mode == "3EX_2EM_pulsed" else 2
         self.pulsed_mode = mode.split("_")[-1] == "pulsed"
+        self.sample_stride = 2 * self.n_analog_signals if self.pulsed_mode else 2  # Data values per sample.
         self.max_LED_current = self.config["max_LED_current"]["pulsed" if self.pulsed_mode else "continuous"]
         if self.pulsed_mode:
             self.max_rate = self.config["max_sampling_rate"]["pulsed"] // self.n_analog_signals
         else:
             self.max_rate = self.config["max_sampling_rate"]["continuous"]
-        self.exec("p.set_mode('{}')".format(mode))
+        self.command("set_mode", mode.encode())
 
     def set_LED_current(self, LED_1_current=None, LED_2_current=None):
         if LED_1_current is not None:
@@ -79,8 +127,9 @@ class Acquisition_board(Pyboard):
                 self.serial.write(b"\xFD" + LED_1_current.to_bytes(2, "little"))
             if LED_2_current is not None:
                 self.serial.write(b"\xFE" + LED_2_current.to_bytes(2, "little"))
-        else:
-            self.exec("p.set_LED_current({},{})".format(LED_1_current, LED_2_current))
+        else:  # 0xFFFF leaves LED current unchanged.
+            LED_currents = [0xFFFF if current is None else current for current in (LED_1_current, LED_2_current)]
+            self.command("set_LED_current", struct.pack("<HH", *LED_currents))
 
     def set_sampling_rate(self, sampling_rate):
         self.sampling_rate = sampling_rate
@@ -91,9 +140,34 @@ class Acquisition_board(Pyboard):
 
     def start(self, sync_out_config):
         """Start data aquistion and streaming on the pyboard."""
-        self.exec_raw_no_follow("p.start({},{},{})".format(self.sampling_rate, self.buffer_size, sync_out_config))
-        self.chunk_number = 0  # Number of data chunks recieved from board, modulo 2**16.
+        self.n_buffers = self._n_firmware_buffers() if firmware_buffer_ms else None
+        flags = bool(compress_data) | bool(chunk_timestamps) << 1 | bool(sync_out_config) << 2
+        sync_out = [0, 0, 0]  # Pulse duration and inter pulse interval range (ms).
+        if sync_out_config:
+            sync_out = [sync_out_config["pulse_duration_ms"], *sync_out_config["inter_pulse_interval_ms"]]
+        self.command(
+            "start",
+            struct.pack("<IHHBHHH", int(self.sampling_rate), self.buffer_size, self.n_buffers or 0, flags, *sync_out),
+        )
+        # Chunk parser extracts data chunks from serial bytes, decoding them if compressed.
+        self.chunk_parser = Chunk_parser(
+            self.buffer_size,
+            compressed_stride=self.sample_stride if compress_data else None,
+            timestamps=chunk_timestamps,
+            overruns=bool(self.n_buffers),
+        )
+        self.chunk_timing = Chunk_timing() if chunk_timestamps else None  # Chunk latency and clock drift.
+        self.board_time = None  # Board time of last chunk recieved, without rollover (us).
+        self.unexpected_bytes = b""  # Recent bytes recieved outside data chunks.
+        self.process_latency = Latency_histogram()  # Duration of calls to process_data which recieve data.
+        self.write_latency = Latency_histogram()  # Duration of writes to data file.
+        self.plot_latency = Latency_histogram()  # Duration of plot updates, recorded by the GUI.
         self.running = True
+        if self.threaded:
+            self.data_queue = deque(maxlen=reader_queue_length)  # New signals for the GUI.
+            self.reader_error = None  # Exception raised in reader thread.
+            self.reader_thread = threading.Thread(target=self._reader_loop, name=f"reader {self.port}", daemon=True)
+            self.reader_thread.start()
 
     def record(self, data_dir, subject_ID, file_type="ppd"):
         """Open data file and write data header."""
@@ -116,38 +190,68 @@ class Acquisition_board(Pyboard):
             "version": VERSION,
         }
         if file_type == "ppd":  # Single binary .ppd file.
-            self.data_file = open(file_path, "wb")
+            data_file = open(file_path, "wb")
             data_header = json.dumps(self.header_dict).encode()
-            self.data_file.write(len(data_header).to_bytes(2, "little"))
-            self.data_file.write(data_header)
+            data_file.write(len(data_header).to_bytes(2, "little"))
+            data_file.write(data_header)
         elif file_type == "csv":  # Header in .json file and data in .csv file.
             self.json_path = Path(data_dir, file_name[:-4] + ".json")
             with open(self.json_path, "w") as headerfile:
                 headerfile.write(json.dumps(self.header_dict, sort_keys=True, indent=4))
-            self.data_file = open(file_path, "w")
-            self.data_file.write(
-                ", ".join(
-                    [f"Analog{a+1}" for a in range(self.n_analog_signals)]
-                    + [f"Digital{d+1}" for d in range(self.n_digital_signals)]
-                )
-                + "\n"
+            data_file = open(file_path, "wb")
+            data_file.write(
+                (
+                    ", ".join(
+                        [f"Analog{a+1}" for a in range(self.n_analog_signals)]
+                        + [f"Digital{d+1}" for d in range(self.n_digital_signals)]
+                    )
+                    + os.linesep
+                ).encode()
             )
+        self.data_writer = Data_writer(  # Location of chunks missing from data file is saved in .gaps.json file.
+            data_file,
+            fsync_interval=fsync_interval,
+            write_latency=self.write_latency,
+            gaps_path=Path(data_dir, file_name[:-4] + ".gaps.json"),
+        )
+        self.n_file_samples = 0  # Number of samples written to file.
+        with self.file_lock:
+            self.data_file = data_file
+            if metrics_log_interval:  # Log metrics to .metrics.jsonl file with same name as data file.
+                self.metrics_file = open(Path(data_dir, file_name[:-4] + ".metrics.jsonl"), "w")
+                self.last_metrics_log = time.monotonic()
+            if self.chunk_timing:  # Save chunk times to .timing file, see _get_chunk_times for format.
+                self.timing_file = open(Path(data_dir, file_name[:-4] + ".timing"), "wb")
         return file_name
 
     def stop_recording(self):
-        if self.data_file:
-            # Write session end time to file.
-            self.header_dict["end_time"] = datetime.now().isoformat(timespec="milliseconds")
-            if self.file_type == "ppd":  # Overwrite header at start of datafile.
-                self.data_file.seek(2)
-                self.data_file.write(json.dumps(self.header_dict).encode())
-            elif self.file_type == "csv":  # Overwrite seperate json file.
-                with open(self.json_path, "w") as headerfile:
-                    headerfile.write(json.dumps(self.header_dict, sort_keys=True, indent=4))
-            self.data_file.close()
-        self.data_file = None
+        with self.file_lock:
+            if self.data_file:
+                # Write session end time to file.
+                self.header_dict["end_time"] = datetime.now().isoformat(timespec="milliseconds")
+                self.data_writer.close()
+                self.data_writer = None
+                if self.file_type == "ppd":  # Overwrite header at start of datafile.
+                    self.data_file.seek(2)
+                    self.data_file.write(json.dumps(self.header_dict).encode())
+                elif self.file_type == "csv":  # Overwrite seperate json file.
+                    with open(self.json_path, "w") as headerfile:
+                        headerfile.write(json.dumps(self.header_dict, sort_keys=True, indent=4))
+                self.data_file.close()
+            self.data_file = None
+            if self.metrics_file:
+                self._log_metrics()
+                self.metrics_file.close()
+                self.metrics_file = None
+            if self.timing_file:
+                self.timing_file.close()
+                self.timing_file = None
 
     def stop(self):
+        if self.reader_thread:
+            self.running = False  # Tells reader thread to exit.
+            self.reader_thread.join()
+            self.reader_thread = None
         if self.data_file:
             self.stop_recording()
         self.serial.write(b"\xFF")  # Stop signal
@@ -156,34 +260,15 @@ class Acquisition_board(Pyboard):
         self.running = False
 
     def process_data(self):
-        """Read a chunk of data from the serial line, check data integrity, extract signals,
+        """Read all available data from the serial line, check data integrity, extract signals,
         save signals to disk if file is open, return signals."""
-        unexpected_input = []
-        data_chunks = []
-        while self.serial.in_waiting > 0:
-            new_byte = self.serial.read(1)
-            if new_byte == b"\x07":  # Start of data chunk.
-                chunk = np.frombuffer(self.serial.read(self.serial_chunk_size), dtype=np.dtype("<u2"))
-                recieved_chunk_number = chunk[0]
-                checksum = chunk[1]
-                data = chunk[2:]
-                if checksum == int(np.sum(data, dtype=np.uint64)) & 0xFFFF:  # Checksum of data chunk is correct.
-                    self.chunk_number = (self.chunk_number + 1) & 0xFFFF
-                    n_skipped_chunks = np.int16(recieved_chunk_number - self.chunk_number)  # rollover safe subtraction.
-                    if n_skipped_chunks > 0:  # Prepend data with zeros to replace skipped chunks.
-                        skip_pad = np.zeros(self.buffer_size * n_skipped_chunks, dtype=np.dtype("<u2"))
-                        data = np.hstack([skip_pad, data])
-                        self.chunk_number = (self.chunk_number + n_skipped_chunks) & 0xFFFF
-                    data_chunks.append(data)
-            else:
-                unexpected_input.append(new_byte)
-                unexpected_bytes = b"".join(unexpected_input[-8:])
-                if unexpected_bytes in (b"\x04Traceba", b"uncaught"):  # Code on pyboard has crashed.
-                    data_err = (unexpected_bytes + self.read_until(2, b"\x04>", timeout=1)).decode()
-                    raise PyboardError(data_err)
+        t0 = time.perf_counter()
+        self.chunk_parser.read_serial(self.serial)
+        data, unexpected_bytes = self.chunk_parser.parse()
+        if unexpected_bytes:
+            self.check_for_error(unexpected_bytes)
         # Extract signals.
-        if data_chunks:
-            data = np.hstack(data_chunks)
+        if data is not None:
             analog = data >> 1  # Analog signal is most significant 15 bits.
             digital = (data % 2) == 1  # Digital signal is least significant bit.
             if self.mode == "2EX_2EM_continuous":
@@ -211,17 +296,202 @@ class Acquisition_board(Pyboard):
                     np.all(LED_on_signal == 0) or np.all(baseline == 0)
                     for LED_on_signal, baseline in zip(LED_on_signals, baselines)
                 ]
+            if self.chunk_timing:
+                chunk_times = self._get_chunk_times(len(data) // len(signals[0]))
             # Write data to disk.
-            if self.data_file:
-                if self.file_type == "ppd":  # Binary data file.
-                    self.data_file.write(data.tobytes())
-                else:  # CSV data file.
-                    np.savetxt(self.data_file, np.array(signals + DIs, dtype=int).T, fmt="%d", delimiter=",")
+            with self.file_lock:
+                if self.data_file:
+                    if self.file_type == "ppd":  # Binary data file.
+                        self.data_writer.write(data)
+                    else:  # CSV data file.
+                        self.data_writer.write(encode_csv(np.column_stack(signals + DIs)))
+                    if self.chunk_parser.gaps:  # Record location of zeros written for missing chunks.
+                        values_per_sample = len(data) // len(signals[0])
+                        self.data_writer.add_gaps(
+                            [chunk_number, self.n_file_samples + offset // values_per_sample, n // values_per_sample]
+                            for chunk_number, offset, n in self.chunk_parser.gaps
+                        )
+                    if self.timing_file and len(chunk_times):
+                        chunk_times[:, 0] += self.n_file_samples
+                        self.timing_file.write(chunk_times.astype("<i8").tobytes())
+                    self.n_file_samples += len(signals[0])
+                    if self.metrics_file and time.monotonic() - self.last_metrics_log > metrics_log_interval:
+                        self._log_metrics()
+            self.process_latency.add(time.perf_counter() - t0)
             return signals, DIs, clipping_high, clipping_low
 
+    def _get_chunk_times(self, values_per_sample):
+        """Return the timing of chunks extracted by the last parse as an int64 array with rows
+        [sample, board_time, host_time], where sample is the index of the chunk's first sample
+        in the data, board_time is the time of that sample on the board's clock since the board
+        was reset (us) and host_time is when the chunk was read by the host (us since the Unix
+        epoch).  Chunk times are also added to the chunk latency and clock drift statistics."""
+        chunk_times = np.array(self.chunk_parser.chunk_times, dtype=np.int64).reshape(-1, 2)
+        if len(chunk_times) == 0:
+            return np.zeros((0, 3), dtype=np.int64)
+        # Remove rollover of board times, which are sent modulo 2**30.
+        board_times = chunk_times[:, 1]
+        if self.board_time is None:
+            self.board_time = int(board_times[0])
+        board_times = self.board_time + np.cumsum((np.diff(board_times, prepend=self.board_time) & 0x3FFFFFFF))
+        self.board_time = int(board_times[-1])
+        host_time = self.chunk_parser.read_time // 1000
+        for board_time in board_times:
+            self.chunk_timing.add(board_time / 1e6, host_time / 1e6)
+        return np.column_stack(
+            [chunk_times[:, 0] // values_per_sample, board_times, np.full_like(board_times, host_time)]
+        )
+
+    def benchmark_firmware(self):
+        """Measure the time the pyboard takes to acquire and checksum each sample in each acquisition
+        mode, returns a dict {mode: results} with the results described in Photometry.benchmark."""
+        return ast.literal_eval(self.command("benchmark", timeout=60).decode())
+
+    def get_new_data(self):
+        """Return the signals recieved since the last call in the format returned by process_data,
+        or None if there is no new data.  In threaded mode the data has already been processed by
+        the reader thread, otherwise process_data is called."""
+        if not self.threaded:
+            return self.process_data()
+        if self.reader_error:
+            raise self.reader_error
+        new_data = []
+        while self.data_queue:
+            new_data.append(self.data_queue.popleft())
+        return merge_new_data(new_data)
+
+    def _reader_loop(self):
+        """Called in reader thread to process data from the board while running."""
+        while self.running:
+            try:
+                new_data = self.process_data()
+            except BaseException as e:  # Passed to GUI thread by get_new_data.
+                self.reader_error = e
+                return
+            if new_data:
+                self.data_queue.append(new_data)
+            sleep(reader_interval / 1000)
+
+    def check_for_error(self, unexpected_bytes):
+        """Raise PyboardError if bytes recieved outside data chunks show code on pyboard has crashed."""
+        self.unexpected_bytes = self.unexpected_bytes[-7:] + unexpected_bytes
+        for error_start in (b"\x04Traceba", b"uncaught"):
+            error_ind = self.unexpected_bytes.find(error_start)
+            if error_ind != -1:  # Code on pyboard has crashed.
+                data_err = self.unexpected_bytes[error_ind:]
+                if not data_err.endswith(b"\x04>"):
+                    data_err += self.read_until(2, b"\x04>", timeout=1)
+                raise PyboardError(data_err.decode())
+
+    def _n_firmware_buffers(self):
+        """Return the number of data buffers for the pyboard to hold firmware_buffer_ms of data,
+        limited to using half the pyboard's free RAM, and at least 2."""
+        mem_free = struct.unpack("<I", self.command("mem_free"))[0]
+        buffer_bytes = 2 * self.buffer_size + 64  # Array data and object overheads.
+        chunk_dur = 1000 * self.buffer_size / (self.sample_stride * self.sampling_rate)  # ms.
+        n_buffers = int(np.ceil(firmware_buffer_ms / chunk_dur)) + 1  # +1 for buffer being written.
+        return max(2, min(n_buffers, (mem_free // 2) // buffer_bytes))
+
+    def get_writer_stats(self):
+        """Return statistics on data file writing, or None if not recording."""
+        if self.data_writer:
+            return self.data_writer.get_stats()
+
+    def get_metrics(self):
+        """Return a dict of counters and latency statistics for the current acquisition, or None
+        if acquisition has not been started."""
+        if not self.chunk_parser:
+            return None
+        return {
+            "bytes_read": self.chunk_parser.n_bytes_read,
+            "chunks_OK": self.chunk_parser.n_chunks,
+            "bad_checksums": self.chunk_parser.n_bad_checksums,
+            "skipped_chunks": self.chunk_parser.n_skipped_chunks,
+            "unexpected_bytes": self.chunk_parser.n_unexpected_bytes,
+            "board_buffers": self.n_buffers,  # Size of pyboard's buffer ring, None if 2 buffers.
+            "board_overruns": self.chunk_parser.n_board_overruns,  # Buffers lost on pyboard, modulo 2**16.
+            "serial_backlog": self.chunk_parser.in_waiting,  # Bytes waiting at last read.
+            "max_serial_backlog": self.chunk_parser.max_in_waiting,
+            "process_latency": self.process_latency.summary(),
+            "write_latency": self.write_latency.summary(),
+            "plot_latency": self.plot_latency.summary(),
+            "writer": self.get_writer_stats(),
+            "chunk_timing": self.chunk_timing.summary() if self.chunk_timing else None,
+        }
+
+    def _log_metrics(self):
+        """Write the current metrics to the metrics file as a line of JSON."""
+        metrics = {"time": datetime.now().isoformat(timespec="milliseconds"), **self.get_metrics()}
+        self.metrics_file.write(json.dumps(metrics) + "\n")
+        self.metrics_file.flush()
+        self.last_metrics_log = time.monotonic()
+
     def unique_id(self):
         """Return the hardware ID of the pyboard."""
-        return int(self.eval("p.unique_id").decode())
+        return int.from_bytes(self.command("unique_id"), "little")
+
+    # -----------------------------------------------------------------------
+    # Commands.
+    # -----------------------------------------------------------------------
+
+    def command(self, name, payload=b"", timeout=1):
+        """Send a command to the command loop on the pyboard (see Photometry.serve) and return
+        the response bytes, raising PyboardError if the command fails.  Inside a batch() block
+        the command is queued and None is returned."""
+        self.request_id = (self.request_id + 1) & 0xFF
+        frame = b"\xFC" + bytes([self.request_id, command_opcodes[name], len(payload)]) + payload
+        if self.command_batch is not None:
+            self.command_batch.append((self.request_id, name, frame))
+            return None
+        return self._send_commands([(self.request_id, name, frame)], timeout)[0]
+
+    @contextmanager
+    def batch(self, timeout=1):
+        """Context manager which queues the commands sent in the with block, then sends them in a
+        single write and waits for all the responses, so they take a single round trip to the
+        pyboard.  The with statement returns a list which the responses are added to."""
+        self.command_batch = []
+        responses = []
+        try:
+            yield responses
+            commands = self.command_batch
+        finally:
+            self.command_batch = None
+        responses += self._send_commands(commands, timeout)
+
+    def _send_commands(self, commands, timeout):
+        """Write commands as a single write, return their responses in order.  Raise PyboardError
+        if a command fails or the responses are not all recieved within timeout seconds."""
+        if not commands:
+            return []
+        self.serial.write(b"".join(frame for request_id, name, frame in commands))
+        responses = {}  # {request_id: (status, response)}
+        unexpected_bytes = b""
+        deadline = time.monotonic() + timeout
+        try:
+            while len(responses) < len(commands):
+                self.serial.timeout = max(deadline - time.monotonic(), 0)
+                start_byte = self.serial.read(1)
+                if not start_byte:
+                    raise PyboardError("timeout waiting for command response", unexpected_bytes)
+                elif start_byte != b"\xFB":  # Not the start of a response.
+                    unexpected_bytes += start_byte
+                    continue
+                response_header = self.serial.read(4)
+                if len(response_header) < 4:
+                    raise PyboardError("timeout waiting for command response", unexpected_bytes + response_header)
+                n_bytes = int.from_bytes(response_header[2:4], "little")
+                response = self.serial.read(n_bytes)
+                if len(response) < n_bytes:  # Timed out part way through response.
+                    raise PyboardError("incomplete command response", response_header + response)
+                responses[response_header[0]] = (response_header[1], response)
+        finally:
+            self.serial.timeout = None
+        for request_id, name, frame in commands:
+            status, response = responses.get(request_id, (1, b"no response"))
+            if status:
+                raise PyboardError("command", name, response)
+        return [responses[request_id][1] for request_id, name, frame in commands]
 
     # -----------------------------------------------------------------------
     # File transfer
@@ -261,6 +531,22 @@ class Acquisition_board(Pyboard):
         raise PyboardError
 
 
+def merge_new_data(new_data):
+    """Combine a list of outputs of Acquisition_board.process_data into a single output in the
+    same format, or None if the list is empty."""
+    if not new_data:
+        return None
+    elif len(new_data) == 1:
+        return new_data[0]
+    signals, DIs, clipping_high, clipping_low = zip(*new_data)
+    return (
+        [np.hstack(channel) for channel in zip(*signals)],
+        [np.hstack(channel) for channel in zip(*DIs)],
+        [any(channel) for channel in zip(*clipping_high)],
+        [all(channel) for channel in zip(*clipping_low)],
+    )
+
+
 # ----------------------------------------------------------------------------------------
 #  Helper functions.
 # ----------------------------------------------------------------------------------------
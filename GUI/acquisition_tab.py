@@ -1,5 +1,7 @@
 import json
+import time
 from pathlib import Path
+import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 from pyqtgraph.Qt.QtWidgets import QFrame, QMessageBox
 from serial import SerialException
@@ -8,13 +10,15 @@ from typing import List
 from enum import Enum
 
 import config.GUI_config as GUI_config
-from GUI.acquisition_board import Acquisition_board
+from GUI.acquisition_board import Acquisition_board, merge_new_data
+from GUI.simulated_board import Simulated_board, simulated_port_prefix
 from GUI.pyboard import PyboardError
 from GUI.plotting import Signals_plot
 from GUI.dir_paths import experiments_dir, data_dir, config_dir
 from GUI.utility import set_cbox_item, cbox_update_options
 
 AlignVCenter = QtCore.Qt.AlignmentFlag.AlignVCenter
+metrics_update_interval = 1  # How often metrics shown in each Setupbox are updated while running (seconds).
 
 # ----------------------------------------------------------------------------------------
 #  Acquisition_tab
@@ -184,12 +188,25 @@ class Acquisition_tab(QtWidgets.QWidget):
         self.h_layout.addWidget(self.controls_groupbox)
         self.v_layout.addLayout(self.h_layout)
         self.v_layout.addWidget(self.datadir_groupbox)
-        self.v_layout.addWidget(self.scroll_area)
+        if GUI_config.plot_backend == "batched":  # Signals from all setups plotted in one widget.
+            self.plot_layout = pg.GraphicsLayoutWidget()
+            if GUI_config.plot_opengl:
+                self.plot_layout.useOpenGL(True)
+            self.splitter = QtWidgets.QSplitter(QtCore.Qt.Orientation.Vertical)
+            self.splitter.addWidget(self.scroll_area)
+            self.splitter.addWidget(self.plot_layout)
+            self.v_layout.addWidget(self.splitter)
+        else:  # Each setup has its own plot widget.
+            self.plot_layout = None
+            self.v_layout.addWidget(self.scroll_area)
 
         # Timers.
 
         self.update_timer = QtCore.QTimer()  # Timer to regularly call process_data()
         self.update_timer.timeout.connect(self.process_data)
+        self.display_timer = QtCore.QTimer()  # Timer to regularly call update_plots()
+        self.display_timer.timeout.connect(self.update_plots)
+        self.frames_to_skip = 0  # Number of display updates to skip as previous update was slow.
 
         # Initial state
 
@@ -208,6 +225,7 @@ class Acquisition_tab(QtWidgets.QWidget):
     def remove_setup(self):
         box = self.setupboxes.pop(-1)
         box.close()
+        box.signals_plot.remove_from_layout()
         box.setParent(None)
         box.deleteLater()
         self.n_setups = len(self.setupboxes)
@@ -245,8 +263,10 @@ class Acquisition_tab(QtWidgets.QWidget):
                 self.GUI_main.tab_widget.setTabEnabled(1, False)
                 if not self.update_timer.isActive():
                     self.update_timer.start(GUI_config.update_interval)
+                    self.display_timer.start(int(1000 / GUI_config.display_fps))
             else:  # No setups running.
                 self.update_timer.stop()
+                self.display_timer.stop()
                 self.config_groupbox.setEnabled(True)
                 self.settings_groupbox.setEnabled(True)
                 self.datadir_groupbox.setEnabled(True)
@@ -443,6 +463,20 @@ class Acquisition_tab(QtWidgets.QWidget):
             if box.is_running():
                 box.process_data()
 
+    def update_plots(self):
+        """Called regularly while setups are running to plot new data.  If updating the plots
+        takes longer than the interval between display updates, subsequent updates are skipped
+        so that reading data from the boards is not held up, data recieved while updates are
+        skipped is plotted at the next update."""
+        if self.frames_to_skip:
+            self.frames_to_skip -= 1
+            return
+        t0 = time.perf_counter()
+        for box in self.setupboxes:
+            if box.is_running():
+                box.update_plot()
+        self.frames_to_skip = int((time.perf_counter() - t0) * GUI_config.display_fps)
+
 
 # ----------------------------------------------------------------------------------------
 #  Setupbox
@@ -508,9 +542,18 @@ class Setupbox(QtWidgets.QFrame):
         self.record_button.clicked.connect(self.record)
         self.stop_button.clicked.connect(self.stop)
 
+        self.metrics_button = QtWidgets.QPushButton("Metrics")
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.setToolTip("Show data acquisition metrics")
+        self.metrics_text = QtWidgets.QLabel()  # Shows acquisition metrics while running.
+        self.metrics_text.setWordWrap(True)
+        self.metrics_text.setVisible(False)
+        self.metrics_button.toggled.connect(self.metrics_text.setVisible)
+        self.metrics_update_time = 0  # Time metrics text was last updated.
+
         # Plots
 
-        self.signals_plot = Signals_plot(self)
+        self.signals_plot = Signals_plot(self, plot_layout=self.acquisition_tab.plot_layout)
 
         # Layout
 
@@ -530,8 +573,10 @@ class Setupbox(QtWidgets.QFrame):
         self.Hlayout.addWidget(self.start_button)
         self.Hlayout.addWidget(self.record_button)
         self.Hlayout.addWidget(self.stop_button)
+        self.Hlayout.addWidget(self.metrics_button)
         self.Vlayout = QtWidgets.QVBoxLayout(self)
         self.Vlayout.addLayout(self.Hlayout)
+        self.Vlayout.addWidget(self.metrics_text)
         self.Vlayout.addWidget(QFrame(frameShape=QFrame.Shape.HLine, frameShadow=QFrame.Shadow.Sunken))
         self.Vlayout.addWidget(self.signals_plot)
 
@@ -558,8 +603,11 @@ class Setupbox(QtWidgets.QFrame):
             self.status_text.setText("Connecting")
             self.connect_button.setEnabled(False)
             self.acquisition_tab.GUI_main.app.processEvents()
-            self.board = Acquisition_board(serial_port, device_config)
-            self.select_mode(self.acquisition_tab.mode_select.currentText())
+            board_class = Simulated_board if serial_port.startswith(simulated_port_prefix) else Acquisition_board
+            self.board = board_class(serial_port, device_config, threaded=GUI_config.acquisition_thread)
+            with self.board.batch():  # Configure board in a single round trip.
+                self.select_mode(self.acquisition_tab.mode_select.currentText())
+                self.board.set_LED_current(self.current_spinbox_1.value(), self.current_spinbox_2.value())
             self.board.set_sampling_rate(self.acquisition_tab.rate_spinbox.value())
             self.port_select.setEnabled(False)
             self.subject_text.setEnabled(True)
@@ -572,7 +620,6 @@ class Setupbox(QtWidgets.QFrame):
             self.connect_button.setIcon(QtGui.QIcon("GUI/icons/disconnect.svg"))
             self.status_text.setText("Connected")
             self.connect_button.setEnabled(True)
-            self.board.set_LED_current(self.current_spinbox_1.value(), self.current_spinbox_2.value())
             self.current_spinbox_1.valueChanged.connect(lambda v: self.board.set_LED_current(LED_1_current=int(v)))
             self.current_spinbox_2.valueChanged.connect(lambda v: self.board.set_LED_current(LED_2_current=int(v)))
             self.status = Status.STOPPED
@@ -615,6 +662,7 @@ class Setupbox(QtWidgets.QFrame):
         # self.select_mode(self.acquisition_tab.mode_select.currentText())
         self.board.set_sampling_rate(self.acquisition_tab.rate_spinbox.value())
         self.signals_plot.reset(self.board.sampling_rate)
+        self.new_plot_data = []  # Data recieved since plots were last updated.
         self.board.start(self.acquisition_tab.sync_out_config)
         self.status = Status.RUNNING
         self.acquisition_tab.update_status()
@@ -711,16 +759,51 @@ class Setupbox(QtWidgets.QFrame):
 
     def process_data(self):
         # Called regularly while running, read data from the serial port
-        # and update the plot.
+        # and store it until the plot is updated.
         try:
-            new_data = self.board.process_data()
+            new_data = self.board.get_new_data()
         except (PyboardError, SerialException):
             self.disconnect()
             self.status_text.setText("Error")
             raise
             return
-        if new_data:  # Update plots.
-            self.signals_plot.update(new_data)
+        if new_data:
+            self.new_plot_data.append(new_data)
+
+    def update_plot(self):
+        # Called regularly while running to plot data recieved since the last update.
+        if self.new_plot_data:
+            t0 = time.perf_counter()
+            self.signals_plot.update(merge_new_data(self.new_plot_data))
+            self.board.plot_latency.add(time.perf_counter() - t0)
+            self.new_plot_data = []
+        if self.metrics_text.isVisible() and time.monotonic() - self.metrics_update_time > metrics_update_interval:
+            self.update_metrics_text()
+
+    def update_metrics_text(self):
+        """Show the board's data acquisition metrics in the metrics text."""
+        metrics = self.board.get_metrics()
+        latencies = [
+            f"{name} {metrics[key]['p50_ms']:.2f}/{metrics[key]['p99_ms']:.2f}/{metrics[key]['max_ms']:.2f}"
+            for name, key in (("Read", "process_latency"), ("Write", "write_latency"), ("Plot", "plot_latency"))
+        ]
+        clock_drift = ""
+        chunk_timing = metrics["chunk_timing"]
+        if chunk_timing:  # Board sends chunk timestamps.
+            latency = chunk_timing["latency"]
+            latencies.append(f"Chunk {latency['p50_ms']:.2f}/{latency['p99_ms']:.2f}/{latency['max_ms']:.2f}")
+            if chunk_timing["drift_ppm"] is not None:
+                clock_drift = f"   Clock drift: {chunk_timing['drift_ppm']:.1f} ppm"
+        board_overruns = ""
+        if metrics["board_buffers"]:  # Board reports chunks lost as its buffer ring was full.
+            board_overruns = f" (board overruns {metrics['board_overruns']} of {metrics['board_buffers']} buffers)"
+        self.metrics_text.setText(
+            f"Chunks OK: {metrics['chunks_OK']}   Bad checksums: {metrics['bad_checksums']}   "
+            f"Skipped chunks: {metrics['skipped_chunks']}{board_overruns}   Unexpected bytes: {metrics['unexpected_bytes']}   "
+            f"Serial backlog: {metrics['serial_backlog']} (max {metrics['max_serial_backlog']}) bytes   "
+            f"Latency median/99%/max (ms): " + "  ".join(latencies) + clock_drift
+        )
+        self.metrics_update_time = time.monotonic()
 
     def update_setups(self, setup_labels):
         """Update available ports in port_select combobox."""
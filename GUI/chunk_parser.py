@@ -0,0 +1,294 @@
+# Code which runs on host computer and extracts data chunks from the byte stream
+# sent by the pyboard.
+# Copyright (c) Thomas Akam 2018-2025.  Licenced under the GNU General Public License v3.
+
+import time
+import numpy as np
+
+CHUNK_START = 0x07  # Byte indicating start of a data chunk.
+COMPRESSED_CHUNK_START = 0x06  # Byte indicating start of a compressed data chunk.
+_zigzag = np.arange(1 << 16, dtype=np.uint16)
+ZIGZAG_DECODE = (_zigzag >> 1) ^ -(_zigzag & 1)  # Lookup table from zigzag encoded to uint16 deltas.
+
+
+class Chunk_parser:
+    """Class for extracting data chunks from the byte stream sent by the pyboard.  Each
+    chunk is a b'\\x07' start byte followed by the chunk number and checksum as 2 byte
+    integers, then buffer_size 2 byte data samples.  Bytes read from the serial port are
+    appended to a reusable buffer, all complete chunks in the buffer are framed and checked
+    together using numpy, and any partial chunk is kept in the buffer for the next call.
+
+    If compressed_stride is not None, chunks are delta encoded by the pyboard as described in
+    _compress_buffer in photometry_upy.py, with compressed_stride values per sample, and are
+    decoded to the same data as uncompressed chunks.  If timestamps is True the chunk header
+    also contains the time of the chunk's first sample on the pyboard's clock, see
+    Photometry._send_buffer, and the times of chunks extracted by parse are given by
+    self.chunk_times.  If overruns is True the chunk header also contains the number of
+    buffers the pyboard has discarded because its buffer ring was full, after the checksum."""
+
+    def __init__(self, buffer_size, capacity=64, compressed_stride=None, timestamps=False, overruns=False):
+        self.buffer_size = buffer_size  # Number of data samples per chunk.
+        self.overruns = overruns
+        self.timestamp_ind = 3 if overruns else 2  # Index of timestamp in chunk header.
+        self.timestamps = timestamps
+        self.n_header_values = self.timestamp_ind + (2 if timestamps else 0)  # 2 byte integers in chunk header.
+        self.chunk_bytes = 1 + 2 * (self.n_header_values + buffer_size)  # Bytes per chunk including header.
+        self.compressed_stride = compressed_stride
+        if compressed_stride:
+            self.n_deltas = buffer_size - compressed_stride  # Number of delta encoded values per chunk.
+            self.compressed_header_bytes = 2 + 2 * (self.n_header_values + compressed_stride)
+            self._header_offsets = np.arange(self.compressed_header_bytes)
+            self._delta_bits = {}  # {n_bits: (payload byte offsets, bit weights)} used by _decode_chunks.
+        self.buffer = bytearray(capacity * self.chunk_bytes)
+        self.n_bytes = 0  # Number of unprocessed bytes in buffer.
+        self.chunk_number = 0  # Number of last chunk recieved, modulo 2**16.
+        self.n_bytes_read = 0  # Number of bytes read from serial port.
+        self.n_chunks = 0  # Number of chunks recieved with correct checksum.
+        self.n_bad_checksums = 0  # Number of chunks discarded due to incorrect checksum.
+        self.n_skipped_chunks = 0  # Number of chunks missing from the stream.
+        self.n_unexpected_bytes = 0  # Number of bytes recieved outside data chunks.
+        self.n_board_overruns = 0  # Buffers discarded by pyboard as buffer ring full, modulo 2**16.
+        self.gaps = []  # [chunk_number, value_offset, n_values] for skipped chunks in data returned by last parse.
+        self.chunk_times = []  # [value_offset, board_time] for chunks in data returned by last parse (us mod 2**30).
+        self.read_time = None  # Time of last read that recieved bytes (ns, time.time_ns).
+        self.in_waiting = 0  # Bytes waiting on serial port at last read.
+        self.max_in_waiting = 0  # Maximum bytes waiting on serial port at a read.
+
+    def read_serial(self, serial):
+        """Read all bytes waiting on the serial port into the buffer with a single read,
+        return the number of bytes read."""
+        n_waiting = serial.in_waiting
+        self.in_waiting = n_waiting
+        self.max_in_waiting = max(self.max_in_waiting, n_waiting)
+        if n_waiting == 0:
+            return 0
+        self._reserve(n_waiting)
+        n_read = serial.readinto(memoryview(self.buffer)[self.n_bytes : self.n_bytes + n_waiting])
+        self.read_time = time.time_ns()
+        self.n_bytes += n_read
+        self.n_bytes_read += n_read
+        return n_read
+
+    def feed(self, new_bytes):
+        """Append bytes to the buffer."""
+        self._reserve(len(new_bytes))
+        self.buffer[self.n_bytes : self.n_bytes + len(new_bytes)] = new_bytes
+        self.read_time = time.time_ns()
+        self.n_bytes += len(new_bytes)
+        self.n_bytes_read += len(new_bytes)
+
+    def parse(self):
+        """Extract all complete chunks from the buffer.  Returns (data, unexpected_bytes)
+        where data is a uint16 array containing the data from chunks with correct checksum,
+        with skipped chunks replaced by zeros, or None if no chunks were extracted, and
+        unexpected_bytes are any bytes recieved outside of data chunks.  The location of zeros
+        inserted for skipped chunks is given by self.gaps."""
+        self.gaps = []
+        self.chunk_times = []
+        if self.compressed_stride:
+            return self._parse_compressed()
+        if self.chunk_bytes <= self.n_bytes < 2 * self.chunk_bytes and self.buffer[0] == CHUNK_START:
+            return self._parse_single_chunk()
+        data_chunks = []
+        n_values = 0  # Number of data values extracted.
+        unexpected_bytes = []
+        buf = np.frombuffer(self.buffer, dtype=np.uint8, count=self.n_bytes)
+        pos = 0
+        while pos < self.n_bytes:
+            start = self.buffer.find(b"\x07", pos, self.n_bytes)
+            if start == -1:
+                start = self.n_bytes
+            if start > pos:  # Bytes before the start of chunk.
+                unexpected_bytes.append(bytes(self.buffer[pos:start]))
+                pos = start
+            n_complete = (self.n_bytes - start) // self.chunk_bytes
+            if n_complete == 0:  # Only a partial chunk remains.
+                break
+            end = start + n_complete * self.chunk_bytes
+            chunks = buf[start:end].reshape(n_complete, self.chunk_bytes)
+            if n_complete > 1 and self.buffer[start : end : self.chunk_bytes].count(CHUNK_START) < n_complete:
+                # Only use chunks that directly follow each other.
+                chunks = chunks[: np.argmin(chunks[:, 0] == CHUNK_START)]
+            data = self._check_chunks(chunks[:, 1:].copy().view("<u2"), n_values)
+            if data is not None:
+                data_chunks.append(data)
+                n_values += len(data)
+            pos = start + chunks.shape[0] * self.chunk_bytes
+        buf = chunks = None  # Release views of buffer before it is modified.
+        return self._parse_result(pos, data_chunks, unexpected_bytes)
+
+    def _parse_single_chunk(self):
+        """Extract the single complete chunk at the start of the buffer, returns as parse.  This is
+        the usual case when the serial port is read every update_interval, and is handled without
+        the setup cost of framing multiple chunks with numpy."""
+        chunk = np.frombuffer(self.buffer, np.dtype("<u2"), self.n_header_values + self.buffer_size, 1).copy()
+        data = self._check_chunk(chunk)
+        return self._parse_result(self.chunk_bytes, [] if data is None else [data], [])
+
+    def _check_chunk(self, chunk):
+        """Check a single chunk [chunk_number, checksum, data...], returns as _check_chunks,
+        which is only called if the checksum is bad or chunks have been skipped."""
+        chunk_number = int(chunk[0])
+        if (int(chunk[2:].sum(dtype=np.uint64)) & 0xFFFF) == chunk[1] and chunk_number == (
+            self.chunk_number + 1
+        ) & 0xFFFF:
+            self.n_chunks += 1
+            self.chunk_number = chunk_number
+            if self.overruns:
+                self.n_board_overruns = int(chunk[2])
+            if self.timestamps:
+                ti = self.timestamp_ind
+                self.chunk_times.append([0, int(chunk[ti]) | (int(chunk[ti + 1]) << 16)])
+            return chunk[self.n_header_values :]
+        return self._check_chunks(chunk.reshape(1, -1), 0)
+
+    def _parse_compressed(self):
+        """Extract and decode all complete compressed chunks from the buffer, returns as parse.
+        Compressed chunks vary in length so are framed one at a time, then decoded and checked
+        together."""
+        starts, n_bits = [], []  # Start position and bits per delta of each complete chunk.
+        unexpected_bytes = []
+        pos = 0
+        while pos < self.n_bytes:
+            start = self.buffer.find(b"\x06", pos, self.n_bytes)
+            if start == -1:
+                start = self.n_bytes
+            if start > pos:  # Bytes before the start of chunk.
+                unexpected_bytes.append(bytes(self.buffer[pos:start]))
+                pos = start
+            if self.n_bytes - start < self.compressed_header_bytes:  # Only a partial chunk remains.
+                break
+            chunk_bits = self.buffer[start + 1 + 2 * self.n_header_values]
+            if chunk_bits > 16:  # Not a chunk header.
+                unexpected_bytes.append(bytes(self.buffer[start : start + 1]))
+                pos = start + 1
+                continue
+            chunk_end = start + self.compressed_header_bytes + (self.n_deltas * chunk_bits + 7) // 8
+            if chunk_end > self.n_bytes:
+                break
+            starts.append(start)
+            n_bits.append(chunk_bits)
+            pos = chunk_end
+        data_chunks = []
+        if starts:
+            chunks = self._decode_chunks(starts, n_bits)
+            data = self._check_chunk(chunks[0]) if len(starts) == 1 else self._check_chunks(chunks, 0)
+            if data is not None:
+                data_chunks.append(data)
+        return self._parse_result(pos, data_chunks, unexpected_bytes)
+
+    def _decode_chunks(self, starts, n_bits):
+        """Decode the compressed chunks starting at positions starts in the buffer, with n_bits
+        bits per delta, return a 2D uint16 array with one row [chunk_number, checksum, data...]
+        per chunk as for uncompressed chunks.  Chunks with the same n_bits are decoded together."""
+        n_chunks, stride, n_header = len(starts), self.compressed_stride, self.n_header_values
+        buf = np.frombuffer(self.buffer, np.uint8, self.n_bytes)
+        starts = np.array(starts)[:, None]
+        headers = buf[starts + self._header_offsets]
+        chunks = np.empty((n_chunks, n_header + self.buffer_size), dtype=np.dtype("<u2"))
+        chunks[:, :n_header] = headers[:, 1 : 1 + 2 * n_header].copy().view("<u2")
+        values = chunks[:, n_header:].reshape(n_chunks, -1, stride)  # [chunk, sample, value], view of chunks.
+        values[:, 0] = headers[:, 2 + 2 * n_header :].copy().view("<u2")  # First sample.
+        bit_widths = set(n_bits)
+        for chunk_bits in bit_widths:
+            group = slice(None) if len(bit_widths) == 1 else np.array(n_bits) == chunk_bits
+            if chunk_bits == 0:  # All values equal to first sample.
+                values[group, 1:] = 0
+                continue
+            if chunk_bits not in self._delta_bits:  # Payload byte offsets and bit weights.
+                n_bytes = (self.n_deltas * chunk_bits + 7) // 8
+                self._delta_bits[chunk_bits] = (
+                    self.compressed_header_bytes + np.arange(n_bytes),
+                    1 << np.arange(chunk_bits, dtype=np.uint16),
+                )
+            payload_offsets, weights = self._delta_bits[chunk_bits]
+            payload = buf[starts[group] + payload_offsets]
+            bits = np.unpackbits(payload, axis=1, bitorder="little")[:, : self.n_deltas * chunk_bits]
+            zigzag = bits.reshape(payload.shape[0], self.n_deltas, chunk_bits) @ weights
+            values[group, 1:] = ZIGZAG_DECODE[zigzag].reshape(payload.shape[0], -1, stride)
+        buf = None  # Release view of buffer before it is modified.
+        np.cumsum(values, axis=1, dtype=np.uint16, out=values)  # Deltas are between values stride apart.
+        return chunks
+
+    def _parse_result(self, pos, data_chunks, unexpected_bytes):
+        """Move any partial chunk after pos to start of buffer, return (data, unexpected_bytes)."""
+        n_remaining = self.n_bytes - pos
+        self.buffer[:n_remaining] = self.buffer[pos : self.n_bytes]
+        self.n_bytes = n_remaining
+        if not data_chunks:
+            data = None
+        elif len(data_chunks) == 1:
+            data = data_chunks[0]
+        else:
+            data = np.hstack(data_chunks)
+        unexpected_bytes = b"".join(unexpected_bytes)
+        self.n_unexpected_bytes += len(unexpected_bytes)
+        return data, unexpected_bytes
+
+    def _check_chunks(self, chunks, value_offset):
+        """Check checksums and chunk numbers of a 2D uint16 array of consecutive chunks (one row
+        per chunk, [chunk_number, checksum, data...]), return the data from good chunks with zeros
+        inserted for skipped chunks.  Skipped chunks are added to self.gaps and chunk timestamps
+        to self.chunk_times, with offsets from value_offset."""
+        checksum_OK = (chunks[:, 2:].sum(axis=1, dtype=np.uint64) & 0xFFFF) == chunks[:, 1]
+        n_bad_checksums = chunks.shape[0] - int(np.count_nonzero(checksum_OK))
+        if n_bad_checksums:
+            self.n_bad_checksums += n_bad_checksums
+            chunks = chunks[checksum_OK]
+            if chunks.shape[0] == 0:
+                return None
+        self.n_chunks += chunks.shape[0]
+        if self.overruns:
+            self.n_board_overruns = int(chunks[-1, 2])
+        chunk_numbers = chunks[:, 0].tolist()
+        data = chunks[:, self.n_header_values :]
+        if chunk_numbers == [(self.chunk_number + i) & 0xFFFF for i in range(1, len(chunk_numbers) + 1)]:
+            # No chunks skipped.
+            self.chunk_number = chunk_numbers[-1]
+            if self.timestamps:
+                self._add_chunk_times(chunks, value_offset + np.arange(chunks.shape[0]) * self.buffer_size)
+            return data.ravel()
+        # Number of chunks skipped before each chunk, using rollover safe subtraction.
+        chunk_numbers = np.array(chunk_numbers, dtype=np.int64)
+        prev_chunk_numbers = np.hstack([self.chunk_number, chunk_numbers[:-1]])
+        n_skipped = ((chunk_numbers - prev_chunk_numbers - 1 + 0x8000) & 0xFFFF) - 0x8000
+        if np.all(n_skipped >= 0):
+            self.chunk_number = int(chunk_numbers[-1])
+        else:  # Chunk numbers out of order, track chunk number sequentially.
+            for i, recieved_chunk_number in enumerate(chunk_numbers):
+                self.chunk_number = (self.chunk_number + 1) & 0xFFFF
+                n_skipped[i] = ((recieved_chunk_number - self.chunk_number + 0x8000) & 0xFFFF) - 0x8000
+                if n_skipped[i] > 0:
+                    self.chunk_number = (self.chunk_number + int(n_skipped[i])) & 0xFFFF
+            n_skipped = np.maximum(n_skipped, 0)
+        rows = np.arange(data.shape[0]) + np.cumsum(n_skipped)  # Row of each chunk in padded data.
+        self._add_chunk_times(chunks, value_offset + rows * self.buffer_size)
+        if n_skipped.any():  # Insert zeros in place of skipped chunks.
+            self.n_skipped_chunks += int(np.sum(n_skipped))
+            padded = np.zeros((rows[-1] + 1, self.buffer_size), dtype=np.dtype("<u2"))
+            padded[rows] = data
+            data = padded
+            for i in np.flatnonzero(n_skipped):  # Record each run of skipped chunks.
+                self.gaps.append(
+                    [
+                        int(chunk_numbers[i] - n_skipped[i]) & 0xFFFF,  # Number of first skipped chunk.
+                        value_offset + int(rows[i] - n_skipped[i]) * self.buffer_size,
+                        int(n_skipped[i]) * self.buffer_size,
+                    ]
+                )
+        return data.ravel()
+
+    def _add_chunk_times(self, chunks, value_offsets):
+        """Add the value offset and timestamp of each chunk to self.chunk_times."""
+        if self.timestamps:
+            ti = self.timestamp_ind
+            board_times = chunks[:, ti].astype(np.int64) | (chunks[:, ti + 1].astype(np.int64) << 16)
+            self.chunk_times += np.column_stack([value_offsets, board_times]).tolist()
+
+    def _reserve(self, n_new_bytes):
+        """Grow the buffer if needed so that n_new_bytes can be appended."""
+        required = self.n_bytes + n_new_bytes
+        if required > len(self.buffer):
+            new_buffer = bytearray(max(required, 2 * len(self.buffer)))
+            new_buffer[: self.n_bytes] = self.buffer[: self.n_bytes]
+            self.buffer = new_buffer
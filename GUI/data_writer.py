@@ -0,0 +1,190 @@
+# Code which runs on host computer and writes data to disk in a background thread.
+# Copyright (c) Thomas Akam 2018-2025.  Licenced under the GNU General Public License v3.
+
+import os
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+# Lookup tables used to convert integers to text for CSV files.
+_csv_max_digits = 5  # Enough digits for any 16 bit integer.
+_csv_values = np.arange(1 << 16)
+_csv_n_digits = np.maximum(np.floor(np.log10(np.maximum(_csv_values, 1))).astype(int) + 1, 1)
+_csv_digits = (  # ASCII digits of each value, right aligned.
+    48 + (_csv_values[:, None] // 10 ** np.arange(_csv_max_digits - 1, -1, -1)) % 10
+).astype(np.uint8)
+_csv_digit_mask = np.arange(_csv_max_digits) >= (_csv_max_digits - _csv_n_digits[:, None])  # Digits to keep.
+
+
+def encode_csv(values, newline=os.linesep):
+    """Convert a 2D array of integers in the range 0 - 65535 to CSV text with one row per line,
+    matching the output of np.savetxt(file, values, fmt="%d", delimiter=",") to a text mode
+    file, return as bytes.  All digits and separators are written into a single array and the
+    unused bytes removed with a boolean mask, rather than formatting each number seperately."""
+    values = np.asarray(values, dtype=np.uint16)
+    n_rows, n_cols = values.shape
+    newline = newline.encode()
+    fields = np.empty((n_rows, n_cols, _csv_max_digits + len(newline)), dtype=np.uint8)
+    fields[:, :, :_csv_max_digits] = _csv_digits[values]
+    fields[:, :-1, _csv_max_digits] = ord(",")
+    fields[:, -1, _csv_max_digits:] = np.frombuffer(newline, dtype=np.uint8)
+    keep = np.zeros(fields.shape, dtype=bool)
+    keep[:, :, :_csv_max_digits] = _csv_digit_mask[values]
+    keep[:, :-1, _csv_max_digits] = True  # Delimiters.
+    keep[:, -1, _csv_max_digits:] = True  # Newline.
+    return fields[keep].tobytes()
+
+
+class Data_writer:
+    """Class for writing data to a file from a background thread, so that slow disk
+    writes do not hold up reading data from the board.  Data passed to write() is copied
+    into fixed size blocks from a preallocated pool, full blocks are passed to the writer
+    thread which writes each block to the file with a single call, then returns it to the
+    pool.  Partially filled blocks are passed to the writer thread after max_block_age
+    seconds.  If all blocks are waiting to be written, new blocks are allocated rather than
+    waiting for the disk.  The file is flushed to disk every fsync_interval seconds.  If a
+    Latency_histogram is passed as write_latency the duration of each write is added to it.
+    If gaps_path is provided, records of chunks missing from the data file passed to add_gaps
+    are saved to a JSON file at gaps_path by the writer thread."""
+
+    def __init__(
+        self,
+        file,
+        block_size=1 << 16,
+        n_blocks=16,
+        max_block_age=1,
+        fsync_interval=5,
+        write_latency=None,
+        gaps_path=None,
+    ):
+        self.file = file
+        self.block_size = block_size  # Bytes.
+        self.max_block_age = max_block_age  # Seconds.
+        self.fsync_interval = fsync_interval  # Seconds, None to only flush to disk on close.
+        self.free_blocks = queue.SimpleQueue()  # Blocks available to copy data into.
+        for i in range(n_blocks - 1):
+            self.free_blocks.put(bytearray(block_size))
+        self.write_queue = queue.SimpleQueue()  # Blocks waiting to be written, (block, n_bytes), or gap records.
+        self.block = bytearray(block_size)  # Block currently being filled.
+        self.block_fill = 0  # Number of bytes in current block.
+        self.block_time = time.monotonic()  # Time when current block was started.
+        self.n_blocks_allocated = n_blocks  # Blocks allocated including any added when pool was empty.
+        self.bytes_written = 0
+        self.n_writes = 0
+        self.write_time_total = 0  # Seconds.
+        self.write_time_max = 0  # Seconds.
+        self.last_write_time = 0  # Seconds.
+        self.write_latency = write_latency
+        self.write_error = None  # Exception raised in writer thread.
+        self.gaps_path = gaps_path
+        self.gaps = []  # [chunk_number, sample_offset, n_samples] for each run of missing chunks, writer thread only.
+        self.last_fsync = time.monotonic()
+        self.thread = threading.Thread(target=self._writer_loop, name="data writer", daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        """Copy data (bytes-like or contiguous numpy array) into blocks for writing to file."""
+        if self.write_error:
+            raise self.write_error
+        data = memoryview(data).cast("B")
+        pos = 0
+        while pos < len(data):
+            n_bytes = min(len(data) - pos, self.block_size - self.block_fill)
+            self.block[self.block_fill : self.block_fill + n_bytes] = data[pos : pos + n_bytes]
+            self.block_fill += n_bytes
+            pos += n_bytes
+            if self.block_fill == self.block_size:
+                self._queue_block()
+        if self.block_fill and time.monotonic() - self.block_time > self.max_block_age:
+            self._queue_block()
+
+    def add_gaps(self, gaps):
+        """Add [chunk_number, sample_offset, n_samples] records of runs of chunks missing from
+        the data file to the gaps file, which is rewritten by the writer thread."""
+        self.write_queue.put(list(gaps))
+
+    def flush(self):
+        """Pass the partially filled block to the writer thread."""
+        if self.block_fill:
+            self._queue_block()
+
+    def close(self):
+        """Write all remaining data to file, flush file to disk and stop writer thread.
+        The file itself is not closed."""
+        self.flush()
+        self.write_queue.put(None)  # Tells writer thread to exit.
+        self.thread.join()
+        if self.write_error:
+            raise self.write_error
+
+    def get_stats(self):
+        """Return a dict of statistics on the writer's performance."""
+        return {
+            "queue_depth": self.write_queue.qsize(),  # Blocks waiting to be written.
+            "blocks_allocated": self.n_blocks_allocated,
+            "bytes_written": self.bytes_written,
+            "last_write_ms": 1000 * self.last_write_time,
+            "mean_write_ms": 1000 * self.write_time_total / self.n_writes if self.n_writes else 0,
+            "max_write_ms": 1000 * self.write_time_max,
+        }
+
+    def _queue_block(self):
+        self.write_queue.put((self.block, self.block_fill))
+        try:
+            self.block = self.free_blocks.get_nowait()
+        except queue.Empty:  # All blocks waiting to be written, allocate a new one.
+            self.block = bytearray(self.block_size)
+            self.n_blocks_allocated += 1
+        self.block_fill = 0
+        self.block_time = time.monotonic()
+
+    def _writer_loop(self):
+        """Called in writer thread to write queued blocks to file."""
+        if self.gaps_path:
+            self._write_gaps([])
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            if isinstance(item, list):  # Gap records from add_gaps.
+                self._write_gaps(item)
+                continue
+            block, n_bytes = item
+            try:
+                t0 = time.perf_counter()
+                self.file.write(memoryview(block)[:n_bytes])
+                if self.fsync_interval is not None and time.monotonic() - self.last_fsync > self.fsync_interval:
+                    self._fsync()
+                self.last_write_time = time.perf_counter() - t0
+            except Exception as e:  # Raised in main thread on next call to write or close.
+                self.write_error = e
+            self.bytes_written += n_bytes
+            self.n_writes += 1
+            self.write_time_total += self.last_write_time
+            self.write_time_max = max(self.write_time_max, self.last_write_time)
+            if self.write_latency:
+                self.write_latency.add(self.last_write_time)
+            self.free_blocks.put(block)
+        try:
+            self._fsync()
+        except Exception as e:
+            self.write_error = e
+
+    def _write_gaps(self, new_gaps):
+        """Write all gap records to the gaps file, replacing the file atomically so it is always
+        complete."""
+        self.gaps += new_gaps
+        try:
+            temp_path = self.gaps_path.with_suffix(".tmp")
+            with open(temp_path, "w") as f:
+                json.dump({"columns": ["chunk_number", "sample_offset", "n_samples"], "gaps": self.gaps}, f)
+            os.replace(temp_path, self.gaps_path)
+        except Exception as e:  # Raised in main thread on next call to write or close.
+            self.write_error = e
+
+    def _fsync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_fsync = time.monotonic()
@@ -0,0 +1,93 @@
+# Code which runs on host computer and records statistics on the performance of data acquisition.
+# Copyright (c) Thomas Akam 2018-2025.  Licenced under the GNU General Public License v3.
+
+import math
+import numpy as np
+from collections import deque
+
+
+class Latency_histogram:
+    """Histogram of durations with logarithmically spaced bins, bins_per_octave bins for each
+    doubling of duration from min_duration.  Adding a duration is constant time and memory use
+    is fixed, so durations can be recorded every time an operation runs.  Percentiles are
+    estimated as the upper edge of the bin containing the percentile."""
+
+    def __init__(self, min_duration=1e-6, bins_per_octave=8, n_octaves=30):
+        self.min_duration = min_duration  # Seconds.
+        self.bins_per_octave = bins_per_octave
+        self.counts = np.zeros(bins_per_octave * n_octaves, dtype=np.int64)
+        self.bin_edges = min_duration * 2 ** (np.arange(1, len(self.counts) + 1) / bins_per_octave)  # Upper.
+        self.n = 0
+        self.total = 0  # Seconds.
+        self.max = 0  # Seconds.
+
+    def add(self, duration):
+        """Record a duration in seconds."""
+        if duration > self.min_duration:
+            bin_ind = min(int(math.log2(duration / self.min_duration) * self.bins_per_octave), len(self.counts) - 1)
+        else:
+            bin_ind = 0
+        self.counts[bin_ind] += 1
+        self.n += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, p):
+        """Return an estimate of the p'th percentile duration in seconds, 0 if no durations recorded."""
+        if not self.n:
+            return 0
+        bin_ind = np.searchsorted(np.cumsum(self.counts), p / 100 * self.n)
+        return min(float(self.bin_edges[bin_ind]), self.max)
+
+    def summary(self):
+        """Return a dict of statistics in milliseconds."""
+        return {
+            "count": self.n,
+            "mean_ms": 1000 * self.total / self.n if self.n else 0,
+            "p50_ms": 1000 * self.percentile(50),
+            "p99_ms": 1000 * self.percentile(99),
+            "max_ms": 1000 * self.max,
+        }
+
+
+class Chunk_timing:
+    """Statistics of when data chunks arrive at the host computer relative to when they were
+    acquired, using the time of each chunk's first sample on the board's clock.  As the two
+    clocks have an unknown offset, latency is measured relative to the minimum latency of the
+    preceding window_size chunks, which also removes slow clock drift.  Drift between the board
+    and host clocks is estimated by a least squares fit of host time against board time."""
+
+    def __init__(self, window_size=1000):
+        self.latency = Latency_histogram()
+        self.window = deque(maxlen=window_size)  # (chunk_index, offset) with increasing offsets.
+        self.n = 0
+        self.first_times = None  # (board_time, host_time) of first chunk (seconds).
+        self.sums = np.zeros(5)  # Sums of x, y, x*x, x*y, where x, y are board, host time from first chunk.
+
+    def add(self, board_time, host_time):
+        """Record the board and host times of a chunk in seconds."""
+        if self.first_times is None:
+            self.first_times = (board_time, host_time)
+        x = board_time - self.first_times[0]
+        y = host_time - self.first_times[1]
+        self.sums += (1, x, y, x * x, x * y)
+        offset = y - x
+        while self.window and self.window[-1][1] >= offset:  # Sliding window minimum.
+            self.window.pop()
+        self.window.append((self.n, offset))
+        if self.window[0][0] <= self.n - self.window.maxlen:
+            self.window.popleft()
+        self.latency.add(offset - self.window[0][1])
+        self.n += 1
+
+    def drift_ppm(self):
+        """Return the rate of the board clock relative to the host clock minus 1, in parts
+        per million, or None if not enough chunks have been recorded."""
+        n, x, y, xx, xy = self.sums
+        if n < 2 or n * xy - x * y <= 0:
+            return None
+        return 1e6 * float((n * xx - x * x) / (n * xy - x * y) - 1)  # Inverse of slope of host vs board time.
+
+    def summary(self):
+        """Return a dict of statistics, latency in milliseconds."""
+        return {"drift_ppm": self.drift_ppm(), "latency": self.latency.summary()}
@@ -3,28 +3,47 @@
 
 import numpy as np
 import pyqtgraph as pg
+from collections import deque
 from datetime import datetime
 from pyqtgraph.Qt import QtGui, QtCore, QtWidgets
 from pyqtgraph.Qt.QtWidgets import QFrame
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, sosfilt, sosfilt_zi
 
-from config.GUI_config import history_dur, triggered_dur, max_plot_pulses
+from config.GUI_config import (
+    history_dur,
+    triggered_dur,
+    triggered_heatmap_events,
+    max_plot_pulses,
+    lowpass_zero_phase_dur,
+    plot_decimation,
+)
 
 # Signals_plot ------------------------------------------------------
 
 
 class Signals_plot(QtWidgets.QWidget):
 
-    """Class for plotting data from one setup."""
+    """Class for plotting data from one setup.  If plot_layout (a pg.GraphicsLayoutWidget) is
+    provided the signals are plotted in a row of the layout, so the signals from all setups are
+    drawn by a single widget, otherwise they are plotted in a widget of their own.  In a shared
+    layout the signals are plotted directly with array backed PlotCurveItems, without the
+    PlotDataItem wrapper which processes the data again at every update before passing it to
+    its own PlotCurveItem."""
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, plot_layout=None):
         super(QtWidgets.QWidget, self).__init__(parent)
         self.parent = parent
+        self.plot_layout = plot_layout
 
         # Create axis
-        self.axis = pg.PlotWidget(title="Analog signal", labels={"left": "Volts"})
+        if plot_layout is None:
+            self.axis = pg.PlotWidget(title="Analog signal", labels={"left": "Volts"})
+            self.axis.getPlotItem().setMenuEnabled(False)
+        else:
+            plot_layout.nextRow()
+            self.axis = plot_layout.addPlot(title="Analog signal", labels={"left": "Volts"})
+            self.axis.setMenuEnabled(False)
         self.axis.setMouseEnabled(x=False, y=False)
-        self.axis.getPlotItem().setMenuEnabled(False)
         self.axis.disableAutoRange()
         self.legend = self.axis.addLegend(offset=(10, 10))
         self.axis.setYRange(-0.1, 3.3, padding=0)
@@ -32,16 +51,14 @@ class Signals_plot(QtWidgets.QWidget):
         self.axis.setLimits(xMin=-history_dur, xMax=0.2)
 
         # Plotting classes
-        self.plots = [
-            self.axis.plot(pen=pg.mkPen("g"), name="analog 1"),
-            self.axis.plot(pen=pg.mkPen("r"), name="analog 2"),
-        ]
+        self.plots = [self._add_curve("g", "analog 1"), self._add_curve("r", "analog 2")]
         self.DI_shaders = [
             Pulse_shader(self.axis, brush=(0, 0, 225, 80)),
             Pulse_shader(self.axis, brush=(225, 225, 0, 80)),
         ]
         self.event_triggered_plot = Event_triggered_plot(self)
         self.event_triggered_plot.axis.setVisible(False)
+        self.event_triggered_plot.heatmap_axis.setVisible(False)
         self.info_overlay = Info_overlay(self.axis)
 
         # Create controls
@@ -79,6 +96,11 @@ class Signals_plot(QtWidgets.QWidget):
         self.lowpass_checkbox.setCheckable(True)
         self.etp_checkbox = QtWidgets.QCheckBox("Event triggered plot")
         self.etp_checkbox.stateChanged.connect(self.show_hide_event_triggered_plot)
+        self.etp_trigger_select = QtWidgets.QComboBox()
+        self.etp_trigger_select.addItems(["DI 1", "DI 2"])
+        self.etp_trigger_select.currentIndexChanged.connect(self.event_triggered_plot.set_trigger)
+        self.etp_heatmap_checkbox = QtWidgets.QCheckBox("Heatmap")
+        self.etp_heatmap_checkbox.stateChanged.connect(self.show_hide_event_triggered_plot)
         self.controls_layout = QtWidgets.QHBoxLayout()
         self.controls_layout.addWidget(self.yrange_label)
         self.controls_layout.addWidget(self.fullrange_button)
@@ -95,21 +117,39 @@ class Signals_plot(QtWidgets.QWidget):
         self.controls_layout.addWidget(self.offset_spinbox)
         self.controls_layout.addWidget(QFrame(frameShape=QFrame.Shape.VLine, frameShadow=QFrame.Shadow.Sunken))
         self.controls_layout.addWidget(self.etp_checkbox)
+        self.controls_layout.addWidget(self.etp_trigger_select)
+        self.controls_layout.addWidget(self.etp_heatmap_checkbox)
         self.controls_layout.addStretch()
 
         self.enable_disable_demean_mode()
+        self.show_hide_event_triggered_plot()
 
         # Main layout
         self.vertical_layout = QtWidgets.QVBoxLayout()
         self.vertical_layout.setContentsMargins(0, 0, 0, 0)
         self.vertical_layout.addLayout(self.controls_layout)
-        self.vertical_layout.addWidget(self.axis)
+        if plot_layout is None:
+            self.vertical_layout.addWidget(self.axis)
         self.vertical_layout.addWidget(self.event_triggered_plot.axis)
+        self.vertical_layout.addWidget(self.event_triggered_plot.heatmap_axis)
         self.setLayout(self.vertical_layout)
 
+    def remove_from_layout(self):
+        # Remove axis from shared plot layout when setup is removed.
+        if self.plot_layout is not None:
+            self.plot_layout.removeItem(self.axis)
+
+    def _add_curve(self, color, name):
+        # Add a curve for plotting an analog signal to the axis.
+        if self.plot_layout is None:
+            return self.axis.plot(pen=pg.mkPen(color), name=name)
+        curve = pg.PlotCurveItem(pen=pg.mkPen(color), name=name)
+        self.axis.addItem(curve)
+        return curve
+
     def set_n_signals(self, n_analog_signals):
         if len(self.plots) == 2 and n_analog_signals == 3:
-            self.plots.append(self.axis.plot(pen=pg.mkPen("m"), name="analog 3"))
+            self.plots.append(self._add_curve("m", "analog 3"))
         elif len(self.plots) == 3 and n_analog_signals == 2:
             self.axis.removeItem(self.plots.pop(-1))
 
@@ -117,9 +157,9 @@ class Signals_plot(QtWidgets.QWidget):
         history_length = int(sampling_rate * history_dur)
         self.autoscale_next_update = False
         self.signals = [
-            Signal_history(history_length),
-            Signal_history(history_length),
-            Signal_history(history_length),
+            Signal_history(history_length, min_max=True),
+            Signal_history(history_length, min_max=True),
+            Signal_history(history_length, min_max=True),
         ]
         self.DIs = [
             Signal_history(history_length, int),
@@ -129,41 +169,70 @@ class Signals_plot(QtWidgets.QWidget):
 
         self.DI_shaders[0].reset(self.DIs[0], self.x)
         self.DI_shaders[1].reset(self.DIs[1], self.x)
-        self.event_triggered_plot.reset(sampling_rate)
+        self.event_triggered_plot.reset(sampling_rate, len(self.plots))
         if sampling_rate > 50:
-            self.filter_BA = butter(2, 10, "low", fs=sampling_rate)
+            self.filter_sos = butter(2, 10, "low", fs=sampling_rate, output="sos")
+            self.filter_unit_zi = sosfilt_zi(self.filter_sos)  # Steady state filter state for unit input.
+            self.filter_zi = [None, None, None]  # Filter state for each signal.
+            self.filtered_signals = [Signal_history(history_length, min_max=True) for i in range(3)]  # Causal.
+            self.zero_phase_samples = min(int(sampling_rate * lowpass_zero_phase_dur), history_length)
+            self.zero_phase_signals = [Signal_history(history_length, min_max=True) for i in range(3)]
             self.lowpass_checkbox.setEnabled(True)
         else:
+            self.filter_sos = None
             self.lowpass_checkbox.setChecked(False)
             self.lowpass_checkbox.setEnabled(False)
 
     def update(self, new_data):
         new_signals, new_DIs, new_clipping_high, new_clipping_low = new_data
         new_signals = [3.3 * new_signal / (1 << 15) for new_signal in new_signals]  # Convert to Volts.
-        for i, new_signal in enumerate(new_signals):
-            self.signals[i].update(new_signal)
-            if self.AC_mode:  # Plot signals with mean removed.
-                y = (
-                    self.signals[i].history
-                    - np.nanmean(self.signals[i].history)
-                    - i * self.offset_spinbox.value() / 1000
-                )
+        # Update histories in sections short enough that event triggered plot does not miss events.
+        section_len = self.event_triggered_plot.max_update_len
+        for start in range(0, len(new_signals[0]), section_len):
+            for i, new_signal in enumerate(new_signals):
+                self.signals[i].update(new_signal[start : start + section_len])
+                if self.filter_sos is not None:  # Filter new data even if not plotted so history is available.
+                    self.filter_new_data(i, new_signal[start : start + section_len])
+            for i, new_DI in enumerate(new_DIs):
+                self.DIs[i].update(new_DI[start : start + section_len])
+                self.DI_shaders[i].update(len(new_DI[start : start + section_len]))
+            self.event_triggered_plot.update(len(new_signals[0][start : start + section_len]))
+        # Plot signals.
+        for i in range(len(new_signals)):
+            if self.lowpass_checkbox.isChecked():  # Plot lowpass filtered signal.
+                signal = self.zero_phase_signals[i] if self.zero_phase_samples else self.filtered_signals[i]
             else:
-                y = self.signals[i].history
-            if self.lowpass_checkbox.isChecked():  # Lowpass filter signal
-                if np.any(np.isnan(y)):
-                    y[np.isnan(y)] = 0
-                y = filtfilt(*self.filter_BA, y)
-            self.plots[i].setData(self.x, y)
-        for i, new_DI in enumerate(new_DIs):
-            self.DIs[i].update(new_DI)
-            self.DI_shaders[i].update()
-        self.event_triggered_plot.update(len(new_signals[0]))
+                signal = self.signals[i]
+            x, y = self.x, signal.history
+            if plot_decimation:  # Plot minimum and maximum of signal in bins of ~1 pixel.
+                decimated = signal.min_max.decimated(int(self.axis.getViewBox().width()))
+                if decimated is not None:
+                    inds, y = decimated
+                    x = self.x[inds]
+            if self.AC_mode:  # Plot signals with mean removed.
+                y = y - np.nanmean(signal.history) - i * self.offset_spinbox.value() / 1000
+            # Once the history is full it contains no NaNs so pyqtgraph need not check for them.
+            self.plots[i].setData(x, y, skipFiniteCheck=signal.n_samples >= signal.history_length)
         if self.autoscale_next_update:
             self.autoscale()
             self.autoscale_next_update = False
         self.info_overlay.update(new_clipping_high, new_clipping_low)
 
+    def filter_new_data(self, i, new_signal):
+        """Lowpass filter the new samples of signal i with a causal filter whose state is kept
+        between updates, so only new samples are filtered.  The most recent zero_phase_samples
+        samples are then filtered backwards, giving zero phase filtering of the recent signal
+        where the delay of the causal filter would be visible."""
+        if self.filter_zi[i] is None:  # Initialise filter state to steady state for first sample.
+            self.filter_zi[i] = self.filter_unit_zi * new_signal[0]
+        filtered, self.filter_zi[i] = sosfilt(self.filter_sos, new_signal, zi=self.filter_zi[i])
+        self.filtered_signals[i].update(filtered)
+        if self.zero_phase_samples:
+            self.zero_phase_signals[i].update(filtered)
+            recent = self.filtered_signals[i].history[-self.zero_phase_samples :]
+            zi = self.filter_unit_zi * recent[-1]
+            self.zero_phase_signals[i].overwrite_recent(sosfilt(self.filter_sos, recent[::-1], zi=zi)[0][::-1])
+
     def enable_disable_demean_mode(self):
         if self.demean_checkbox.isChecked():
             self.AC_mode = True
@@ -177,10 +246,13 @@ class Signals_plot(QtWidgets.QWidget):
             self.autoscale_next_update = True
 
     def show_hide_event_triggered_plot(self):
-        if self.etp_checkbox.isChecked():
-            self.event_triggered_plot.axis.setVisible(True)
-        else:
-            self.event_triggered_plot.axis.setVisible(False)
+        show_etp = self.etp_checkbox.isChecked()
+        self.event_triggered_plot.axis.setVisible(show_etp)
+        self.event_triggered_plot.heatmap_axis.setVisible(show_etp and self.etp_heatmap_checkbox.isChecked())
+        self.etp_trigger_select.setEnabled(show_etp)
+        self.etp_heatmap_checkbox.setEnabled(show_etp)
+        if self.event_triggered_plot.heatmap_axis.isVisibleTo(self):
+            self.event_triggered_plot.update_heatmap()
 
     def autoscale(self):
         """Set the Y axis ranges to show all the data"""
@@ -207,37 +279,50 @@ class Signals_plot(QtWidgets.QWidget):
 
 
 class Pulse_shader:
-    """Class for plotting pulses as shaded regions on Signals_plot."""
+    """Class for plotting pulses as shaded regions on Signals_plot.  Rising and falling edges are
+    found only in the new samples of the digital input at each update, and the start and end
+    sample numbers of recent pulses are kept so the shaded regions can be moved as time passes
+    without searching the whole history for edges."""
 
     def __init__(self, axis, brush):
         self.axis = axis
-        self.pulses = []
+        self.pulses = []  # Shaded regions.
         self.brush = brush
 
     def reset(self, DI, x):
         self.DI = DI
         self.x = x
+        self.pulse_samples = deque(maxlen=max_plot_pulses)  # [start, end] sample numbers, end None if ongoing.
         for pulse in self.pulses:
             self.axis.removeItem(pulse)
         self.pulses = []
 
-    def update(self):
-        pulse_starts = self.x[np.where(np.diff(self.DI.history) == 1)[0] + 1]
-        pulse_ends = self.x[np.where(np.diff(self.DI.history) == -1)[0] + 1]
-        if self.DI.history[0] == 1:
-            pulse_starts = np.hstack([self.x[0], pulse_starts])
-        if self.DI.history[-1] == 1:
-            pulse_ends = np.hstack([pulse_ends, self.x[-1]])
-        pulse_times = list(zip(pulse_starts, pulse_ends))[-max_plot_pulses:]  # Limit number of pulses to show.
-        for i, (pulse_start, pulse_end) in enumerate(pulse_times):
+    def update(self, new_data_len):
+        # Find edges in new samples, using previous sample to detect edge on first new sample.
+        new_data_len = min(new_data_len, self.DI.history_length - 1)
+        edges = np.diff(self.DI.history[-new_data_len - 1 :])
+        first_new_sample = self.DI.n_samples - new_data_len
+        for edge_ind in np.nonzero(edges)[0]:
+            if edges[edge_ind] == 1:  # Pulse start.
+                self.pulse_samples.append([first_new_sample + edge_ind, None])
+            elif self.pulse_samples:  # Pulse end.
+                self.pulse_samples[-1][1] = first_new_sample + edge_ind
+        # Remove pulses that have left the plot.
+        history_start = self.DI.n_samples - self.DI.history_length  # Sample number of first sample in history.
+        while self.pulse_samples and self.pulse_samples[0][1] is not None and self.pulse_samples[0][1] <= history_start:
+            self.pulse_samples.popleft()
+        # Move shaded regions to location of pulses.
+        for i, (start_sample, end_sample) in enumerate(self.pulse_samples):
+            pulse_start = self.x[max(start_sample - history_start, 0)]
+            pulse_end = self.x[-1] if end_sample is None else self.x[end_sample - history_start]
             try:  # Update location of existing pulses.
                 self.pulses[i].setRegion([pulse_start, pulse_end])
             except IndexError:  # Create new pulses.
                 pulse = pg.LinearRegionItem([pulse_start, pulse_end], brush=self.brush, pen=(0, 0, 0, 0), movable=False)
                 self.pulses.append(pulse)
                 self.axis.addItem(pulse)
-        if len(self.pulses) > len(pulse_starts):  # Hide unused pulses.
-            for pulse in self.pulses[len(pulse_starts) :]:
+        for pulse in self.pulses[len(self.pulse_samples) :]:  # Hide unused pulses.
+            if pulse.getRegion() != (0, 0):
                 pulse.setRegion([0, 0])
 
 
@@ -245,56 +330,248 @@ class Pulse_shader:
 
 
 class Event_triggered_plot:
-    def __init__(self, signals_plot, tau=5):
+    """Class for plotting signals around rising edges of the digital inputs.  For each digital
+    input, the epochs of all analog signals around new rising edges are extracted from the signal
+    histories with a single gather, the mean and variance of each signal across epochs are updated
+    incrementally using Welford's method, and the most recent epochs are kept in a preallocated
+    array for plotting as a heatmap.  Plots show events on the digital input selected as trigger."""
+
+    signal_colors = ("g", "r", "m")  # As Signals_plot.
+
+    def __init__(self, signals_plot):
         self.signals_plot = signals_plot
         self.axis = pg.PlotWidget(title="Event triggered", labels={"left": "Volts", "bottom": "Time (seconds)"})
         self.axis.setMouseEnabled(x=False, y=False)
-        self.axis.addLegend(offset=(-10, 10))
-        self.prev_plot = self.axis.plot(pen=pg.mkPen(pg.hsvColor(0.6, sat=0, alpha=0.3)), name="latest")
-        self.ave_plot = self.axis.plot(pen=pg.mkPen(pg.hsvColor(0.6)), name="average")
+        self.legend = self.axis.addLegend(offset=(-10, 10))
         self.axis.addItem(pg.InfiniteLine(pos=0, angle=90, pen=pg.mkPen(style=QtCore.Qt.PenStyle.DotLine)))
         self.axis.setXRange(triggered_dur[0], triggered_dur[1], padding=0)
-        self.alpha = 1 - np.exp(-1.0 / tau)  # Learning rate for update of average trace, tau is time constant.
-
-    def reset(self, sampling_rate):
+        self.heatmap_axis = pg.PlotWidget(
+            title="Event triggered analog 1", labels={"left": "Event", "bottom": "Time (seconds)"}
+        )
+        self.heatmap_axis.setMouseEnabled(x=False, y=False)
+        self.heatmap = pg.ImageItem(axisOrder="row-major")
+        self.heatmap_axis.addItem(self.heatmap)
+        self.heatmap_axis.addItem(pg.InfiniteLine(pos=0, angle=90, pen=pg.mkPen(style=QtCore.Qt.PenStyle.DotLine)))
+        self.heatmap_axis.setXRange(triggered_dur[0], triggered_dur[1], padding=0)
+        self.trigger_DI = 0  # Digital input whose events are plotted.
+        self.plot_items = []
+        self.counts = None
+
+    def reset(self, sampling_rate, n_signals):
         self.window = (np.array(triggered_dur) * sampling_rate).astype(
             int
         )  # Window for event triggered signals (samples [pre, post])
-        self.x = np.linspace(*triggered_dur, self.window[1] - self.window[0])  # X axis for event triggered plots.
-        self.average = None
-        self.prev_plot.clear()
-        self.ave_plot.clear()
+        window_len = self.window[1] - self.window[0]
+        self.x = np.linspace(*triggered_dur, window_len)  # X axis for event triggered plots.
+        # Maximum number of new samples per update for pre event window of all events to be in history.
+        self.max_update_len = max(self.signals_plot.DIs[0].history_length - window_len, 1)
+        self.n_signals = n_signals
+        n_DIs = len(self.signals_plot.DIs)
+        self.counts = np.zeros(n_DIs, int)  # Number of events on each digital input.
+        self.means = np.zeros((n_DIs, n_signals, window_len))  # Mean of each signal for each digital input.
+        self.M2s = np.zeros((n_DIs, n_signals, window_len))  # Sum of squared differences from mean.
+        self.epochs = np.full(  # Most recent epochs, [digital input, event, signal, sample].
+            (n_DIs, triggered_heatmap_events, n_signals, window_len), np.nan, dtype=np.float32
+        )
+        # Create plot items.
+        for item in self.plot_items:
+            self.axis.removeItem(item)
+        self.plot_items = []
+        self.latest_plots, self.mean_plots, self.sem_curves = [], [], []
+        for a in range(n_signals):
+            color = pg.mkColor(self.signal_colors[a])
+            self.latest_plots.append(pg.PlotDataItem(pen=pg.mkPen(color.red(), color.green(), color.blue(), 80)))
+            self.mean_plots.append(pg.PlotDataItem(pen=pg.mkPen(color), name=f"analog {a+1}"))
+            self.sem_curves.append((pg.PlotCurveItem(), pg.PlotCurveItem()))  # Mean +/- standard error.
+            sem_fill = pg.FillBetweenItem(*self.sem_curves[-1], brush=(color.red(), color.green(), color.blue(), 60))
+            self.plot_items += [sem_fill, self.latest_plots[-1], self.mean_plots[-1]]
+        for item in self.plot_items:
+            self.axis.addItem(item)
+        self.update_plots()
+
+    def set_trigger(self, DI):
+        # Select digital input whose events are plotted.
+        self.trigger_DI = DI
+        if self.counts is not None:
+            self.update_plots()
 
     def update(self, new_data_len):
-        # Update event triggered average plot.
-        trig_section = self.signals_plot.DIs[0].history[-self.window[1] - new_data_len - 1 : -self.window[1]]
-        rising_edges = np.where(np.diff(trig_section) == 1)[0]
-        for i, edge in enumerate(rising_edges):
-            edge_ind = -self.window[1] - new_data_len - 1 + edge  # Position of edge in signal history.
-            ev_trig_sig = self.signals_plot.signals[0].history[edge_ind + self.window[0] : edge_ind + self.window[1]]
-            if self.average is None:  # First acquisition
-                self.average = ev_trig_sig
-            else:  # Update averaged trace.
-                self.average = (1 - self.alpha) * self.average + self.alpha * ev_trig_sig
-            if i + 1 == len(rising_edges):
-                self.prev_plot.setData(self.x, ev_trig_sig)
-                self.ave_plot.setData(self.x, self.average)
+        # Find rising edges whose post event window has been completed by the new data.
+        history_length = self.signals_plot.DIs[0].history_length
+        section_start = max(history_length - self.window[1] - new_data_len, 0)
+        section_end = history_length - self.window[1] + 1
+        for d, DI in enumerate(self.signals_plot.DIs):
+            rising_edges = section_start + 1 + np.where(np.diff(DI.history[section_start:section_end]) == 1)[0]
+            rising_edges = rising_edges[rising_edges + self.window[0] >= 0]  # Pre event window in history.
+            if len(rising_edges) == 0:
+                continue
+            epoch_inds = rising_edges[:, None] + np.arange(*self.window)
+            epochs = np.stack(
+                [signal.history[epoch_inds] for signal in self.signals_plot.signals[: self.n_signals]], axis=1
+            )  # [event, signal, sample]
+            epochs = epochs[~np.isnan(epochs).any(axis=(1, 2))]  # Exclude events before start of acquisition.
+            if len(epochs):
+                self.add_epochs(d, epochs)
+                if d == self.trigger_DI:
+                    self.update_plots()
+
+    def add_epochs(self, d, epochs):
+        # Update mean and variance for digital input d with new epochs, using Welford's method
+        # generalised to combine batches of epochs.
+        n_old, n_new = self.counts[d], len(epochs)
+        n_total = n_old + n_new
+        new_mean = epochs.mean(axis=0)
+        delta = new_mean - self.means[d]
+        self.means[d] += delta * n_new / n_total
+        self.M2s[d] += ((epochs - new_mean) ** 2).sum(axis=0) + delta**2 * n_old * n_new / n_total
+        self.counts[d] = n_total
+        # Store most recent epochs.
+        n_stored = min(n_new, triggered_heatmap_events)
+        self.epochs[d, (n_total - n_stored + np.arange(n_stored)) % triggered_heatmap_events] = epochs[-n_stored:]
+
+    def update_plots(self):
+        d = self.trigger_DI
+        n_events = self.counts[d]
+        self.axis.setTitle(f"Event triggered ({n_events} events)")
+        if n_events == 0:
+            for plot in self.latest_plots + self.mean_plots + [curve for curves in self.sem_curves for curve in curves]:
+                plot.setData([], [])
+            self.heatmap.clear()
+            return
+        sem = np.sqrt(self.M2s[d] / (n_events - 1) / n_events) if n_events > 1 else np.zeros_like(self.means[d])
+        latest = self.epochs[d, (n_events - 1) % triggered_heatmap_events]
+        for a in range(self.n_signals):
+            self.latest_plots[a].setData(self.x, latest[a])
+            self.mean_plots[a].setData(self.x, self.means[d, a])
+            self.sem_curves[a][0].setData(self.x, self.means[d, a] + sem[a])
+            self.sem_curves[a][1].setData(self.x, self.means[d, a] - sem[a])
+        if self.heatmap_axis.isVisible():
+            self.update_heatmap()
+
+    def update_heatmap(self):
+        # Plot analog 1 for the most recent events on the trigger digital input, latest at top.
+        if self.counts is None or self.counts[self.trigger_DI] == 0:
+            return
+        n_events = self.counts[self.trigger_DI]
+        n_shown = min(n_events, triggered_heatmap_events)
+        order = (n_events - n_shown + np.arange(n_shown)) % triggered_heatmap_events
+        self.heatmap.setImage(self.epochs[self.trigger_DI, order, 0], autoLevels=True)
+        self.heatmap.setRect(QtCore.QRectF(triggered_dur[0], 0, triggered_dur[1] - triggered_dur[0], n_shown))
+        self.heatmap_axis.setYRange(0, n_shown, padding=0)
 
 
 # Signal_history ------------------------------------------------------------
 
 
 class Signal_history:
-    # Buffer to store the recent history of a signal.
-
-    def __init__(self, history_length, dtype=float):
-        self.history = np.full(history_length, np.nan if dtype == float else 0, dtype)
+    # Ring buffer to store the recent history of a signal.  Each sample is written at two
+    # positions history_length apart in a buffer of twice the history length, so the history
+    # is always a contiguous slice of the buffer and no data is copied when it is accessed.
+
+    def __init__(self, history_length, dtype=float, min_max=False):
+        self.history_length = history_length
+        self.buffer = np.full(2 * history_length, np.nan if dtype == float else 0, dtype)
+        self.write_ind = 0  # Position in buffer where next sample is written.
+        self.n_samples = 0  # Number of samples recieved since reset.
+        self.min_max = Min_max_pyramid(self) if min_max else None  # Used for decimated plotting.
+
+    @property
+    def history(self):
+        # View of buffer containing the signal history, oldest sample first.
+        return self.buffer[self.write_ind : self.write_ind + self.history_length]
 
     def update(self, new_data):
-        # Move old data along buffer, store new data samples.
+        # Store new data samples, overwriting the oldest samples.
+        self.n_samples += len(new_data)
+        if self.min_max:
+            self.min_max.data_changed(self.n_samples - len(new_data))
+        new_data = new_data[-self.history_length :]
         data_len = len(new_data)
-        self.history = np.roll(self.history, -data_len)
-        self.history[-data_len:] = new_data
+        n_before_wrap = min(data_len, self.history_length - self.write_ind)  # Samples written before wraparound.
+        for offset in (0, self.history_length):
+            self.buffer[offset + self.write_ind : offset + self.write_ind + n_before_wrap] = new_data[:n_before_wrap]
+            self.buffer[offset : offset + data_len - n_before_wrap] = new_data[n_before_wrap:]
+        self.write_ind = (self.write_ind + data_len) % self.history_length
+
+    def overwrite_recent(self, new_data):
+        # Replace the most recent len(new_data) samples.
+        self.write_ind = (self.write_ind - len(new_data)) % self.history_length
+        self.n_samples -= len(new_data)
+        self.update(new_data)
+
+
+class Min_max_pyramid:
+    # Minimum and maximum of a Signal_history in bins of 2, 4, 8... samples, used to plot the
+    # history with a number of points proportional to the plot width while keeping brief events
+    # visible.  Bins are aligned to the sample number since reset, the bins of each level are
+    # stored in a ring indexed by bin number, and when the plot is updated only bins containing
+    # samples that have changed are recomputed, each level from the level below.
+
+    def __init__(self, signal_history, min_bins=64):
+        self.signal = signal_history
+        self.bin_sizes = []  # Samples per bin for each level.
+        bin_size = 2
+        while signal_history.history_length // bin_size >= min_bins:
+            self.bin_sizes.append(bin_size)
+            bin_size *= 2
+        self.ring_lengths = [signal_history.history_length // bin_size + 2 for bin_size in self.bin_sizes]
+        self.mins = [np.full(ring_length, np.nan) for ring_length in self.ring_lengths]
+        self.maxs = [np.full(ring_length, np.nan) for ring_length in self.ring_lengths]
+        self.first_changed = [0 for bin_size in self.bin_sizes]  # First changed sample for each level.
+        self.first_changed_all = 0  # First sample changed since last call to decimated.
+
+    def data_changed(self, first_changed):
+        # Called by Signal_history when samples from first_changed onwards have been written.
+        self.first_changed_all = min(self.first_changed_all, first_changed)
+
+    def decimated(self, max_bins):
+        # Return (inds, values) where values are the minimum and maximum of each bin for the
+        # smallest bin size giving at most max_bins bins, and inds their positions in the history,
+        # or None if the history has at most 2 * max_bins samples.
+        history_length, n_samples = self.signal.history_length, self.signal.n_samples
+        if history_length <= 2 * max_bins or not self.bin_sizes:
+            return None
+        level = next(
+            (l for l, bin_size in enumerate(self.bin_sizes) if history_length / bin_size <= max_bins),
+            len(self.bin_sizes) - 1,
+        )
+        self.first_changed = [min(first_changed, self.first_changed_all) for first_changed in self.first_changed]
+        self.first_changed_all = n_samples
+        for l in range(level + 1):
+            self._update_level(l)
+        bin_size = self.bin_sizes[level]
+        bins = np.arange((n_samples - history_length) // bin_size, (n_samples - 1) // bin_size + 1)
+        bin_starts = bins * bin_size - (n_samples - history_length)  # Position of bins in history.
+        inds = np.clip(np.column_stack([bin_starts, bin_starts + bin_size // 2]).ravel(), 0, history_length - 1)
+        ring_inds = bins % self.ring_lengths[level]
+        values = np.column_stack([self.mins[level][ring_inds], self.maxs[level][ring_inds]])
+        if bin_starts[0] < 0:  # First bin starts before history, use only samples in history.
+            first_bin = self.signal.history[: bin_starts[0] + bin_size]
+            values[0] = [np.fmin.reduce(first_bin), np.fmax.reduce(first_bin)]
+        return inds, values.ravel()
+
+    def _update_level(self, l):
+        # Recompute bins of level l containing changed samples.
+        history_length, n_samples = self.signal.history_length, self.signal.n_samples
+        first_sample = max(self.first_changed[l], n_samples - history_length)
+        self.first_changed[l] = n_samples
+        if first_sample >= n_samples:
+            return
+        bin_size = self.bin_sizes[l]
+        bins = np.arange(first_sample // bin_size, (n_samples - 1) // bin_size + 1)
+        if l == 0:  # Compute from signal history, samples not in history are NaN.
+            values = np.full((len(bins), bin_size), np.nan)
+            start = bins[0] * bin_size - (n_samples - history_length)  # Position of first bin in history.
+            values.ravel()[max(-start, 0) : history_length - start] = self.signal.history[max(start, 0) :]
+            bin_mins = bin_maxs = values
+        else:  # Compute from pairs of bins of level below.
+            child_bins = np.column_stack([2 * bins, 2 * bins + 1])
+            bin_mins = self.mins[l - 1][child_bins % self.ring_lengths[l - 1]]
+            bin_maxs = self.maxs[l - 1][child_bins % self.ring_lengths[l - 1]]
+            if child_bins[-1, 1] * self.bin_sizes[l - 1] >= n_samples:  # Last child bin has no samples yet.
+                bin_mins[-1, 1] = bin_maxs[-1, 1] = np.nan
+        self.mins[l][bins % self.ring_lengths[l]] = np.fmin.reduce(bin_mins, axis=1)
+        self.maxs[l][bins % self.ring_lengths[l]] = np.fmax.reduce(bin_maxs, axis=1)
 
 
 # Info_overlay ----------------------------------------------------
@@ -6,6 +6,8 @@ from pyqtgraph.Qt import QtCore, QtWidgets
 
 from GUI.dir_paths import config_dir, devices_dir
 from GUI.acquisition_board import get_board_info, set_flashdrive_enabled
+from GUI.simulated_board import get_simulated_board_info, simulated_port_prefix
+from config.GUI_config import simulated_setups
 from GUI.utility import set_cbox_item
 
 
@@ -89,10 +91,14 @@ class Setups_tab(QtWidgets.QWidget):
         """Called regularly when no task running to update tab with currently
         connected boards."""
         ports = set([c[0] for c in list_ports.comports() if ("Pyboard" in c[1]) or ("USB Serial Device" in c[1])])
+        ports.update(f"{simulated_port_prefix}{i + 1}" for i in range(simulated_setups))
         if not ports == self.setups.keys():
             # Add any newly connected setups.
             for port in set(ports) - set(self.setups.keys()):
-                unique_id, flashdrive_enabled = get_board_info(port)
+                if port.startswith(simulated_port_prefix):
+                    unique_id, flashdrive_enabled = get_simulated_board_info(port)
+                else:
+                    unique_id, flashdrive_enabled = get_board_info(port)
                 if unique_id is None:  # Serial device is not a pyboard.
                     continue
                 saved_setup = self.get_saved_setup(unique_id=unique_id, port=port)
@@ -0,0 +1,385 @@
+# Code which runs on host computer and simulates a pyboard running the photometry firmware,
+# for testing and benchmarking the GUI and data recording without hardware.
+# Copyright (c) Thomas Akam 2018-2025.  Licenced under the GNU General Public License v3.
+
+import os
+import zlib
+import struct
+import select
+import threading
+import numpy as np
+from time import perf_counter
+from collections import deque
+
+from GUI.acquisition_board import Acquisition_board, command_opcodes
+
+simulated_port_prefix = "SIM"  # Ports of simulated setups in the setups tab are SIM1, SIM2, ...
+
+event_duration_ms = 100  # Duration of pulses on simulated digital inputs.
+event_interval_ms = [500, 4000]  # Range of intervals between pulses on simulated digital inputs.
+traceback_message = (
+    b"\x04Traceback (most recent call last):\r\n"
+    b'  File "<stdin>", line 1, in <module>\r\n'
+    b'  File "photometry_upy.py", line 119, in start\r\n'
+    b"MemoryError: memory allocation failed, allocating 4096 bytes\r\n"
+    b"\x04>"
+)
+
+
+class Simulated_board(Acquisition_board):
+    """Acquisition_board connected to a Simulated_photometry object rather than a pyboard.  The
+    simulated firmware writes data to one end of a pseudo-terminal and the board reads it from
+    the other end as a serial port, so data acquisition and recording use the same code as with
+    hardware.  Commands are sent to the simulated firmware's command loop over the pseudo-terminal,
+    as to a pyboard.  Requires a platform with pseudo-terminals (Linux, macOS).  Optional arguments
+    inject faults into the data stream:
+    drop_chunk_rate   : Probability that each data chunk is not sent.
+    bad_checksum_rate : Probability that each data chunk is sent with an incorrect checksum.
+    traceback_after   : Number of chunks sent before the firmware crashes with a traceback.
+    clock_drift_ppm   : Rate of the simulated board's clock relative to the host's, minus 1 (ppm).
+    usb_buffer_bytes  : Bytes the host can leave unread before the board stops sending, as the USB
+                        connection, None for no limit.  Chunks acquired while sending is blocked
+                        are held in the firmware's buffer ring, and lost when it is full.
+    seed              : Seed for the random number generator used for signals and faults."""
+
+    def __init__(self, port, device_config, threaded=False, **simulation_kwargs):
+        import tty  # Not available on Windows.
+
+        self.simulation_kwargs = simulation_kwargs
+        self.device_fd, self.host_fd = os.openpty()
+        tty.setraw(self.host_fd)
+        try:
+            super().__init__(os.ttyname(self.host_fd), device_config, threaded)
+        except Exception:
+            os.close(self.host_fd)
+            raise
+        self.port = port
+        self.p.unique_id = get_simulated_board_info(port)[0]
+
+    def load_firmware(self):
+        """Instantiate simulated Photometry class and start its command loop."""
+        self.p = Simulated_photometry(self.config, self.device_fd, host_fd=self.host_fd, **self.simulation_kwargs)
+        self.p.serve()
+        self.command("ping")
+
+    def close(self):
+        self.p.close()
+        super().close()
+        os.close(self.device_fd)
+        os.close(self.host_fd)  # Kept open to query bytes unread by host, serial port has its own.
+
+
+class Simulated_photometry:
+    """Simulates the Photometry class in photometry_upy.py.  When serving, a thread executes commands
+    sent by the host, and when acquisition is started generates simulated signals at the sampling
+    rate, sending them to the host in chunks using the same byte format as Photometry._send_buffer.
+    If fd is None data is not streamed, and is instead generated faster than real time by
+    get_chunks after calling start.  host_fd is the host end of the pseudo-terminal, used to limit
+    unread bytes to usb_buffer_bytes."""
+
+    def __init__(
+        self,
+        device_config,
+        fd,
+        drop_chunk_rate=0,
+        bad_checksum_rate=0,
+        traceback_after=None,
+        clock_drift_ppm=0,
+        usb_buffer_bytes=None,
+        seed=None,
+        host_fd=None,
+    ):
+        self.config = device_config
+        self.fd = fd  # File descriptor of device end of pseudo-terminal.
+        self.host_fd = host_fd
+        self.usb_buffer_bytes = usb_buffer_bytes
+        self.drop_chunk_rate = drop_chunk_rate
+        self.bad_checksum_rate = bad_checksum_rate
+        self.traceback_after = traceback_after
+        self.clock_rate = 1 + clock_drift_ppm * 1e-6  # Board clock rate relative to host.
+        self.reset_time = perf_counter()  # Host time when board was reset.
+        self.rng = np.random.default_rng(seed)
+        self.running = False
+        self.serving = False
+        self.thread = None
+        self.LED_1_value = 0
+        self.LED_2_value = 0
+        self.unique_id = 0
+
+    def set_mode(self, mode):
+        # Set the acquisition mode.
+        assert mode in ["2EX_2EM_continuous", "2EX_1EM_pulsed", "2EX_2EM_pulsed", "3EX_2EM_pulsed"], "Invalid mode."
+        self.mode = mode
+        self.n_analog_signals = 3 if mode == "3EX_2EM_pulsed" else 2
+        self.n_digital_signals = 1 if mode == "3EX_2EM_pulsed" else 2
+
+    def set_LED_current(self, LED_1_current=None, LED_2_current=None):
+        # Set the LED current.
+        if LED_1_current is not None:
+            self.LED_1_value = self._LED_value(LED_1_current)
+        if LED_2_current is not None:
+            self.LED_2_value = self._LED_value(LED_2_current)
+
+    def _LED_value(self, LED_current):
+        # DAC value used to drive LED at specified current.
+        if LED_current == 0:
+            return 0
+        return int(self.config["LED_calibration"]["slope"] * LED_current + self.config["LED_calibration"]["offset"])
+
+    def mem_free(self):
+        # Return the number of bytes of free heap memory.
+        return 100000
+
+    def start(self, sampling_rate, buffer_size, sync_out=False, compress=False, timestamps=False, n_buffers=None):
+        # Initialise variables used during acquisition, data is streamed by _run.
+        self.start_time = perf_counter()
+        self.sampling_rate = sampling_rate
+        self.buffer_size = buffer_size
+        self.compress = compress
+        self.timestamps = timestamps
+        self.sample_stride = 2 if self.mode == "2EX_2EM_continuous" else 2 * self.n_analog_signals
+        self.samples_per_chunk = buffer_size // self.sample_stride
+        self.n_buffers = n_buffers or 2
+        self.send_overruns = bool(n_buffers)
+        self.ready_buffers = deque()  # (chunk_number, buffer_start_us, buffer) of full buffers waiting to be sent.
+        self.n_overruns = 0  # Number of full buffers discarded as all buffers were waiting to be sent.
+        self.chunk_number = 0  # Number of data chunks acquired, modulo 2**16.
+        self.n_chunks = 0  # Number of data chunks acquired.
+        self.n_samples = 0  # Number of samples acquired on each channel.
+        ms_to_samples = lambda ms: max(int(sampling_rate * ms / 1000), 1)
+        if sync_out:  # Digital 1 is sync pulse output.
+            self.DI1 = _Pulse_train(
+                self.rng,
+                ms_to_samples(sync_out["pulse_duration_ms"]),
+                *map(ms_to_samples, sync_out["inter_pulse_interval_ms"])
+            )
+        else:
+            self.DI1 = _Pulse_train(self.rng, ms_to_samples(event_duration_ms), *map(ms_to_samples, event_interval_ms))
+        self.DI2 = _Pulse_train(self.rng, ms_to_samples(event_duration_ms), *map(ms_to_samples, event_interval_ms))
+        self.running = True
+
+    def serve(self):
+        # Execute binary commands sent by the host in a thread, as Photometry.serve.
+        self.serving = True
+        self.thread = threading.Thread(target=self._serve, name="simulated photometry", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # Stop acquisition and the command loop.
+        self.running = self.serving = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def _serve(self):
+        # Execute commands from the host and acknowledge them in the format used by Photometry.serve.
+        while self.serving:
+            if not select.select([self.fd], [], [], 0.05)[0]:
+                continue
+            received_byte = os.read(self.fd, 1)
+            if received_byte == b"\x03":  # ctrl+c, return to REPL.
+                break
+            elif received_byte != b"\xFC":  # Not the start of a command.
+                continue
+            request_id, opcode, n_bytes = self._read(3)
+            payload = self._read(n_bytes)
+            if opcode == command_opcodes["benchmark"]:  # Not simulated, acknowledged as a failed command.
+                response = b"Firmware benchmark requires a pyboard."
+                status = 1
+            else:
+                try:
+                    response = self._command(opcode, payload) or b""
+                    status = 0
+                except Exception as e:
+                    response = repr(e).encode()
+                    status = 1
+            self._write(b"\xFB" + bytes([request_id, status]) + len(response).to_bytes(2, "little") + response)
+            if self.running:  # Start command recieved, acquire data until host sends stop signal.
+                self._run()
+        self.serving = False
+
+    def _command(self, opcode, payload):
+        # Execute a command recieved by _serve, return the response bytes, as Photometry._command.
+        if opcode == command_opcodes["set_mode"]:
+            self.set_mode(payload.decode())
+        elif opcode == command_opcodes["set_LED_current"]:  # 0xFFFF leaves the LED's current unchanged.
+            LED_currents = struct.unpack("<HH", payload)
+            self.set_LED_current(*[None if LED_current == 0xFFFF else LED_current for LED_current in LED_currents])
+        elif opcode == command_opcodes["unique_id"]:
+            return self.unique_id.to_bytes(12, "little")
+        elif opcode == command_opcodes["mem_free"]:
+            return struct.pack("<I", self.mem_free())
+        elif opcode == command_opcodes["start"]:  # Flags are compress, timestamps and sync_out bits.
+            rate, buffer_size, n_buffers, flags, pulse_dur, min_IPI, max_IPI = struct.unpack("<IHHBHHH", payload)
+            sync_out = False
+            if flags & 4:
+                sync_out = {"pulse_duration_ms": pulse_dur, "inter_pulse_interval_ms": [min_IPI, max_IPI]}
+            self.start(rate, buffer_size, sync_out, bool(flags & 1), bool(flags & 2), n_buffers or None)
+        elif opcode != command_opcodes["ping"]:
+            raise ValueError("Invalid opcode.")
+
+    def _run(self):
+        # Send each chunk of data when it would be ready on the pyboard, and process commands from host.
+        chunk_dur = self.samples_per_chunk / self.sampling_rate
+        start_time = self.start_time
+        while self.running:
+            timeout = max(start_time + (self.n_chunks + 1) * chunk_dur - perf_counter(), 0)
+            if select.select([self.fd], [], [], timeout)[0]:
+                received_byte = os.read(self.fd, 1)
+                if received_byte == b"\xFF":  # Stop signal.
+                    break
+                elif received_byte == b"\xFD":  # Set LED 1 power.
+                    self.set_LED_current(LED_1_current=int.from_bytes(self._read(2), "little"))
+                elif received_byte == b"\xFE":  # Set LED 2 power.
+                    self.set_LED_current(LED_2_current=int.from_bytes(self._read(2), "little"))
+            while perf_counter() >= start_time + (self.n_chunks + 1) * chunk_dur:
+                if self.traceback_after is not None and self.n_chunks >= self.traceback_after:
+                    self._write(traceback_message)  # Firmware crashed, exiting command loop.
+                    self.running = self.serving = False
+                    return
+                self._buffer_full(self._acquire_buffer())
+            while self.ready_buffers and self._host_ready():
+                self._send_buffer(*self.ready_buffers.popleft())
+        self.running = False
+
+    def _buffer_full(self, buffer):
+        # Queue buffer to be sent unless all the firmware's other buffers are waiting to be
+        # sent, as Photometry._buffer_full.
+        self.chunk_number = (self.chunk_number + 1) & 0xFFFF
+        if len(self.ready_buffers) < self.n_buffers - 1:
+            self.ready_buffers.append((self.chunk_number, self.buffer_start_us, buffer))
+        else:
+            self.n_overruns += 1
+
+    def _host_ready(self):
+        # Return True if the host has fewer than usb_buffer_bytes bytes unread.
+        if self.usb_buffer_bytes is None or self.host_fd is None:
+            return True
+        import fcntl, termios  # Not available on Windows.
+
+        n_unread = int.from_bytes(fcntl.ioctl(self.host_fd, termios.FIONREAD, bytes(4)), "little")
+        return n_unread < self.usb_buffer_bytes
+
+    def _acquire_buffer(self):
+        # Return a buffer of simulated data in the format written by the interrupt service routines.
+        n = self.samples_per_chunk
+        t = (self.n_samples + np.arange(n)) / self.sampling_rate
+        # Time of first sample on board clock (us, modulo 2**30).
+        self.buffer_start_us = int((self.start_time - self.reset_time + t[0]) * self.clock_rate * 1e6) & 0x3FFFFFFF
+        self.n_samples += n
+        self.n_chunks += 1
+        DI1 = self.DI1.get(n)
+        DI2 = self.DI2.get(n) if self.n_digital_signals == 2 else np.zeros(n, bool)
+        LED_values = [self.LED_1_value, self.LED_2_value, 4095][: self.n_analog_signals]
+        bleaching = 0.8 + 0.2 * np.exp(-t / 600)
+        DI = DI1 | DI2
+        baselines = [self._ADC_values(np.full(n, 800.0)) for c in range(self.n_analog_signals)]
+        LED_on = [
+            self._ADC_values(800 + 8 * LED_value * bleaching * (1 + 0.05 * np.sin(2 * np.pi * 0.2 * t + c) + 0.02 * DI))
+            for c, LED_value in enumerate(LED_values)
+        ]
+        if self.mode == "2EX_2EM_continuous":
+            buffer = np.empty((n, 2), dtype=np.dtype("<u2"))
+            buffer[:, 0] = (LED_on[0] << 1) | DI1
+            buffer[:, 1] = (LED_on[1] << 1) | DI2
+        else:  # Pulsed modes, LED-on sample followed by baseline for each channel in turn.
+            buffer = np.empty((n, self.n_analog_signals, 2), dtype=np.dtype("<u2"))
+            for c, DI in enumerate([DI1, DI2, np.zeros(n, bool)][: self.n_analog_signals]):
+                buffer[:, c, 0] = (LED_on[c] << 1) | DI
+                buffer[:, c, 1] = baselines[c] << 1
+        return buffer.ravel()
+
+    def _ADC_values(self, mean):
+        # Return simulated 15 bit ADC readings with noise.
+        return np.clip(mean + self.rng.normal(0, 30, len(mean)), 0, 0x7FFF).astype(np.dtype("<u2"))
+
+    def get_chunks(self, n_chunks):
+        """Acquire n_chunks chunks of data and return the bytes that would be sent to the host."""
+        chunks = []
+        for i in range(n_chunks):
+            self._buffer_full(self._acquire_buffer())
+            chunks.append(self._chunk_bytes(*self.ready_buffers.popleft()))
+        return b"".join(chunks)
+
+    def _send_buffer(self, chunk_number, buffer_start_us, buffer):
+        # Send buffer to host computer.
+        self._write(self._chunk_bytes(chunk_number, buffer_start_us, buffer))
+
+    def _chunk_bytes(self, chunk_number, buffer_start_us, buffer):
+        # Return buffer preceded by the chunk header as sent by Photometry._send_buffer, unless
+        # faults are being simulated.
+        if self.drop_chunk_rate and self.rng.random() < self.drop_chunk_rate:
+            return b""  # Chunk lost.
+        chunk_header = [chunk_number, 0]
+        if self.send_overruns:
+            chunk_header.append(self.n_overruns & 0xFFFF)
+        if self.timestamps:
+            chunk_header += [buffer_start_us & 0xFFFF, buffer_start_us >> 16]
+        checksum = (int(np.sum(buffer, dtype=np.uint64)) + sum(chunk_header[2:])) & 0xFFFF
+        if self.bad_checksum_rate and self.rng.random() < self.bad_checksum_rate:
+            checksum = (checksum + 1) & 0xFFFF  # Chunk corrupted.
+        chunk_header[1] = checksum
+        chunk_header = np.array(chunk_header, dtype=np.dtype("<u2"))
+        if self.compress:
+            return self._compressed_chunk_bytes(buffer, chunk_header)
+        return b"\x07" + chunk_header.tobytes() + buffer.tobytes()
+
+    def _compressed_chunk_bytes(self, buffer, chunk_header):
+        # Return buffer delta encoded as by _compress_buffer in photometry_upy.py.
+        stride = self.sample_stride
+        deltas = (buffer[stride:].astype(np.int32) - buffer[:-stride] + 0x8000) % 0x10000 - 0x8000
+        zigzag = (deltas << 1) ^ (deltas >> 31)
+        n_bits = int(zigzag.max()).bit_length() if len(zigzag) else 0
+        bits = ((zigzag[:, None] >> np.arange(n_bits)) & 1).astype(np.uint8)
+        return (
+            b"\x06"
+            + chunk_header.tobytes()
+            + bytes([n_bits])
+            + buffer[:stride].tobytes()
+            + np.packbits(bits.ravel(), bitorder="little").tobytes()
+        )
+
+    def _write(self, data):
+        # Write all bytes to the host.
+        data = memoryview(data)
+        while data:
+            data = data[os.write(self.fd, data) :]
+
+    def _read(self, n_bytes):
+        # Read n_bytes bytes sent by the host.
+        data = b""
+        while len(data) < n_bytes:
+            data += os.read(self.fd, n_bytes - len(data))
+        return data
+
+
+def get_simulated_board_info(port):
+    """Get the unique id and flashdrive enabled status of a simulated board, as get_board_info."""
+    return zlib.crc32(port.encode()), False
+
+
+class _Pulse_train:
+    """Generates pulses of fixed duration with random intervals between them, in samples."""
+
+    def __init__(self, rng, pulse_dur, min_interval, max_interval):
+        self.rng = rng
+        self.pulse_dur = pulse_dur
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.n_samples = 0
+        self.onset = self._interval()  # Sample number of next pulse onset.
+
+    def _interval(self):
+        return int(self.rng.integers(self.min_interval, self.max_interval + 1))
+
+    def get(self, n):
+        """Return the value of the next n samples as a boolean array."""
+        values = np.zeros(n, bool)
+        end = self.n_samples + n
+        while self.onset < end:
+            values[max(self.onset - self.n_samples, 0) : self.onset + self.pulse_dur - self.n_samples] = True
+            if self.onset + self.pulse_dur > end:
+                break  # Pulse continues into next samples.
+            self.onset += self.pulse_dur + self._interval()
+        self.n_samples = end
+        return values
@@ -0,0 +1,86 @@
+# Round trip test and benchmark of compressed data streaming.  For each acquisition mode,
+# simulated data is encoded as the pyboard sends it with and without compression (see
+# _compress_buffer in photometry_upy.py), with dropped and corrupted chunks, and parsed by
+# Chunk_parser in reads that split chunks at arbitrary points.  Checks that the decoded data
+# and the location of skipped chunks are identical for both streams, and prints the
+# compression ratio and parsing throughput.
+#
+# Usage: python benchmarks/compression_benchmark.py [n_chunks]
+
+import sys
+import json
+import time
+import numpy as np
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from framing_benchmark import Replay_serial
+from config.GUI_config import update_interval, available_acquisition_modes
+from GUI.dir_paths import devices_dir
+from GUI.chunk_parser import Chunk_parser
+from GUI.simulated_board import Simulated_photometry
+
+SAMPLING_RATE = 1000  # Hz
+DEVICE_TYPE = "pyPhotometry_v2.0"
+
+
+def make_stream(device_config, mode, n_chunks, compress, **fault_kwargs):
+    """Return the bytes sent by a simulated board for n_chunks data chunks, and the stride."""
+    p = Simulated_photometry(device_config, None, seed=0, **fault_kwargs)
+    p.set_mode(mode)
+    p.set_LED_current(10, 10)
+    buffer_size = int(SAMPLING_RATE // (1000 / update_interval)) * 2 * p.n_analog_signals
+    p.start(SAMPLING_RATE, buffer_size, compress=compress)
+    return p.get_chunks(n_chunks), buffer_size, p.sample_stride
+
+
+def parse_stream(stream, buffer_size, compressed_stride, bytes_per_poll):
+    """Parse stream in reads of bytes_per_poll bytes, return the data and gaps."""
+    serial = Replay_serial(stream, bytes_per_poll)
+    parser = Chunk_parser(buffer_size, compressed_stride=compressed_stride)
+    outputs, gaps = [], []
+    n_values = 0
+    while serial.next_poll():
+        parser.read_serial(serial)
+        data, unexpected_bytes = parser.parse()
+        assert not unexpected_bytes, "Unexpected bytes in stream."
+        if data is not None:
+            gaps += [[chunk_number, n_values + offset, n] for chunk_number, offset, n in parser.gaps]
+            n_values += len(data)
+            outputs.append(data)
+    return np.hstack(outputs), gaps
+
+
+def round_trip(device_config, mode, n_chunks, **fault_kwargs):
+    """Check compressed and uncompressed streams decode to the same data, return the stream
+    sizes and parsing time for each, and the number of values per sample."""
+    results = {}
+    for compress in (False, True):
+        stream, buffer_size, stride = make_stream(device_config, mode, n_chunks, compress, **fault_kwargs)
+        bytes_per_poll = int(len(stream) / n_chunks * 2.5)  # Reads split chunks.
+        t0 = time.perf_counter()
+        data, gaps = parse_stream(stream, buffer_size, stride if compress else None, bytes_per_poll)
+        results[compress] = (len(stream), time.perf_counter() - t0, data, gaps)
+    assert np.array_equal(results[False][2], results[True][2]), "Decoded data does not match."
+    assert results[False][3] == results[True][3], "Skipped chunks do not match."
+    return results, stride
+
+
+if __name__ == "__main__":
+    n_chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    with open(Path(devices_dir, DEVICE_TYPE + ".json"), "r") as f:
+        device_config = json.load(f)
+    print(f"{n_chunks} chunks at {SAMPLING_RATE} Hz")
+    print(f"{'mode':<20}{'faults':<8}{'ratio':>7}{'raw MB/s':>10}{'compressed MB/s':>17}{'Msamples/s':>12}")
+    for mode in available_acquisition_modes:
+        for faults in ({}, {"drop_chunk_rate": 0.02, "bad_checksum_rate": 0.02}):
+            results, stride = round_trip(device_config, mode, n_chunks, **faults)
+            (raw_bytes, raw_time, data, _), (compressed_bytes, compressed_time, _, _) = results.values()
+            print(
+                f"{mode:<20}{'yes' if faults else 'no':<8}{raw_bytes / compressed_bytes:7.2f}"
+                f"{raw_bytes / raw_time / 1e6:10.1f}{compressed_bytes / compressed_time / 1e6:17.1f}"
+                f"{len(data) / stride / compressed_time / 1e6:12.2f}"
+            )
+    print("Round trip OK for all modes.")
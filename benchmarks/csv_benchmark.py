@@ -0,0 +1,55 @@
+# Benchmark of converting signals to CSV text for CSV data files, comparing np.savetxt
+# previously used by Acquisition_board.process_data with the encode_csv function.
+#
+# Usage: python benchmarks/csv_benchmark.py
+
+import io
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from GUI.data_writer import encode_csv
+
+
+def make_signals(n_rows, n_analog_signals=2, n_digital_signals=2, seed=0):
+    """Generate signals in the format passed to the CSV writer by process_data."""
+    rng = np.random.default_rng(seed)
+    signals = [rng.integers(0, 1 << 15, n_rows, dtype=np.uint16) for a in range(n_analog_signals)]
+    DIs = [rng.random(n_rows) > 0.5 for d in range(n_digital_signals)]
+    return signals, DIs
+
+
+def savetxt_encode(signals, DIs):
+    """CSV conversion used by Acquisition_board.process_data in pyPhotometry v1.1."""
+    text_file = io.StringIO()
+    np.savetxt(text_file, np.array(signals + DIs, dtype=int).T, fmt="%d", delimiter=",")
+    return text_file.getvalue().encode()
+
+
+def lookup_encode(signals, DIs):
+    return encode_csv(np.column_stack(signals + DIs), newline="\n")
+
+
+def benchmark(rows_per_chunk, n_chunks, n_repeats=3):
+    """Print rows per second converted by np.savetxt and encode_csv."""
+    chunks = [make_signals(rows_per_chunk, seed=i) for i in range(n_chunks)]
+    outputs = {}
+    for name, encode in (("np.savetxt", savetxt_encode), ("encode_csv", lookup_encode)):
+        durations = []
+        for i in range(n_repeats):
+            t0 = time.perf_counter()
+            output = [encode(signals, DIs) for signals, DIs in chunks]
+            durations.append(time.perf_counter() - t0)
+        outputs[name] = output
+        print(f"{name:>11}: {rows_per_chunk * n_chunks / min(durations) / 1e3:9.1f} k rows/s")
+    assert outputs["np.savetxt"] == outputs["encode_csv"], "CSV output does not match."
+
+
+if __name__ == "__main__":
+    for rows_per_chunk in (10, 100, 1000):
+        print(f"\n{rows_per_chunk} rows per chunk:")
+        benchmark(rows_per_chunk, n_chunks=max(10, 20000 // rows_per_chunk))
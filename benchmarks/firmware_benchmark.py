@@ -0,0 +1,45 @@
+# Benchmark of the photometry firmware running on a pyboard, measuring the time taken by the
+# interrupt service routine which acquires each sample, and by computing the checksum and
+# compressing the data, in each acquisition mode.  Prints the maximum sampling rate for each
+# mode and the max_sampling_rate values for the device config file these support, so the
+# limits in config/devices can be set from measurements.  Requires a connected pyboard, LEDs
+# are pulsed during the pulsed mode benchmarks so should be disconnected or covered.
+#
+# Usage: python benchmarks/firmware_benchmark.py port device_type
+#     e.g. python benchmarks/firmware_benchmark.py COM3 pyPhotometry_v2.0
+
+import sys
+import json
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from GUI.acquisition_board import Acquisition_board
+from GUI.dir_paths import devices_dir
+
+if __name__ == "__main__":
+    port, device_type = sys.argv[1:3]
+    with open(Path(devices_dir, device_type + ".json"), "r") as f:
+        device_config = json.load(f)
+    board = Acquisition_board(port, device_config)
+    try:
+        results = board.benchmark_firmware()
+    finally:
+        board.close()
+    print(f"{'mode':<20}{'ISR us':>8}{'checksum us':>13}{'compress us':>13}{'max rate Hz':>13}{'compressed Hz':>15}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<20}{result['ISR_us']:8.1f}{result['checksum_us']:13.2f}{result['compress_us']:13.2f}"
+            f"{result['max_sampling_rate']:13}{result['max_sampling_rate_compressed']:15}"
+        )
+    # max_sampling_rate in device config is the sampling rate in continuous mode, and the rate
+    # summed over analog signals in pulsed modes.
+    pulsed_rate = min(
+        result["max_sampling_rate"] * (3 if mode == "3EX_2EM_pulsed" else 2)
+        for mode, result in results.items()
+        if mode.endswith("pulsed")
+    )
+    continuous_rate = results["2EX_2EM_continuous"]["max_sampling_rate"]
+    print(f"\nSupported max_sampling_rate: continuous {continuous_rate}, pulsed {pulsed_rate}")
+    print(f"Device config {device_type} max_sampling_rate: {device_config['max_sampling_rate']}")
@@ -0,0 +1,138 @@
+# Benchmark of extracting data chunks from the serial byte stream sent by the pyboard,
+# comparing the byte at a time parsing previously used by Acquisition_board.process_data
+# with the Chunk_parser class.
+#
+# Usage: python benchmarks/framing_benchmark.py [stream_file]
+#
+# If stream_file is specified it should contain bytes recorded from the serial port
+# of a running board, otherwise a stream of 2EX_2EM_continuous data at 1kHz is generated.
+
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from GUI.chunk_parser import Chunk_parser
+
+SAMPLING_RATE = 1000  # Hz
+N_ANALOG_SIGNALS = 2
+UPDATE_INTERVAL = 10  # ms
+BUFFER_SIZE = int(SAMPLING_RATE // (1000 / UPDATE_INTERVAL)) * 2 * N_ANALOG_SIGNALS
+
+
+def make_byte_stream(n_chunks, buffer_size=BUFFER_SIZE, seed=0):
+    """Generate the bytes sent by the pyboard for n_chunks data chunks of random data."""
+    rng = np.random.default_rng(seed)
+    chunks = []
+    for chunk_number in range(1, n_chunks + 1):
+        data = rng.integers(0, 1 << 16, buffer_size, dtype=np.uint16)
+        header = np.array([chunk_number & 0xFFFF, int(np.sum(data, dtype=np.uint64)) & 0xFFFF], dtype="<u2")
+        chunks.append(b"\x07" + header.tobytes() + data.astype("<u2").tobytes())
+    return b"".join(chunks)
+
+
+class Replay_serial:
+    """Mimics a serial port which recieves the bytes of a stream in fixed size reads."""
+
+    def __init__(self, stream, bytes_per_poll):
+        self.stream = stream
+        self.bytes_per_poll = bytes_per_poll
+        self.pos = 0
+        self.poll_end = 0
+
+    def next_poll(self):
+        """Make the next bytes_per_poll bytes of the stream available, return False at end of stream."""
+        self.poll_end = min(self.poll_end + self.bytes_per_poll, len(self.stream))
+        return self.pos < len(self.stream)
+
+    @property
+    def in_waiting(self):
+        return self.poll_end - self.pos
+
+    def read(self, size=1):
+        # Like a serial port without timeout, reading more bytes than are waiting blocks until they arrive.
+        data = self.stream[self.pos : self.pos + size]
+        self.pos += len(data)
+        self.poll_end = max(self.poll_end, self.pos)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[: len(data)] = data
+        return len(data)
+
+
+def legacy_process(serial, buffer_size, state):
+    """Byte at a time parsing used by Acquisition_board.process_data in pyPhotometry v1.1."""
+    serial_chunk_size = (buffer_size + 2) * 2
+    data_chunks = []
+    while serial.in_waiting > 0:
+        new_byte = serial.read(1)
+        if new_byte == b"\x07":
+            chunk = np.frombuffer(serial.read(serial_chunk_size), dtype=np.dtype("<u2"))
+            recieved_chunk_number = chunk[0]
+            checksum = chunk[1]
+            data = chunk[2:]
+            if checksum == int(np.sum(data, dtype=np.uint64)) & 0xFFFF:
+                state["chunk_number"] = (state["chunk_number"] + 1) & 0xFFFF
+                n_skipped_chunks = np.int16((int(recieved_chunk_number) - state["chunk_number"]) & 0xFFFF)
+                if n_skipped_chunks > 0:
+                    skip_pad = np.zeros(buffer_size * n_skipped_chunks, dtype=np.dtype("<u2"))
+                    data = np.hstack([skip_pad, data])
+                    state["chunk_number"] = (state["chunk_number"] + int(n_skipped_chunks)) & 0xFFFF
+                data_chunks.append(data)
+    if data_chunks:
+        return np.hstack(data_chunks)
+
+
+def run_legacy(stream, bytes_per_poll, buffer_size=BUFFER_SIZE):
+    serial = Replay_serial(stream, bytes_per_poll)
+    state = {"chunk_number": 0}
+    outputs = []
+    while serial.next_poll():
+        data = legacy_process(serial, buffer_size, state)
+        if data is not None:
+            outputs.append(data)
+    return np.hstack(outputs)
+
+
+def run_chunk_parser(stream, bytes_per_poll, buffer_size=BUFFER_SIZE):
+    serial = Replay_serial(stream, bytes_per_poll)
+    parser = Chunk_parser(buffer_size)
+    outputs = []
+    while serial.next_poll():
+        parser.read_serial(serial)
+        data, unexpected_bytes = parser.parse()
+        if data is not None:
+            outputs.append(data)
+    return np.hstack(outputs)
+
+
+def benchmark(stream, bytes_per_poll, n_repeats=3):
+    """Print bytes per second parsed by legacy and Chunk_parser implementations."""
+    results = {}
+    for name, run in (("byte at a time", run_legacy), ("Chunk_parser", run_chunk_parser)):
+        durations = []
+        for i in range(n_repeats):
+            t0 = time.perf_counter()
+            output = run(stream, bytes_per_poll)
+            durations.append(time.perf_counter() - t0)
+        results[name] = output
+        print(f"{name:>15}: {len(stream) / min(durations) / 1e6:8.2f} MB/s")
+    assert np.array_equal(*results.values()), "Parsed data does not match."
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        stream = Path(sys.argv[1]).read_bytes()
+        print(f"Recorded stream: {len(stream)} bytes")
+    else:
+        stream = make_byte_stream(n_chunks=3000)
+        print(f"Generated stream: {len(stream)} bytes, {SAMPLING_RATE}Hz, chunk size {BUFFER_SIZE} samples")
+    chunk_bytes = 5 + 2 * BUFFER_SIZE
+    for chunks_per_poll in (1, 2.5, 10):
+        print(f"\n{chunks_per_poll} chunks per poll:")
+        benchmark(stream, int(chunks_per_poll * chunk_bytes))
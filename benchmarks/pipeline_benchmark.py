@@ -0,0 +1,278 @@
+# End to end benchmark of the data acquisition and analysis pipeline, using synthetic data
+# in the pyboard's serial format generated by Simulated_photometry.  For each device type in
+# config/devices and each acquisition mode, at the maximum sampling rate, benchmarks:
+#     process_data         - Acquisition_board.process_data reading data every update_interval.
+#     process_data_ppd     - As above while recording to a .ppd file.
+#     process_data_csv     - As above while recording to a .csv file.
+#     Signals_plot.update  - Updating and drawing the live plot every display frame (headless Qt).
+#     import_ppd           - Importing a recorded .ppd file.
+#     preprocess_data      - Preprocessing the imported signals.
+# Each benchmark runs in a seperate process so peak memory use can be measured.  Throughput
+# (samples per second per signal), latency percentiles for each read, frame or call, and peak
+# resident memory are printed and saved to a JSON file.  Passing a previous results file with
+# --compare reports benchmarks which have become slower, with exit status 1 if there are any.
+#
+# Usage: python benchmarks/pipeline_benchmark.py [--duration s] [--output file] [--compare file]
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+sys.path.append(str(Path(__file__).parents[1] / "tools"))
+
+from framing_benchmark import Replay_serial
+from config.GUI_config import (
+    VERSION,
+    update_interval,
+    display_fps,
+    available_acquisition_modes,
+    compress_data,
+    chunk_timestamps,
+)
+from GUI.dir_paths import devices_dir
+from GUI.simulated_board import Simulated_board
+
+STAGES = [
+    "process_data",
+    "process_data_ppd",
+    "process_data_csv",
+    "Signals_plot.update",
+    "import_ppd",
+    "preprocess_data",
+]
+PERCENTILES = [50, 90, 99, 100]
+REGRESSION_TOLERANCE = 0.2  # Fractional slowdown reported as a regression by --compare.
+
+
+class Replay_board_serial(Replay_serial):
+    """Replay_serial which accepts the calls the Acquisition_board makes to its serial port."""
+
+    def write(self, data):
+        pass
+
+    def reset_input_buffer(self):
+        self.pos = self.poll_end = len(self.stream)
+
+    def close(self):
+        pass
+
+
+def start_board(device_config, mode, duration):
+    """Return a started Simulated_board whose serial port replays duration seconds of data,
+    with the bytes recieved in each update_interval made available by each next_poll()."""
+    board = Simulated_board("SIM", device_config, seed=0)
+    board.set_mode(mode)
+    board.set_sampling_rate(board.max_rate)
+    board.set_LED_current(10, 10)
+    board.start(False)
+    # Stop simulated firmware and restart acquisition to generate data faster than real time.
+    board.p.close()
+    board.p.start(board.sampling_rate, board.buffer_size, False, compress_data, chunk_timestamps, board.n_buffers)
+    chunk_dur = board.p.samples_per_chunk / board.sampling_rate
+    stream = board.p.get_chunks(int(np.ceil(duration / chunk_dur)))
+    bytes_per_poll = int(np.ceil(len(stream) * (update_interval / 1000) / duration))
+    board.serial.close()
+    board.serial = Replay_board_serial(stream, bytes_per_poll)
+    return board
+
+
+def run_process_data(device_config, mode, duration, file_type=None, data_dir=None):
+    """Process duration seconds of data with process_data, optionally recording it, return
+    the processed data, the time taken by each read and the path of any file recorded."""
+    board = start_board(device_config, mode, duration)
+    file_path = None
+    if file_type:
+        file_path = Path(data_dir, board.record(data_dir, "benchmark", file_type))
+    new_data, read_times = [], []
+    while board.serial.next_poll():
+        t0 = time.perf_counter()
+        data = board.process_data()
+        if file_type and board.serial.pos == len(board.serial.stream):  # Time closing the file.
+            board.stop_recording()
+        read_times.append(time.perf_counter() - t0)
+        if data:
+            new_data.append(data)
+    board.stop()
+    board.close()
+    return new_data, read_times, file_path
+
+
+def benchmark_process_data(device_config, mode, duration, work_dir, file_type=None):
+    new_data, read_times, file_path = run_process_data(device_config, mode, duration, file_type, work_dir)
+    return sum(len(data[0][0]) for data in new_data), read_times
+
+
+def benchmark_plot(device_config, mode, duration, work_dir):
+    from pyqtgraph.Qt import QtWidgets
+    from render_benchmark import Setup_widget
+    from GUI.plotting import Signals_plot
+    from GUI.acquisition_board import merge_new_data
+
+    new_data = merge_new_data(run_process_data(device_config, mode, duration)[0])
+    signals, DIs, clipping_high, clipping_low = new_data
+    sampling_rate = device_config_rate(device_config, mode)
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    setup_widget = Setup_widget()
+    setup_widget.resize(1000, 300)
+    signals_plot = Signals_plot(setup_widget)
+    QtWidgets.QVBoxLayout(setup_widget).addWidget(signals_plot)
+    setup_widget.show()
+    signals_plot.set_n_signals(len(signals))
+    signals_plot.reset(sampling_rate)
+    samples_per_frame = max(int(sampling_rate / display_fps), 1)
+    frame_times = []
+    for start in range(0, len(signals[0]), samples_per_frame):
+        frame = (
+            [signal[start : start + samples_per_frame] for signal in signals],
+            [DI[start : start + samples_per_frame] for DI in DIs],
+            clipping_high,
+            clipping_low,
+        )
+        t0 = time.perf_counter()
+        signals_plot.update(frame)
+        app.processEvents()  # Draw plot.
+        frame_times.append(time.perf_counter() - t0)
+    setup_widget.close()
+    return len(signals[0]), frame_times
+
+
+def benchmark_import(device_config, mode, duration, work_dir, n_repeats=5):
+    from data_import import import_ppd
+
+    file_path = run_process_data(device_config, mode, duration, "ppd", work_dir)[2]
+    import_times = []
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        data_dict = import_ppd(file_path)
+        import_times.append(time.perf_counter() - t0)
+    return len(data_dict["analog_1"]), import_times
+
+
+def benchmark_preprocess(device_config, mode, duration, work_dir, n_repeats=5):
+    from data_import import import_ppd, preprocess_data
+
+    data_dict = import_ppd(run_process_data(device_config, mode, duration, "ppd", work_dir)[2])
+    preprocess_times = []
+    for i in range(n_repeats):
+        t0 = time.perf_counter()
+        preprocess_data(data_dict)
+        preprocess_times.append(time.perf_counter() - t0)
+    return len(data_dict["analog_1"]), preprocess_times
+
+
+def device_config_rate(device_config, mode):
+    """Maximum sampling rate for the mode, as Acquisition_board.set_mode."""
+    if mode.split("_")[-1] == "pulsed":
+        return device_config["max_sampling_rate"]["pulsed"] // (3 if mode == "3EX_2EM_pulsed" else 2)
+    return device_config["max_sampling_rate"]["continuous"]
+
+
+def run_stage(stage, device_config, mode, duration):
+    """Run benchmark stage, return dict of results.  Called in a new process."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        if stage.startswith("process_data"):
+            file_type = stage.split("_")[-1] if stage != "process_data" else None
+            n_samples, times = benchmark_process_data(device_config, mode, duration, work_dir, file_type)
+        elif stage == "Signals_plot.update":
+            n_samples, times = benchmark_plot(device_config, mode, duration, work_dir)
+        elif stage == "import_ppd":
+            n_samples, times = benchmark_import(device_config, mode, duration, work_dir)
+        elif stage == "preprocess_data":
+            n_samples, times = benchmark_preprocess(device_config, mode, duration, work_dir)
+    times = np.array(times)
+    total_time = np.sum(times) if stage.startswith(("process_data", "Signals_plot")) else np.median(times)
+    peak_rss = None
+    if resource:  # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << (20 if sys.platform == "darwin" else 10))
+    return {
+        "samples": int(n_samples),
+        "samples_per_s": n_samples / total_time,
+        "latency_ms": {f"p{p}": 1000 * np.percentile(times, p) for p in PERCENTILES},
+        "peak_rss_MB": peak_rss,
+    }
+
+
+def compare(results, previous_results):
+    """Print benchmarks which are slower than in previous_results, return number of regressions."""
+    previous = {(r["device"], r["mode"], r["stage"]): r for r in previous_results["results"]}
+    n_regressions = 0
+    for result in results["results"]:
+        prev = previous.get((result["device"], result["mode"], result["stage"]))
+        if not prev:
+            continue
+        throughput_ratio = result["samples_per_s"] / prev["samples_per_s"]
+        latency_ratio = result["latency_ms"]["p99"] / prev["latency_ms"]["p99"]
+        if throughput_ratio < 1 - REGRESSION_TOLERANCE or latency_ratio > 1 + REGRESSION_TOLERANCE:
+            n_regressions += 1
+            print(
+                f"Regression: {result['device']} {result['mode']} {result['stage']}, throughput "
+                f"{throughput_ratio:.2f}x, p99 latency {latency_ratio:.2f}x relative to v{previous_results['version']}"
+            )
+    print(f"{n_regressions} regressions compared with v{previous_results['version']} ({previous_results['date']})")
+    return n_regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pyPhotometry pipeline benchmark.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of data per benchmark.")
+    parser.add_argument("--output", type=Path, help="JSON results file.")
+    parser.add_argument("--compare", type=Path, help="Previous JSON results file to compare with.")
+    args = parser.parse_args()
+    date = datetime.now()
+    output = args.output or Path(__file__).parent / "results" / f"pipeline_v{VERSION}{date:-%Y-%m-%d-%H%M%S}.json"
+    results = {
+        "version": VERSION,
+        "date": date.isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "duration": args.duration,
+        "results": [],
+    }
+    print(
+        f"{'device':<20}{'mode':<20}{'stage':<21}{'samples/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'RSS MB':>8}"
+    )
+    for device_path in sorted(devices_dir.glob("*.json")):
+        with open(device_path, "r") as f:
+            device_config = json.load(f)
+        for mode in available_acquisition_modes:
+            for stage in STAGES:
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                    result = executor.submit(run_stage, stage, device_config, mode, args.duration).result()
+                result = {
+                    "device": device_path.stem,
+                    "mode": mode,
+                    "stage": stage,
+                    "sampling_rate": device_config_rate(device_config, mode),
+                    **result,
+                }
+                results["results"].append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{device_path.stem:<20}{mode:<20}{stage:<21}{result['samples_per_s']:12.3g}{latency['p50']:9.3f}"
+                    f"{latency['p99']:9.3f}{latency['p100']:9.3f}{result['peak_rss_MB'] or np.nan:8.0f}"
+                )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            sys.exit(1 if compare(results, json.load(f)) else 0)
@@ -0,0 +1,112 @@
+# Benchmark of plotting live data from multiple setups, comparing a plot widget per setup
+# with the signals of all setups drawn in a single OpenGL GraphicsLayoutWidget, using
+# simulated data.  Reports frame time and CPU time per frame vs number of setups.  Frames
+# are drawn by each backend in turn, so that changes in load on the computer during the
+# benchmark do not favour one backend.
+#
+# Usage: python benchmarks/render_benchmark.py [sampling_rate]
+# Set QT_QPA_PLATFORM=offscreen to run without a display, OpenGL is then not benchmarked.
+
+import sys
+import time
+import numpy as np
+import pyqtgraph as pg
+from pathlib import Path
+from pyqtgraph.Qt import QtWidgets
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from GUI.plotting import Signals_plot
+from config.GUI_config import display_fps
+
+
+class Setup_widget(QtWidgets.QWidget):
+    """Stands in for the Setupbox which is the parent of each Signals_plot."""
+
+    def is_running(self):
+        return False
+
+
+class Simulated_signals:
+    """Generates data in the format returned by Acquisition_board.process_data, with slow
+    oscillations and noise on 2 analog signals and periodic pulses on 2 digital inputs."""
+
+    def __init__(self, sampling_rate, seed):
+        self.sampling_rate = sampling_rate
+        self.rng = np.random.default_rng(seed)
+        self.n_samples = 0
+
+    def get_new_data(self, n_samples):
+        t = (self.n_samples + np.arange(n_samples)) / self.sampling_rate
+        self.n_samples += n_samples
+        signals = [
+            (15000 + 3000 * np.sin(2 * np.pi * 0.2 * t + a) + self.rng.normal(0, 300, n_samples)).astype(int)
+            for a in range(2)
+        ]
+        DIs = [((t % period) < 0.1).astype(int) for period in (1.7, 3.1)]
+        return signals, DIs, [False, False], [False, False]
+
+
+def create_setups(n_setups, batched, opengl, sampling_rate):
+    """Return a window plotting n_setups setups, and a list of (Signals_plot, Simulated_signals)."""
+    window = QtWidgets.QWidget()
+    window.resize(1000, 150 * n_setups)
+    layout = QtWidgets.QVBoxLayout(window)
+    plot_layout = None
+    if batched:
+        plot_layout = pg.GraphicsLayoutWidget()
+        plot_layout.useOpenGL(opengl)
+    setups = []
+    for s in range(n_setups):
+        setup_widget = Setup_widget(window)
+        signals_plot = Signals_plot(setup_widget, plot_layout=plot_layout)
+        QtWidgets.QVBoxLayout(setup_widget).addWidget(signals_plot)
+        layout.addWidget(setup_widget)
+        signals_plot.reset(sampling_rate)
+        setups.append((signals_plot, Simulated_signals(sampling_rate, seed=s)))
+    if batched:
+        layout.addWidget(plot_layout)
+    window.show()
+    for signals_plot, simulated_signals in setups:  # Fill histories.
+        signals_plot.update(simulated_signals.get_new_data(len(signals_plot.x)))
+    QtWidgets.QApplication.processEvents()
+    return window, setups
+
+
+def benchmark(n_setups, backends, sampling_rate, n_frames=150):
+    """Return the median frame time and median CPU time per frame (ms) plotting n_setups
+    setups at display_fps with each backend, each frame plotting the data recieved since the
+    previous frame.  Frames are drawn by each backend in turn so that changes in the load on
+    the computer affect all backends equally."""
+    windows = {backend: create_setups(n_setups, *options, sampling_rate) for backend, options in backends.items()}
+    samples_per_frame = int(sampling_rate / display_fps)
+    frame_times = {backend: [] for backend in backends}
+    cpu_times = {backend: [] for backend in backends}
+    for f in range(n_frames):
+        for backend, (window, setups) in windows.items():
+            t0, c0 = time.perf_counter(), time.process_time()
+            for signals_plot, simulated_signals in setups:
+                signals_plot.update(simulated_signals.get_new_data(samples_per_frame))
+            QtWidgets.QApplication.processEvents()  # Draw plots.
+            frame_times[backend].append(time.perf_counter() - t0)
+            cpu_times[backend].append(time.process_time() - c0)
+    for window, setups in windows.values():
+        window.close()
+        window.deleteLater()
+    QtWidgets.QApplication.processEvents()
+    return [(1000 * np.median(frame_times[backend]), 1000 * np.median(cpu_times[backend])) for backend in backends]
+
+
+if __name__ == "__main__":
+    sampling_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    app = pg.mkQApp()
+    backends = {"widgets": (False, False), "batched": (True, False)}
+    if app.platformName() != "offscreen":
+        backends["batched OpenGL"] = (True, True)
+    print(f"{sampling_rate} Hz, {display_fps} fps, frame interval {1000 / display_fps:.1f} ms")
+    print("Frame time (ms) / CPU time per frame (ms):")
+    print("setups" + "".join(f"{backend:>18}" for backend in backends))
+    for n_setups in (1, 2, 4, 6, 9):
+        times = benchmark(n_setups, backends, sampling_rate)
+        print(f"{n_setups:6}" + "".join(f"{frame_time:11.2f} /{cpu_time:5.1f}" for frame_time, cpu_time in times))
@@ -0,0 +1,59 @@
+# Benchmark of updating the signal histories used by the GUI plots, comparing the np.roll
+# based Signal_history from pyPhotometry v1.1 with the ring buffer Signal_history.
+#
+# Usage: python benchmarks/signal_history_benchmark.py
+
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+from GUI.plotting import Signal_history
+from config.GUI_config import history_dur, update_interval
+
+
+class Legacy_signal_history:
+    """Signal_history used by pyPhotometry v1.1."""
+
+    def __init__(self, history_length, dtype=float):
+        self.history = np.full(history_length, np.nan if dtype == float else 0, dtype)
+
+    def update(self, new_data):
+        data_len = len(new_data)
+        self.history = np.roll(self.history, -data_len)
+        self.history[-data_len:] = new_data
+
+
+def benchmark(history_class, sampling_rate, n_setups, n_updates=2000):
+    """Return the mean time (ms) to update the histories of all setups at each plot update,
+    with 3 analog signals and 2 digital inputs per setup as in Signals_plot."""
+    history_length = int(sampling_rate * history_dur)
+    samples_per_update = int(sampling_rate * update_interval / 1000)
+    rng = np.random.default_rng(0)
+    new_signal = rng.random(samples_per_update)
+    new_DI = rng.integers(0, 2, samples_per_update)
+    setups = [
+        ([history_class(history_length) for i in range(3)], [history_class(history_length, int) for i in range(2)])
+        for s in range(n_setups)
+    ]
+    t0 = time.perf_counter()
+    for u in range(n_updates):
+        for signals, DIs in setups:
+            for signal in signals:
+                signal.update(new_signal)
+                signal.history  # Accessed by setData.
+            for DI in DIs:
+                DI.update(new_DI)
+                DI.history  # Accessed by Pulse_shader and Event_triggered_plot.
+    return 1000 * (time.perf_counter() - t0) / n_updates
+
+
+if __name__ == "__main__":
+    sampling_rate, n_setups = 1000, 9
+    print(f"{sampling_rate} Hz, {n_setups} setups, {history_dur} s history, update every {update_interval} ms:")
+    for name, history_class in (("np.roll", Legacy_signal_history), ("ring buffer", Signal_history)):
+        ms_per_update = benchmark(history_class, sampling_rate, n_setups)
+        print(f"{name:>12}: {ms_per_update:7.3f} ms per update ({ms_per_update / update_interval:6.1%} of interval)")
@@ -0,0 +1,143 @@
+# Load test of acquiring and recording data from multiple setups using simulated boards,
+# which stream data in the same format as the pyboard over pseudo-terminals, so no hardware
+# is needed.  Runs the acquisition and recording pipeline without the GUI, then the full GUI
+# with simulated setups, and reports CPU load, read latency and data integrity.
+#
+# Usage: python benchmarks/simulated_load_benchmark.py [n_setups] [duration_s]
+# Set QT_QPA_PLATFORM=offscreen to run the GUI without a display.  Linux and macOS only.
+
+import sys
+import json
+import time
+import tempfile
+import numpy as np
+from pathlib import Path
+
+# Add pyPhotometry directory to sys.path so GUI modules can be imported.
+sys.path.append(str(Path(__file__).parents[1]))
+
+import config.GUI_config as GUI_config
+from GUI.dir_paths import devices_dir
+from GUI.simulated_board import Simulated_board, simulated_port_prefix
+
+MODE = "2EX_2EM_continuous"
+SAMPLING_RATE = 1000  # Hz
+DEVICE_TYPE = "pyPhotometry_v2.0"
+
+
+def recorded_samples(data_dir, n_signals):
+    """Return the number of samples per signal in each .ppd file in data_dir."""
+    n_samples = []
+    for file_path in sorted(Path(data_dir).glob("*.ppd")):
+        with open(file_path, "rb") as f:
+            header_size = int.from_bytes(f.read(2), "little")
+        n_samples.append((file_path.stat().st_size - 2 - header_size) // (2 * n_signals))
+    return n_samples
+
+
+def report(name, n_setups, duration, cpu_time, read_times, boards, data_dir):
+    """Print results of a benchmark run."""
+    expected = SAMPLING_RATE * duration
+    n_samples = recorded_samples(data_dir, boards[0].n_analog_signals)
+    assert len(n_samples) == n_setups, f"{len(n_samples)} data files recorded by {n_setups} setups."
+    print(f"{name}:")
+    print(f"  CPU load {cpu_time / duration:6.1%}, read interval {GUI_config.update_interval} ms")
+    if read_times:
+        read_times = 1000 * np.array(read_times)
+        print(
+            f"  Time to read all setups (ms): median {np.median(read_times):.2f}, "
+            f"99th percentile {np.percentile(read_times, 99):.2f}, max {np.max(read_times):.2f}"
+        )
+    print(f"  Samples recorded per setup: {min(n_samples)} - {max(n_samples)} ({expected:.0f} in benchmark duration)")
+    print(
+        f"  Bad checksums: {sum(board.chunk_parser.n_bad_checksums for board in boards)}, "
+        f"skipped chunks: {sum(board.chunk_parser.n_skipped_chunks for board in boards)}"
+    )
+
+
+def benchmark_pipeline(n_setups, duration, device_config):
+    """Acquire and record data from n_setups simulated boards, reading all boards every
+    update_interval as the GUI does but without plotting."""
+    data_dir = tempfile.mkdtemp()
+    boards = []
+    for i in range(n_setups):
+        board = Simulated_board(f"{simulated_port_prefix}{i + 1}", device_config, GUI_config.acquisition_thread)
+        board.set_mode(MODE)
+        board.set_sampling_rate(SAMPLING_RATE)
+        board.set_LED_current(*GUI_config.default_LED_current)
+        boards.append(board)
+    for i, board in enumerate(boards):
+        board.start(False)
+        board.record(data_dir, f"subject{i + 1}")
+    read_times = []
+    t_start, c_start = time.perf_counter(), time.process_time()
+    next_read = t_start
+    while time.perf_counter() - t_start < duration:
+        next_read += GUI_config.update_interval / 1000
+        time.sleep(max(next_read - time.perf_counter(), 0))
+        t0 = time.perf_counter()
+        for board in boards:
+            board.get_new_data()
+        read_times.append(time.perf_counter() - t0)
+    cpu_time = time.process_time() - c_start
+    for board in boards:
+        board.stop()
+        board.close()
+    report("Acquisition and recording without GUI", n_setups, duration, cpu_time, read_times, boards, data_dir)
+
+
+def benchmark_GUI(n_setups, duration):
+    """Acquire, plot and record data from n_setups simulated setups in the GUI."""
+    GUI_config.simulated_setups = n_setups
+    from pyqtgraph.Qt import QtWidgets, QtCore
+    from GUI.GUI_main import GUI_main
+    from GUI.utility import set_cbox_item
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    gui = GUI_main(app)
+    gui.show()
+    for setup in gui.setups_tab.setups.values():
+        setup.device_type = DEVICE_TYPE
+    acquisition_tab = gui.acquisition_tab
+    data_dir = tempfile.mkdtemp()
+    acquisition_tab.data_dir_text.setText(data_dir)
+    set_cbox_item(acquisition_tab.mode_select, MODE)
+    acquisition_tab.add_remove_setups(n_setups)
+    for i, box in enumerate(acquisition_tab.setupboxes):
+        set_cbox_item(box.port_select, f"{simulated_port_prefix}{i + 1}")
+        box.connect()
+    acquisition_tab.rate_spinbox.setValue(SAMPLING_RATE)
+    # Time each call to process_data.
+    read_times = []
+
+    def timed_process_data():
+        t0 = time.perf_counter()
+        acquisition_tab.process_data()
+        read_times.append(time.perf_counter() - t0)
+
+    acquisition_tab.update_timer.timeout.disconnect()
+    acquisition_tab.update_timer.timeout.connect(timed_process_data)
+    for i, box in enumerate(acquisition_tab.setupboxes):
+        box.subject_text.setText(f"subject{i + 1}")
+        box.start()
+        box.record(IDs_checked=True)
+    c_start = time.process_time()
+    event_loop = QtCore.QEventLoop()
+    QtCore.QTimer.singleShot(int(1000 * duration), event_loop.quit)
+    event_loop.exec()
+    cpu_time = time.process_time() - c_start
+    boards = [box.board for box in acquisition_tab.setupboxes]
+    for box in acquisition_tab.setupboxes:
+        box.stop()
+    report("GUI with plotting", n_setups, duration, cpu_time, read_times, boards, data_dir)
+    gui.close()  # Disconnects boards.
+
+
+if __name__ == "__main__":
+    n_setups = int(sys.argv[1]) if len(sys.argv) > 1 else 9
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with open(Path(devices_dir, DEVICE_TYPE + ".json"), "r") as f:
+        device_config = json.load(f)
+    print(f"{n_setups} setups, {MODE} at {SAMPLING_RATE} Hz, {duration} s")
+    benchmark_pipeline(n_setups, duration, device_config)
+    benchmark_GUI(n_setups, duration)
@@ -6,8 +6,19 @@ VERSION = "1.1"  # Version number of pyPhotometry.
 
 history_dur = 10  # Duration of plotted signal history (seconds)
 triggered_dur = [-3, 6.9]  # Window duration for event triggered signals (seconds pre, post)
-update_interval = 10  # How often plots are updated during acqusition (ms).
+triggered_heatmap_events = 30  # Number of most recent events shown in event triggered heatmap.
+update_interval = 10  # How often data is read from the boards during acqusition (ms).
+display_fps = 30  # How often plots are updated during acquisition (frames per second).
+compress_data = False  # Delta encode data sent by boards to reduce serial bandwidth, decoded before saving.
+chunk_timestamps = False  # Boards send the time of each data chunk, for measuring latency and clock drift.
+firmware_buffer_ms = 1000  # Data boards can buffer while sending is delayed (ms), limited by free RAM, 0 for 2 buffers.
+acquisition_thread = False  # Read and save data from each board in a background thread rather than the GUI thread.
 max_plot_pulses = 5  # Maximum number of pulses to plot on analog plot.
+plot_backend = "widgets"  # 'widgets' for a plot widget per setup, 'batched' to draw all setups' signals in one widget.
+plot_opengl = True  # Use OpenGL to draw the signals of all setups when plot_backend is 'batched'.
+plot_decimation = True  # Plot minimum and maximum of signals in bins of ~1 pixel, False to plot every sample.
+lowpass_zero_phase_dur = 0.5  # Duration of recent signal lowpass filtered with zero phase (seconds), 0 for causal only.
+simulated_setups = 0  # Number of simulated setups shown in the setups tab, for testing without hardware.
 
 default_LED_current = [10, 10]  # Channel [1, 2] (mA).
 
@@ -21,3 +32,5 @@ available_acquisition_modes = [  # Comment out modes to hide them in GUI dropdow
 ]
 
 default_filetype = "ppd"  # 'ppd' or 'csv'
+fsync_interval = 5  # How often data files are flushed to disk while recording (seconds), None to flush only at end.
+metrics_log_interval = None  # Seconds between logging metrics to a .metrics.jsonl file when recording, None to disable.
@@ -3,6 +3,13 @@
 
 import os
 import json
+import time
+import warnings
+import hashlib
+import zipfile
+from glob import glob
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pylab as plt
 import numpy as np
 from scipy.signal import butter, filtfilt, medfilt, decimate
@@ -15,12 +22,15 @@ from packaging.version import parse as parse_version
 # ----------------------------------------------------------------------------------
 
 
-def import_ppd(file_path, low_pass=20, high_pass=0.01):
+def import_ppd(file_path, low_pass=20, high_pass=0.01, cache=False, gaps_as_nan=False):
     """Function to import pyPhotometry binary data files into Python. The high_pass
     and low_pass arguments determine the frequency in Hz of highpass and lowpass
     filtering applied to the filtered analog signals. To disable highpass or lowpass
-    filtering set the respective argument to None.  Returns a dictionary with the
-    following items:
+    filtering set the respective argument to None.  If cache is True the filtered signals
+    and pulse indices are saved to a cache directory next to the data file and loaded from
+    there when the file is next imported, see PPDFile.  Data chunks lost during acquisition
+    are saved as zeros, if gaps_as_nan is True analog signals are NaN for these samples.
+    Returns a dictionary with the following items:
         'filename'      - Data filename
         'subject_ID'    - Subject ID
         'date_time'     - Recording start date and time (ISO 8601 format string)
@@ -41,96 +51,442 @@ def import_ppd(file_path, low_pass=20, high_pass=0.01):
             'digital_y'     - Digital signal
             'pulse_inds_y'  - Locations of rising edges on digital signal (samples).
             'pulse_times_y' - Times of rising edges on digital signal (ms).
+        'gaps'     - [chunk_number, sample_offset, n_samples] for each run of data chunks lost
+                     during acquisition, or None for files recorded without a .gaps.json file.
+        'gap_mask' - Samples in lost data chunks (bool).
+        'chunk_timing' - [sample, board_time, host_time] for each data chunk if the board sent
+                         chunk timestamps, else None.  sample is the index of the chunk's first
+                         sample, board_time the time of that sample on the board's clock (us) and
+                         host_time when the chunk was read by the computer (us since Unix epoch).
+    To load signals only when they are needed, use the PPDFile class.
     """
 
-    # Read data from file --------------------------------------------------------------
-    with open(file_path, "rb") as f:
-        header_size = int.from_bytes(f.read(2), "little")
-        data_header = f.read(header_size)
-        data = np.frombuffer(f.read(), dtype=np.dtype("<u2"))
-
-    # Extract header information -------------------------------------------------------
-    header_dict = json.loads(data_header)
-    sampling_rate = header_dict["sampling_rate"]
-    volts_per_division = header_dict["volts_per_division"][0]
-    acquisition_mode = header_dict["mode"]
-    version = parse_version(header_dict["version"])
-
-    # Get version specfic info ---------------------------------------------------------
-
-    if version < parse_version("1.0"):
-        n_analog_signals = 2
-        n_digital_signals = 2
-        pulsed_mode = "time div" in acquisition_mode
-    else:
-        n_analog_signals = header_dict["n_analog_signals"]
-        n_digital_signals = header_dict["n_digital_signals"]
-        pulsed_mode = "pulsed" in acquisition_mode
+    return PPDFile(file_path, low_pass, high_pass, cache, gaps_as_nan=gaps_as_nan).to_dict()
 
-    if version >= parse_version("1.1"):
-        has_baselines = pulsed_mode
-        ADC_max_value = header_dict["ADC_max_value"]
-    else:
-        has_baselines = False
-        ADC_max_value = 1 << 15
-
-    # Extract signals ------------------------------------------------------------------
-    analog = data >> 1  # Analog signal is most significant 15 bits.
-    digital = ((data & 1) == 1).astype(int)  # Digital signal is least significant bit.
-    clip_threshold = 0.98 * ADC_max_value * volts_per_division
-    if has_baselines:  # Raw LED-on and LED-off (baseline) samples saved seperately.
-        LED_on_sigs = [analog[2 * a :: 2 * n_analog_signals] * volts_per_division for a in range(n_analog_signals)]
-        baselines = [analog[2 * a + 1 :: 2 * n_analog_signals] * volts_per_division for a in range(n_analog_signals)]
-        # Compute baseline subtracted signals by subtracting baseline from LED-on signal.
-        analog_sigs = [LED_on_sig - baseline for LED_on_sig, baseline in zip(LED_on_sigs, baselines)]
-        # Identify any samples where signal is clipping
-        sigs_clipping = [
-            np.maximum(LED_on_sig, baseline) > clip_threshold for LED_on_sig, baseline in zip(LED_on_sigs, baselines)
-        ]
-        digital_sigs = [digital[2 * d :: 2 * n_analog_signals] for d in range(n_digital_signals)]
-    else:  # Any baseline subtraction was done before saving signals.
-        analog_sigs = [analog[a::n_analog_signals] * volts_per_division for a in range(n_analog_signals)]
-        digital_sigs = [digital[d::n_analog_signals] for d in range(n_digital_signals)]
-        sigs_clipping = [analog_sig > clip_threshold for analog_sig in analog_sigs] if not pulsed_mode else None
-
-    # Compute sample times relative to start of recording (ms) -------------------------
-    time = np.arange(analog_sigs[0].shape[0]) * 1000 / sampling_rate
-
-    # Filter signals with specified high and low pass frequencies (Hz) -----------------
-    if low_pass and high_pass:
-        b, a = butter(2, np.array([high_pass, low_pass]) / (0.5 * sampling_rate), "bandpass")
-    elif low_pass:
-        b, a = butter(2, low_pass / (0.5 * sampling_rate), "low")
-    elif high_pass:
-        b, a = butter(2, high_pass / (0.5 * sampling_rate), "high")
-    if low_pass or high_pass:
-        analogs_filt = [filtfilt(b, a, analog_sig) for analog_sig in analog_sigs]
-    else:
-        analogs_filt = [None] * len(analog_sigs)
 
-    # Extract rising edges for digital inputs ------------------------------------------
-    pulse_inds = [1 + np.where(np.diff(digital_sig) == 1)[0] for digital_sig in digital_sigs]
-    pulse_times = [pulse_ind * 1000 / sampling_rate for pulse_ind in pulse_inds]
+cache_dir_name = ".ppd_cache"  # Name of cache directory created in the data file's directory.
+max_cache_size = 1 << 30  # Bytes, least recently used files are deleted when cache exceeds this size.
 
-    # Return signals + header information as a dictionary ------------------------------
-    data_dict = {
-        "filename": os.path.basename(file_path),
-        "time": time,
-    }
-    for a in range(n_analog_signals):
-        data_dict[f"analog_{a+1}"] = analog_sigs[a]
-        data_dict[f"analog_{a+1}_filt"] = analogs_filt[a]
-        if has_baselines:
-            data_dict[f"analog_{a+1}_raw_LED_on"] = LED_on_sigs[a]
-            data_dict[f"analog_{a+1}_raw_baseline"] = baselines[a]
-        if sigs_clipping:
-            data_dict[f"analog_{a+1}_clipping"] = sigs_clipping[a]
-    for d in range(n_digital_signals):
-        data_dict[f"digital_{d+1}"] = digital_sigs[d]
-        data_dict[f"pulse_inds_{d+1}"] = pulse_inds[d]
-        data_dict[f"pulse_times_{d+1}"] = pulse_times[d]
-    data_dict.update(header_dict)
-    return data_dict
+
+class PPDFile(Mapping):
+    """Lazy interface to a pyPhotometry binary data file.  Items are accessed using the
+    same keys as the dictionary returned by import_ppd, e.g. ppd_file["analog_1"].  The data
+    section of the file is memory mapped rather than read into memory, and each signal is
+    only computed when it is first accessed, after which it is cached.  Filtering of analog
+    signals and extraction of digital pulses are only run if the respective items are used.
+    The high_pass, low_pass and gaps_as_nan arguments are as for import_ppd.
+
+    If cache is True, items that are slow to compute (filtered signals, pulse indices and
+    signal envelopes) are saved as .npy files in a cache directory, by default a directory
+    named cache_dir_name in the data file's directory, and loaded from there the next time
+    the file is opened.  Cache files are named using a hash of the data file's size,
+    modification time and contents, and filtered signals also by the filter settings, so
+    cache files for a data file that has changed are not used and are deleted when the file
+    is next opened.  When the cache directory exceeds max_cache_size bytes the least
+    recently used cache files are deleted."""
+
+    def __init__(self, file_path, low_pass=20, high_pass=0.01, cache=False, cache_dir=None, gaps_as_nan=False):
+        self.file_path = file_path
+        self.low_pass = low_pass
+        self.high_pass = high_pass
+        self.gaps_as_nan = gaps_as_nan
+        self.cache_dir = None  # Directory where cached items are saved, None if not caching.
+        if cache or cache_dir:
+            self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(file_path)), cache_dir_name)
+            self._file_hash = self._get_file_hash()
+            self._remove_stale_cache_files()
+
+        # Read header and memory map data ----------------------------------------------
+        with open(file_path, "rb") as f:
+            header_size = int.from_bytes(f.read(2), "little")
+            self.header_dict = json.loads(f.read(header_size))
+        self.data_offset = 2 + header_size  # Position of data in file (bytes).
+        n_values = (os.path.getsize(file_path) - self.data_offset) // 2
+        if n_values > 0:
+            self.data = np.memmap(
+                file_path, dtype=np.dtype("<u2"), mode="r", offset=self.data_offset, shape=(n_values,)
+            )
+        else:  # File contains no data.
+            self.data = np.zeros(0, dtype=np.dtype("<u2"))
+
+        # Extract header information -------------------------------------------------------
+        self.sampling_rate = self.header_dict["sampling_rate"]
+        self.volts_per_division = self.header_dict["volts_per_division"][0]
+        acquisition_mode = self.header_dict["mode"]
+        version = parse_version(self.header_dict["version"])
+
+        # Get version specfic info ---------------------------------------------------------
+        if version < parse_version("1.0"):
+            self.n_analog_signals = 2
+            self.n_digital_signals = 2
+            self.pulsed_mode = "time div" in acquisition_mode
+        else:
+            self.n_analog_signals = self.header_dict["n_analog_signals"]
+            self.n_digital_signals = self.header_dict["n_digital_signals"]
+            self.pulsed_mode = "pulsed" in acquisition_mode
+
+        if version >= parse_version("1.1"):
+            self.has_baselines = self.pulsed_mode
+            ADC_max_value = self.header_dict["ADC_max_value"]
+        else:
+            self.has_baselines = False
+            ADC_max_value = 1 << 15
+        self.clip_threshold = 0.98 * ADC_max_value * self.volts_per_division
+        # Number of data values per sample of each signal.
+        self.sample_stride = 2 * self.n_analog_signals if self.has_baselines else self.n_analog_signals
+        self.n_samples = len(self.data) // self.sample_stride  # Number of complete samples in file.
+
+        # Read location of lost data chunks from .gaps.json file saved with data file -----
+        try:
+            with open(os.path.splitext(file_path)[0] + ".gaps.json", "r") as f:
+                self.gaps = np.array(json.load(f)["gaps"], dtype=np.int64).reshape(-1, 3)
+        except FileNotFoundError:  # Recorded before gaps were saved.
+            self.gaps = None
+        timing_path = os.path.splitext(file_path)[0] + ".timing"
+        if os.path.exists(timing_path):  # Chunk timestamps saved as int64 [sample, board_time, host_time] rows.
+            self.chunk_timing = np.fromfile(timing_path, dtype=np.dtype("<i8")).reshape(-1, 3)
+        else:
+            self.chunk_timing = None
+
+        # Functions to compute each item, in the order returned by import_ppd -------------
+        self._item_funcs = {"filename": (self._filename,), "time": (self._time,)}
+        for a in range(self.n_analog_signals):
+            self._item_funcs[f"analog_{a+1}"] = (self._analog, a)
+            self._item_funcs[f"analog_{a+1}_filt"] = (self._analog_filt, a)
+            if self.has_baselines:
+                self._item_funcs[f"analog_{a+1}_raw_LED_on"] = (self._LED_on, a)
+                self._item_funcs[f"analog_{a+1}_raw_baseline"] = (self._baseline, a)
+            if self.has_baselines or not self.pulsed_mode:
+                self._item_funcs[f"analog_{a+1}_clipping"] = (self._clipping, a)
+        for d in range(self.n_digital_signals):
+            self._item_funcs[f"digital_{d+1}"] = (self._digital, d)
+            self._item_funcs[f"pulse_inds_{d+1}"] = (self._pulse_inds, d)
+            self._item_funcs[f"pulse_times_{d+1}"] = (self._pulse_times, d)
+        self._item_funcs["gaps"] = (self._gaps,)
+        self._item_funcs["gap_mask"] = (self._gap_mask,)
+        self._item_funcs["chunk_timing"] = (self._chunk_timing,)
+        self._cache = {}
+        self._nan_cache = {}  # Analog signals with gaps set to NaN.
+
+    # Mapping interface ---------------------------------------------------------------
+
+    def __getitem__(self, key):
+        if self.gaps_as_nan and key.startswith("analog") and not key.endswith("_clipping"):
+            if key not in self._nan_cache:
+                signal = self._get(key)
+                if signal is not None and self.gaps is not None and len(self.gaps):
+                    signal = signal.copy()
+                    signal[self._get("gap_mask")] = np.nan
+                self._nan_cache[key] = signal
+            return self._nan_cache[key]
+        return self._get(key)
+
+    def _get(self, key):
+        """Return item with lost data chunks as zeros, computing it if not already cached."""
+        if key in self._cache:
+            return self._cache[key]
+        if key in self._item_funcs:
+            func, *args = self._item_funcs[key]
+            self._cache[key] = self._compute(key, func, *args)
+            return self._cache[key]
+        return self.header_dict[key]
+
+    def __iter__(self):
+        yield from self._item_funcs
+        yield from (key for key in self.header_dict if key not in self._item_funcs)
+
+    def __len__(self):
+        return len(self._item_funcs) + len([key for key in self.header_dict if key not in self._item_funcs])
+
+    def to_dict(self):
+        """Compute all items and return them as a dictionary in the format returned by import_ppd."""
+        data_dict = {key: self[key] for key in self._item_funcs}
+        data_dict.update(self.header_dict)
+        return data_dict
+
+    def clear_cache(self):
+        """Discard all computed signals to free memory, cache files on disk are kept."""
+        self._cache = {}
+        self._nan_cache = {}
+
+    def envelope(self, key="analog_1", bin_samples=None):
+        """Return the minimum and maximum of a signal, e.g. "analog_1_filt", in consecutive
+        bins of bin_samples samples (default 1 second) as an array with shape [n_bins, 2], for
+        plotting an overview of a long recording."""
+        if bin_samples is None:
+            bin_samples = max(int(self.sampling_rate), 1)
+        envelope_key = f"{key}_envelope_{bin_samples}"
+        if envelope_key not in self._cache:
+            self._cache[envelope_key] = self._compute(envelope_key, self._envelope, key, bin_samples)
+        return self._cache[envelope_key]
+
+    # Sidecar cache -------------------------------------------------------------------
+
+    def _compute(self, key, func, *args):
+        """Compute item using func, loading it from the cache directory if it has been saved
+        there previously, and saving it if not."""
+        if not self.cache_dir or not (key.startswith("pulse_inds_") or "_filt" in key or "_envelope_" in key):
+            return func(*args)
+        cache_path = self._cache_path(key)
+        try:
+            value = np.load(cache_path)
+            os.utime(cache_path)  # Mark file as recently used.
+            return value
+        except (OSError, ValueError):  # Not in cache or unreadable.
+            pass
+        value = func(*args)
+        if value is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"  # Write then rename so readers never see partial files.
+                with open(temp_path, "wb") as f:
+                    np.save(f, value)
+                os.replace(temp_path, cache_path)
+                _evict_cache_files(self.cache_dir)
+            except OSError as e:
+                warnings.warn(f"Unable to save to cache directory {self.cache_dir}: {e}")
+        return value
+
+    def _cache_path(self, key):
+        if "_filt" in key:  # Filtered signals also depend on filter settings.
+            key += f"_lp{self.low_pass}_hp{self.high_pass}"
+        return os.path.join(self.cache_dir, f"{os.path.basename(self.file_path)}-{self._file_hash}-{key}.npy")
+
+    def _get_file_hash(self):
+        """Hash identifying the version of the data file, computed from its size, modification
+        time and the data at the start and end of the file, so large files are not read in full."""
+        stat = os.stat(self.file_path)
+        file_hash = hashlib.blake2b(f"{stat.st_size} {stat.st_mtime_ns}".encode(), digest_size=8)
+        with open(self.file_path, "rb") as f:
+            file_hash.update(f.read(1 << 16))
+            f.seek(max(stat.st_size - (1 << 16), 0))
+            file_hash.update(f.read())
+        return file_hash.hexdigest()
+
+    def _remove_stale_cache_files(self):
+        """Delete cache files for previous versions of the data file."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        prefix = os.path.basename(self.file_path) + "-"
+        for entry in os.scandir(self.cache_dir):
+            file_hash = entry.name[len(prefix) : len(prefix) + len(self._file_hash)]
+            if entry.name.startswith(prefix) and entry.name.endswith(".npy") and file_hash != self._file_hash:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    # Windowed access -----------------------------------------------------------------
+
+    def read_samples(self, start, stop):
+        """Read samples [start, stop) directly from the file without decoding the rest of the
+        file.  Returns a dictionary with the 'time', 'analog_x', 'analog_x_raw_LED_on',
+        'analog_x_raw_baseline', 'analog_x_clipping' and 'digital_y' items of import_ppd
+        for the window, and 'pulse_inds_y' and 'pulse_times_y' for rising edges within the
+        window, indexed from the start of the file.  Filtered signals are not included as they
+        depend on the whole recording."""
+        start, stop, _ = slice(start, stop).indices(self.n_samples)
+        stop = max(start, stop)
+        prev_start = max(start - 1, 0)  # Previous sample is used to detect rising edge at start.
+        samples = np.asarray(self.data[prev_start * self.sample_stride : stop * self.sample_stride])
+        samples_dict = self._decode_samples(samples.reshape(-1, self.sample_stride), prev_start)
+        window_dict = {key: value[start - prev_start :] for key, value in samples_dict.items()}
+        for d in range(self.n_digital_signals):
+            pulse_inds = prev_start + 1 + np.where(np.diff(samples_dict[f"digital_{d+1}"]) == 1)[0]
+            window_dict[f"pulse_inds_{d+1}"] = pulse_inds
+            window_dict[f"pulse_times_{d+1}"] = pulse_inds * 1000 / self.sampling_rate
+        return window_dict
+
+    def read_time_window(self, start_time, stop_time):
+        """Read the samples with times in [start_time, stop_time) (ms) from the file, returns a
+        dictionary in the format returned by read_samples."""
+        return self.read_samples(
+            int(np.ceil(start_time * self.sampling_rate / 1000)), int(np.ceil(stop_time * self.sampling_rate / 1000))
+        )
+
+    def read_windows(self, sample_inds, window):
+        """Read windows of samples around many sample indices, e.g. ppd_file["pulse_inds_1"],
+        from the file with a single gather.  window is [start, stop) in samples relative to each
+        index, e.g. [-1000, 2000].  Returns a dictionary with a 'time' item giving the time of
+        each sample relative to the index (ms), and 'analog_x', 'analog_x_raw_LED_on',
+        'analog_x_raw_baseline', 'analog_x_clipping' and 'digital_y' items as 2D arrays with
+        one row per window.  Samples outside the recording, which is all samples if the file
+        contains no data, are NaN for analog signals and 0 for digital signals."""
+        sample_inds = np.asarray(sample_inds, dtype=int)
+        window_samples = sample_inds[:, None] + np.arange(window[0], window[1])[None, :]
+        in_file = (window_samples >= 0) & (window_samples < self.n_samples)
+        value_inds = np.clip(window_samples, 0, max(self.n_samples - 1, 0))[..., None] * self.sample_stride
+        data = self.data if self.n_samples else np.zeros(self.sample_stride, dtype=self.data.dtype)
+        samples = data[value_inds + np.arange(self.sample_stride)]
+        windows_dict = self._decode_samples(samples, 0)
+        windows_dict["time"] = np.arange(window[0], window[1]) * 1000 / self.sampling_rate
+        for key, value in windows_dict.items():
+            if key.startswith("analog") and not key.endswith("clipping"):
+                value[~in_file] = np.nan
+            elif key != "time":
+                value[~in_file] = 0
+        return windows_dict
+
+    def _decode_samples(self, samples, first_sample):
+        """Extract signals from an array of samples with shape [..., sample_stride], where
+        first_sample is the sample number of the first sample in the array."""
+        samples_dict = {"time": (first_sample + np.arange(samples.shape[-2])) * 1000 / self.sampling_rate}
+        for a in range(self.n_analog_signals):
+            if self.has_baselines:
+                LED_on_sig = self._to_volts(samples[..., 2 * a])
+                baseline = self._to_volts(samples[..., 2 * a + 1])
+                samples_dict[f"analog_{a+1}"] = LED_on_sig - baseline
+                samples_dict[f"analog_{a+1}_raw_LED_on"] = LED_on_sig
+                samples_dict[f"analog_{a+1}_raw_baseline"] = baseline
+                samples_dict[f"analog_{a+1}_clipping"] = np.maximum(LED_on_sig, baseline) > self.clip_threshold
+            else:
+                samples_dict[f"analog_{a+1}"] = self._to_volts(samples[..., a])
+                if not self.pulsed_mode:
+                    samples_dict[f"analog_{a+1}_clipping"] = samples_dict[f"analog_{a+1}"] > self.clip_threshold
+        for d in range(self.n_digital_signals):
+            samples_dict[f"digital_{d+1}"] = self._to_digital(samples[..., 2 * d if self.has_baselines else d])
+        return samples_dict
+
+    def _to_volts(self, values):
+        # Analog signal is most significant 15 bits.
+        return (values >> 1) * self.volts_per_division
+
+    def _to_digital(self, values):
+        # Digital signal is least significant bit.
+        return ((values & 1) == 1).astype(int)
+
+    # Functions to compute items ------------------------------------------------------
+
+    def _filename(self):
+        return os.path.basename(self.file_path)
+
+    def _time(self):
+        # Sample times relative to start of recording (ms).
+        n_samples = len(range(0, len(self.data), self.sample_stride))
+        return np.arange(n_samples) * 1000 / self.sampling_rate
+
+    def _LED_on(self, a):
+        # Analog signal with LED on before baseline subtraction (volts).
+        return self._to_volts(self.data[2 * a :: self.sample_stride])
+
+    def _baseline(self, a):
+        # Analog signal with LED off (volts).
+        return self._to_volts(self.data[2 * a + 1 :: self.sample_stride])
+
+    def _analog(self, a):
+        if self.has_baselines:  # Subtract baseline from LED-on signal.
+            return self._get(f"analog_{a+1}_raw_LED_on") - self._get(f"analog_{a+1}_raw_baseline")
+        else:  # Any baseline subtraction was done before saving signals.
+            return self._to_volts(self.data[a :: self.sample_stride])
+
+    def _clipping(self, a):
+        # Samples where analog signal was clipping.
+        if self.has_baselines:
+            LED_on_sig = self._get(f"analog_{a+1}_raw_LED_on")
+            baseline = self._get(f"analog_{a+1}_raw_baseline")
+            return np.maximum(LED_on_sig, baseline) > self.clip_threshold
+        else:
+            return self._get(f"analog_{a+1}") > self.clip_threshold
+
+    def _analog_filt(self, a):
+        # Filter signal with specified high and low pass frequencies (Hz).
+        filter_coefs = self._filter_coefs()
+        if filter_coefs is None:
+            return None
+        return filtfilt(*filter_coefs, self._get(f"analog_{a+1}"))
+
+    def _filter_coefs(self):
+        if self.low_pass and self.high_pass:
+            return butter(2, np.array([self.high_pass, self.low_pass]) / (0.5 * self.sampling_rate), "bandpass")
+        elif self.low_pass:
+            return butter(2, self.low_pass / (0.5 * self.sampling_rate), "low")
+        elif self.high_pass:
+            return butter(2, self.high_pass / (0.5 * self.sampling_rate), "high")
+
+    def _digital(self, d):
+        return self._to_digital(self.data[2 * d if self.has_baselines else d :: self.sample_stride])
+
+    def _pulse_inds(self, d):
+        # Locations of rising edges on digital signal (samples).
+        return 1 + np.where(np.diff(self._get(f"digital_{d+1}")) == 1)[0]
+
+    def _pulse_times(self, d):
+        # Times of rising edges on digital signal (ms).
+        return self._get(f"pulse_inds_{d+1}") * 1000 / self.sampling_rate
+
+    def _gaps(self):
+        return self.gaps
+
+    def _chunk_timing(self):
+        return self.chunk_timing
+
+    def _gap_mask(self):
+        # Samples in lost data chunks.
+        gap_mask = np.zeros(len(range(0, len(self.data), self.sample_stride)), bool)
+        if self.gaps is not None:
+            for chunk_number, sample_offset, n_samples in self.gaps:
+                gap_mask[sample_offset : sample_offset + n_samples] = True
+        return gap_mask
+
+    def _envelope(self, key, bin_samples):
+        signal = self._get(key)
+        if signal is None:
+            return None
+        bin_starts = np.arange(0, len(signal), bin_samples)
+        if len(bin_starts) == 0:
+            return np.zeros((0, 2))
+        return np.column_stack([np.minimum.reduceat(signal, bin_starts), np.maximum.reduceat(signal, bin_starts)])
+
+
+def _evict_cache_files(cache_dir, max_size=None):
+    """Delete the least recently used files in the cache directory until its total size is
+    below max_size (default max_cache_size) bytes."""
+    if max_size is None:
+        max_size = max_cache_size
+    cache_files = []  # [(last_used_time, size, path)]
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy"):
+            stat = entry.stat()
+            cache_files.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in cache_files)
+    for _, size, path in sorted(cache_files):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:  # File in use or already deleted.
+            pass
+
+
+def iter_ppd(file_path, block_samples=100000):
+    """Generator which reads a pyPhotometry binary data file in blocks of block_samples
+    samples, so that files larger than memory can be processed with constant memory use.
+    Yields a dictionary for each block with the 'time', 'analog_x', 'analog_x_raw_LED_on',
+    'analog_x_raw_baseline', 'analog_x_clipping' and 'digital_y' items of import_ppd for
+    the samples in the block, and 'pulse_inds_y' and 'pulse_times_y' for rising edges in the
+    block, indexed from the start of the file.  The last digital sample of each block is kept
+    so rising edges at the start of the next block are detected, concatenating the pulse
+    indices from all blocks gives the same result as import_ppd."""
+    ppd_file = PPDFile(file_path, low_pass=None, high_pass=None)
+    stride = ppd_file.sample_stride
+    prev_digital = None  # Last digital sample of previous block.
+    with open(file_path, "rb") as f:
+        f.seek(ppd_file.data_offset)
+        for first_sample in range(0, ppd_file.n_samples, block_samples):
+            n_samples = min(block_samples, ppd_file.n_samples - first_sample)
+            samples = np.fromfile(f, dtype=np.dtype("<u2"), count=n_samples * stride).reshape(n_samples, stride)
+            block_dict = ppd_file._decode_samples(samples, first_sample)
+            for d in range(ppd_file.n_digital_signals):
+                digital = block_dict[f"digital_{d+1}"]
+                if prev_digital is None:  # First sample of file cannot be a rising edge.
+                    rising_edges = np.where(np.diff(digital) == 1)[0] + 1
+                else:
+                    rising_edges = np.where(np.diff(digital, prepend=prev_digital[d]) == 1)[0]
+                block_dict[f"pulse_inds_{d+1}"] = first_sample + rising_edges
+                block_dict[f"pulse_times_{d+1}"] = block_dict[f"pulse_inds_{d+1}"] * 1000 / ppd_file.sampling_rate
+            prev_digital = [block_dict[f"digital_{d+1}"][-1] for d in range(ppd_file.n_digital_signals)]
+            yield block_dict
 
 
 # ----------------------------------------------------------------------------------
@@ -283,3 +639,76 @@ def _double_exponential(t, const, amp_fast, amp_slow, tau_fast, tau_slow):
         tau_slow: Time constant of slow component in seconds.
     """
     return const + amp_slow * np.exp(-t / tau_slow) + amp_fast * np.exp(-t / tau_fast)
+
+
+# ----------------------------------------------------------------------------------
+# Batch processing
+# ----------------------------------------------------------------------------------
+
+
+def batch_process(directory, n_workers=None, results_path=None, **preprocess_kwargs):
+    """Import and preprocess all .ppd files in a directory using a pool of n_workers
+    processes (default one per CPU).  Keyword arguments other than n_workers and
+    results_path are passed to preprocess_data (plot and fig_path are not supported).
+    Preprocessed signals are saved as float32 arrays in an .npz file at results_path
+    (default 'preprocessed.npz' in the directory) as each file finishes, and can be loaded
+    using np.load(results_path)[filename].  A line is printed for each file as it finishes.
+    Returns a summary table as a list of dicts, one per file, with items:
+        'filename'        - Data filename
+        'error'           - Error message if processing failed, else None
+        'n_samples'       - Number of samples in the processed signal
+        'import_time'     - Time taken to open the file and read the signals used (seconds)
+        'preprocess_time' - Time taken by preprocess_data (seconds)
+    On Windows, calls to batch_process must be inside an if __name__ == "__main__": block
+    of the calling script so the worker processes can be started."""
+    if results_path is None:
+        results_path = os.path.join(directory, "preprocessed.npz")
+    summary = []
+    with zipfile.ZipFile(results_path, "w", compression=zipfile.ZIP_DEFLATED) as results_file:
+        for result in iter_batch_process(directory, n_workers, **preprocess_kwargs):
+            signal_norm = result.pop("signal_norm")
+            if signal_norm is not None:  # Save as .npy file in .npz archive.
+                with results_file.open(result["filename"][:-4] + ".npy", "w") as npy_file:
+                    np.lib.format.write_array(npy_file, signal_norm.astype(np.float32))
+            summary.append(result)
+            status = f"Error: {result['error']}" if result["error"] else f"{result['preprocess_time']:.2f}s"
+            print(f"{len(summary)}: {result['filename']} {status}")
+    return summary
+
+
+def iter_batch_process(directory, n_workers=None, **preprocess_kwargs):
+    """Generator which imports and preprocesses all .ppd files in a directory using a pool of
+    n_workers processes, yielding a dict for each file in the order they finish, with the
+    items described in batch_process plus 'signal_norm', the preprocessed signal or None if
+    processing failed."""
+    file_paths = sorted(glob(os.path.join(directory, "*.ppd")))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(_batch_process_file, file_path, preprocess_kwargs) for file_path in file_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _batch_process_file(file_path, preprocess_kwargs):
+    """Import and preprocess one file, called in worker process by iter_batch_process."""
+    result = {
+        "filename": os.path.basename(file_path),
+        "error": None,
+        "n_samples": 0,
+        "import_time": 0,
+        "preprocess_time": 0,
+        "signal_norm": None,
+    }
+    try:
+        t0 = time.perf_counter()
+        ppd_file = PPDFile(file_path)  # Only the signals used by preprocess_data are loaded.
+        for key in (preprocess_kwargs.get("signal", "analog_1"), preprocess_kwargs.get("control", "analog_2")):
+            if isinstance(key, str):  # Read signal from file now so it is included in import_time.
+                ppd_file[key]
+        result["import_time"] = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        result["signal_norm"] = preprocess_data(data_dict=ppd_file, **preprocess_kwargs)
+        result["preprocess_time"] = time.perf_counter() - t0
+        result["n_samples"] = len(result["signal_norm"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
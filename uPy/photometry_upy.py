@@ -5,10 +5,22 @@
 import micropython
 import pyb
 import gc
+import struct
 from array import array
+from micropython import const
 
 micropython.alloc_emergency_exception_buf(100)  # Allocate space for error messages raised during interrupt processing.
 
+# Opcodes of binary commands from the host, see Photometry.serve.  Must match command_opcodes
+# in acquisition_board.py.
+_PING = const(0)
+_SET_MODE = const(1)
+_SET_LED_CURRENT = const(2)
+_UNIQUE_ID = const(3)
+_MEM_FREE = const(4)
+_BENCHMARK = const(5)
+_START = const(6)
+
 # Photometry class.
 
 
@@ -20,12 +32,14 @@ class Photometry:
         self.LED1 = pyb.DAC(1, bits=12)
         self.LED2 = pyb.DAC(2, bits=12)
         self.LED3 = None
+        self.LED_values = array("H", [0, 0, 1])  # Value written to each LED to turn it on.
         self.ovs_buffer = array("H", [0] * 64)  # Oversampling buffer
         self.ovs_timer = pyb.Timer(2)  # Oversampling timer.
         self.sampling_timer = pyb.Timer(3)
         self.usb_serial = pyb.USB_VCP()
         self.running = False
         self.unique_id = int.from_bytes(pyb.unique_id(), "little")
+        self.start_args = None  # Arguments for start when start command has been acknowledged.
 
     def set_mode(self, mode):
         # Set the acquisition mode.
@@ -45,6 +59,12 @@ class Photometry:
             self.LED3 = None
             self.n_digital_signals = 2
             self.n_analog_signals = 2
+        # Tables of the ADC read and LED used for each channel in pulsed modes.
+        if self.mode == "2EX_1EM_pulsed":
+            self.channel_ADCs = (self.ADC1, self.ADC1)
+        else:
+            self.channel_ADCs = (self.ADC1, self.ADC2, self.ADC1)[: self.n_analog_signals]
+        self.channel_LEDs = (self.LED1.write, self.LED2.write, self.LED3.value if self.LED3 else None)
 
     def set_LED_current(self, LED_1_current=None, LED_2_current=None):
         # Set the LED current.
@@ -55,6 +75,7 @@ class Photometry:
                 self.LED_1_value = int(
                     self.config["LED_calibration"]["slope"] * LED_1_current + self.config["LED_calibration"]["offset"]
                 )
+            self.LED_values[0] = self.LED_1_value
             if self.running and (self.mode == "2EX_2EM_continuous"):
                 self.LED1.write(self.LED_1_value)
         if LED_2_current is not None:
@@ -64,37 +85,13 @@ class Photometry:
                 self.LED_2_value = int(
                     self.config["LED_calibration"]["slope"] * LED_2_current + self.config["LED_calibration"]["offset"]
                 )
+            self.LED_values[1] = self.LED_2_value
             if self.running and (self.mode == "2EX_2EM_continuous"):
                 self.LED2.write(self.LED_2_value)
 
-    def start(self, sampling_rate, buffer_size, sync_out=False):
+    def start(self, sampling_rate, buffer_size, sync_out=False, compress=False, timestamps=False, n_buffers=None):
         # Start acquisition, stream data to computer, wait for ctrl+c over serial to stop.
-        self.buffer_size = buffer_size
-        self.sample_buffers = (array("H", [0] * buffer_size), array("H", [0] * buffer_size))
-        self.buffer_data_mv = (memoryview(self.sample_buffers[0]), memoryview(self.sample_buffers[1]))
-        self.chunk_header = array("H", [0, 0])
-        self.channel = 0  # Channel to read next
-        self.sample = 0  # Latest data sample
-        self.baseline = 0  # Latest baseline sample
-        self.dig_sample = False  # Latest digital sample
-        self.write_buf = 0  # Buffer to write data to.
-        self.send_buf = 1  # Buffer to send data from.
-        self.write_ind = 0  # Buffer index to write new data to.
-        self.buffer_ready = False  # Set to True when full buffer is ready to send.
-        self.chunk_number = 0  # Number of data chunks sent to computer, modulo 2**16.
-        self.sync_out = sync_out
-        if self.sync_out:  # Digital 1 pin used to output sync pulses.
-            self.sync_pin = pyb.Pin(self.config["pins"]["digital_1"], pyb.Pin.OUT, pyb.Pin.PULL_DOWN)
-            self.sync_pulse_state = False
-            self.sync_counter = 0
-            self.sync_next_IPI = 0
-            # Compute pulse duration and inter-pulse-intervals in sample.
-            self.sync_pulse_dur = int(sampling_rate * self.sync_out["pulse_duration_ms"] / 1000)
-            self.sync_min_IPI = int(sampling_rate * self.sync_out["inter_pulse_interval_ms"][0] / 1000)
-            self.sync_max_IPI = int(sampling_rate * self.sync_out["inter_pulse_interval_ms"][1] / 1000)
-            self.sync_rng_divisor = int((1 << 30) / (self.sync_max_IPI - self.sync_min_IPI))
-        else:  # Digital 1 pin used as an input.
-            self.DI1 = pyb.Pin(self.config["pins"]["digital_1"], pyb.Pin.IN, pyb.Pin.PULL_DOWN)
+        self._setup(sampling_rate, buffer_size, sync_out, compress, timestamps, n_buffers)
         self.running = True
         self.ovs_timer.init(freq=self.oversampling_rate)
         self.usb_serial.setinterrupt(-1)  # Disable serial interrupt.
@@ -109,7 +106,7 @@ class Photometry:
             self.sampling_timer.init(freq=sampling_rate * self.n_analog_signals)
             self.sampling_timer.callback(self.pulsed_ISR)
         while True:
-            if self.buffer_ready:
+            if self.n_ready:
                 self._send_buffer()
             if self.usb_serial.any():
                 self.recieved_byte = self.usb_serial.read(1)
@@ -121,6 +118,54 @@ class Photometry:
                     self.set_LED_current(LED_2_current=int.from_bytes(self.usb_serial.read(2), "little"))
         self.stop()
 
+    def _setup(self, sampling_rate, buffer_size, sync_out=False, compress=False, timestamps=False, n_buffers=None):
+        # Allocate buffers and initialise variables used during acquisition.  Samples are written
+        # to a ring of n_buffers buffers (default 2) so data is not lost if sending is delayed,
+        # if n_buffers is specified the number of buffers lost as all were waiting to be sent is
+        # included in the chunk header.
+        self.buffer_size = buffer_size
+        self.n_buffers = n_buffers or 2
+        self.sample_buffers = tuple(array("H", [0] * buffer_size) for i in range(self.n_buffers))
+        self.buffer_data_mv = tuple(memoryview(sample_buffer) for sample_buffer in self.sample_buffers)
+        self.buffer_chunk_numbers = array("H", [0] * self.n_buffers)  # Chunk number of each full buffer.
+        self.buffer_start_us = array("L", [0] * self.n_buffers)  # Time of first sample in buffers (us, mod 2**30).
+        self.timestamps = timestamps
+        self.send_overruns = bool(n_buffers)
+        self.timestamp_ind = 3 if self.send_overruns else 2  # Position of timestamp in chunk header.
+        self.chunk_header = array("H", [0] * (self.timestamp_ind + (2 if timestamps else 0)))
+        self.compress = compress
+        if self.compress:  # Preallocate buffer for compressed chunks and views of it for each bit width.
+            self.sample_stride = 2 if self.mode == "2EX_2EM_continuous" else 2 * self.n_analog_signals
+            n_deltas = buffer_size - self.sample_stride
+            header_bytes = 2 + 2 * len(self.chunk_header) + 2 * self.sample_stride
+            self.compressed_buffer = bytearray(header_bytes + 2 * n_deltas)
+            compressed_mv = memoryview(self.compressed_buffer)
+            self.compressed_mvs = [compressed_mv[: header_bytes + (n_deltas * n_bits + 7) // 8] for n_bits in range(17)]
+        self.channel = 0  # Channel to read next
+        self.write_buf = 0  # Buffer to write data to.
+        self.send_buf = 0  # Buffer to send data from.
+        self.write_ind = 0  # Buffer index to write new data to.
+        self.n_ready = 0  # Number of full buffers waiting to be sent.
+        self.n_overruns = 0  # Number of full buffers discarded as all buffers were waiting to be sent.
+        self.chunk_number = 0  # Number of data chunks acquired, modulo 2**16.
+        self.sync_out = sync_out
+        if self.sync_out:  # Digital 1 pin used to output sync pulses.
+            self.sync_pin = pyb.Pin(self.config["pins"]["digital_1"], pyb.Pin.OUT, pyb.Pin.PULL_DOWN)
+            self.sync_pulse_state = False
+            self.sync_counter = 0
+            self.sync_next_IPI = 0
+            # Compute pulse duration and inter-pulse-intervals in sample.
+            self.sync_pulse_dur = int(sampling_rate * self.sync_out["pulse_duration_ms"] / 1000)
+            self.sync_min_IPI = int(sampling_rate * self.sync_out["inter_pulse_interval_ms"][0] / 1000)
+            self.sync_max_IPI = int(sampling_rate * self.sync_out["inter_pulse_interval_ms"][1] / 1000)
+            self.sync_rng_divisor = int((1 << 30) / (self.sync_max_IPI - self.sync_min_IPI))
+            self.DI1_value = self._sync_pulse_DI
+        else:  # Digital 1 pin used as an input.
+            self.DI1 = pyb.Pin(self.config["pins"]["digital_1"], pyb.Pin.IN, pyb.Pin.PULL_DOWN)
+            self.DI1_value = self.DI1.value
+        # Function returning the digital sample stored with each channel in pulsed modes.
+        self.channel_DIs = (self.DI1_value, self.DI2.value if self.DI2 else self._no_DI, self._no_DI)
+
     def stop(self):
         # Stop aquisition
         self.sampling_timer.deinit()
@@ -131,6 +176,117 @@ class Photometry:
         self.usb_serial.setinterrupt(3)  # Enable serial interrupt.
         gc.enable()
 
+    def serve(self):
+        # Execute binary commands sent by the host until ctrl+c is recieved.  Each command is the
+        # byte b'\xFC' followed by a 1 byte request ID, 1 byte opcode, 1 byte payload length and
+        # the payload.  Each command is acknowledged with the byte b'\xFB' followed by the request
+        # ID, a 1 byte status (0 OK, 1 error), the response length as a 2 byte integer and the
+        # response, which is the command's return value or the error message.  The start command
+        # is acknowledged before acquisition starts, and commands are served again once stopped.
+        self.usb_serial.setinterrupt(-1)  # Recieve ctrl+c as a byte.
+        while True:
+            if not self.usb_serial.any():
+                pyb.wfi()  # Sleep until next interrupt.
+                continue
+            recieved_byte = self.usb_serial.read(1)
+            if recieved_byte == b"\x03":  # ctrl+c, return to REPL.
+                break
+            elif recieved_byte != b"\xFC":  # Not the start of a command.
+                continue
+            command_header = self.usb_serial.recv(3, timeout=100)
+            if len(command_header) < 3:
+                continue
+            request_id, opcode, n_bytes = command_header
+            payload = self.usb_serial.recv(n_bytes, timeout=100) if n_bytes else b""
+            try:
+                if len(payload) < n_bytes:
+                    raise ValueError("Incomplete command.")
+                response = self._command(opcode, payload) or b""
+                status = 0
+            except Exception as e:
+                response = repr(e).encode()
+                status = 1
+            self.usb_serial.write(b"\xFB" + bytes([request_id, status]) + len(response).to_bytes(2, "little"))
+            self.usb_serial.write(response)
+            if self.start_args:  # Acquire data until host sends stop signal.
+                start_args, self.start_args = self.start_args, None
+                self.start(*start_args)
+                self.usb_serial.setinterrupt(-1)
+        self.usb_serial.setinterrupt(3)
+
+    def _command(self, opcode, payload):
+        # Execute a command recieved by serve, return the response bytes.
+        if opcode == _SET_MODE:
+            self.set_mode(payload.decode())
+        elif opcode == _SET_LED_CURRENT:  # 0xFFFF leaves the LED's current unchanged.
+            LED_1_current, LED_2_current = struct.unpack("<HH", payload)
+            self.set_LED_current(
+                None if LED_1_current == 0xFFFF else LED_1_current, None if LED_2_current == 0xFFFF else LED_2_current
+            )
+        elif opcode == _UNIQUE_ID:
+            return self.unique_id.to_bytes(12, "little")
+        elif opcode == _MEM_FREE:
+            return struct.pack("<I", self.mem_free())
+        elif opcode == _BENCHMARK:
+            return repr(self.benchmark()).encode()
+        elif opcode == _START:  # Flags are compress, timestamps and sync_out bits.
+            rate, buffer_size, n_buffers, flags, pulse_dur, min_IPI, max_IPI = struct.unpack("<IHHBHHH", payload)
+            sync_out = False
+            if flags & 4:
+                sync_out = {"pulse_duration_ms": pulse_dur, "inter_pulse_interval_ms": [min_IPI, max_IPI]}
+            self.start_args = (rate, buffer_size, sync_out, bool(flags & 1), bool(flags & 2), n_buffers or None)
+        elif opcode != _PING:
+            raise ValueError("Invalid opcode.")
+
+    def benchmark(self, n_calls=500, max_load=0.8):
+        # Measure the time taken by the interrupt service routine and by computing the checksum
+        # and compressing each buffer, per ISR call, in each acquisition mode.  Returns a dict
+        # giving these times (us) and the maximum sampling rates at which acquisition uses
+        # max_load of the processor time, leaving the rest for sending data to the host.  The
+        # LEDs are pulsed at the current LED values in pulsed modes.
+        results = {}
+        mode = getattr(self, "mode", None)
+        for benchmark_mode in ["2EX_2EM_continuous", "2EX_1EM_pulsed", "2EX_2EM_pulsed", "3EX_2EM_pulsed"]:
+            self.set_mode(benchmark_mode)
+            calls_per_sample = 1 if benchmark_mode == "2EX_2EM_continuous" else self.n_analog_signals
+            self._setup(1000, 2 * n_calls, compress=True)  # Each ISR call writes 2 values.
+            ISR = self.continuous_ISR if benchmark_mode == "2EX_2EM_continuous" else self.pulsed_ISR
+            self.ovs_timer.init(freq=self.oversampling_rate)
+            start_us = pyb.micros()
+            for i in range(n_calls):
+                ISR(None)
+            ISR_us = pyb.elapsed_micros(start_us) / n_calls
+            self.ovs_timer.deinit()
+            start_us = pyb.micros()
+            self.chunk_header[1] = sum(self.buffer_data_mv[self.send_buf]) & 0xFFFF
+            checksum_us = pyb.elapsed_micros(start_us) / n_calls
+            start_us = pyb.micros()
+            _compress_buffer(
+                self.sample_buffers[self.send_buf],
+                self.compressed_buffer,
+                self.buffer_size,
+                self.sample_stride,
+                self.chunk_header,
+                len(self.chunk_header),
+            )
+            compress_us = pyb.elapsed_micros(start_us) / n_calls
+            results[benchmark_mode] = {
+                "ISR_us": ISR_us,
+                "checksum_us": checksum_us,
+                "compress_us": compress_us,
+                "max_sampling_rate": int(max_load * 1e6 / ((ISR_us + checksum_us) * calls_per_sample)),
+                "max_sampling_rate_compressed": int(
+                    max_load * 1e6 / ((ISR_us + checksum_us + compress_us) * calls_per_sample)
+                ),
+            }
+        self.LED1.write(0)
+        self.LED2.write(0)
+        if mode:
+            self.set_mode(mode)
+        self.sample_buffers = self.buffer_data_mv = self.compressed_buffer = self.compressed_mvs = None  # Free memory.
+        gc.collect()
+        return results
+
     def sync_pulse_update(self):
         if self.sync_counter == self.sync_next_IPI:
             self.sync_pin.value(1)
@@ -142,93 +298,186 @@ class Photometry:
             self.sync_pulse_state = False
         self.sync_counter += 1
 
+    def _sync_pulse_DI(self):
+        # Update sync pulse output, return its state as the digital sample.
+        self.sync_pulse_update()
+        return self.sync_pulse_state
+
+    def _no_DI(self):
+        # Digital sample for channels without a digital input.
+        return 0
+
     @micropython.native
     def continuous_ISR(self, t):
         # Interrupt service routine for 2 color continous acquisition mode.
-        if self.sync_out:
-            self.sync_pulse_update()
+        if self.write_ind == 0:  # First sample in buffer.
+            self.buffer_start_us[self.write_buf] = pyb.micros() & 0x3FFFFFFF
+        buffer = self.sample_buffers[self.write_buf]
         self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)  # Read sample of analog 1.
-        self.sample = sum(self.ovs_buffer) >> 3
-        DI1_value = self.sync_pulse_state if self.sync_out else self.DI1.value()
-        self.sample_buffers[self.write_buf][self.write_ind] = (self.sample << 1) | DI1_value
-        self.write_ind += 1
+        buffer[self.write_ind] = (_oversampled(self.ovs_buffer, 64) << 1) | self.DI1_value()
         self.ADC2.read_timed(self.ovs_buffer, self.ovs_timer)  # Read sample of analog 2.
-        self.sample = sum(self.ovs_buffer) >> 3
-        self.sample_buffers[self.write_buf][self.write_ind] = (self.sample << 1) | self.DI2.value()
+        buffer[self.write_ind + 1] = (_oversampled(self.ovs_buffer, 64) << 1) | self.DI2.value()
         # Update write index and switch buffers if full.
-        self.write_ind = (self.write_ind + 1) % self.buffer_size
-        if self.write_ind == 0:  # Buffer full, switch buffers.
-            self.write_buf = 1 - self.write_buf
-            self.send_buf = 1 - self.send_buf
-            self.buffer_ready = True
+        self.write_ind = (self.write_ind + 2) % self.buffer_size
+        if self.write_ind == 0:  # Buffer full.
+            self._buffer_full()
 
     @micropython.native
     def pulsed_ISR(self, t):
-        # Interrupt service routine for pulsed acquisition modes.
+        # Interrupt service routine for pulsed acquisition modes, the ADC, LED and digital input
+        # for each channel are looked up in tables set by set_mode and _setup.
+        if self.write_ind == 0:  # First sample in buffer.
+            self.buffer_start_us[self.write_buf] = pyb.micros() & 0x3FFFFFFF
+        channel = self.channel
+        ADC = self.channel_ADCs[channel]
+        LED = self.channel_LEDs[channel]
 
         # Read baseline, turn on LED.
-        if self.channel == 0:  # Photoreciever=1, LED=1.
-            self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-            self.LED1.write(self.LED_1_value)
-        elif self.channel == 1:
-            if self.mode == "2EX_1EM_pulsed":  # Photoreciever=1, LED=2.
-                self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-                self.LED2.write(self.LED_2_value)
-            else:  # Photoreciever=2, LED=2.
-                self.ADC2.read_timed(self.ovs_buffer, self.ovs_timer)
-                self.LED2.write(self.LED_2_value)
-        elif self.channel == 2:  # Photoreciever=1, LED=3.
-            self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-            self.LED3.value(1)
-        self.baseline = sum(self.ovs_buffer) >> 3
+        ADC.read_timed(self.ovs_buffer, self.ovs_timer)
+        LED(self.LED_values[channel])
+        baseline = _oversampled(self.ovs_buffer, 64)
 
         pyb.udelay(300)  # Wait before reading ADC (us).
 
         # Read sample, turn off LED.
-        if self.channel == 0:  # Photoreciever=1, LED=1.
-            if self.sync_out:
-                self.sync_pulse_update()
-            self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-            self.dig_sample = self.sync_pulse_state if self.sync_out else self.DI1.value()
-            self.LED1.write(0)
-        elif self.channel == 1:
-            if self.mode == "2EX_1EM_pulsed":  # Photoreciever=1, LED=2.
-                self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-            else:  # Photoreciever=2, LED=2.
-                self.ADC2.read_timed(self.ovs_buffer, self.ovs_timer)
-            self.dig_sample = False if self.mode == "3EX_2EM_pulsed" else self.DI2.value()
-            self.LED2.write(0)
-        elif self.channel == 2:  # Photoreciever=1, LED=3.
-            self.ADC1.read_timed(self.ovs_buffer, self.ovs_timer)
-            self.LED3.value(0)
-            self.dig_sample = False
-        self.sample = sum(self.ovs_buffer) >> 3
-
-        # Store LED-on signal in buffer.
-        self.sample_buffers[self.write_buf][self.write_ind] = (self.sample << 1) | self.dig_sample
-
-        # Store baseline in buffer.
-        self.sample_buffers[self.write_buf][self.write_ind + 1] = self.baseline << 1
+        ADC.read_timed(self.ovs_buffer, self.ovs_timer)
+        dig_sample = self.channel_DIs[channel]()
+        LED(0)
+
+        # Store LED-on signal and baseline in buffer.
+        buffer = self.sample_buffers[self.write_buf]
+        buffer[self.write_ind] = (_oversampled(self.ovs_buffer, 64) << 1) | dig_sample
+        buffer[self.write_ind + 1] = baseline << 1
 
         # Update channel to read next call.
-        self.channel = (self.channel + 1) % self.n_analog_signals
+        self.channel = (channel + 1) % self.n_analog_signals
 
         # Update write index and switch buffers if buffer full.
         self.write_ind = (self.write_ind + 2) % self.buffer_size
-        if self.write_ind == 0:  # Buffer full, switch buffers.
-            self.write_buf = 1 - self.write_buf
-            self.send_buf = 1 - self.send_buf
-            self.buffer_ready = True
+        if self.write_ind == 0:  # Buffer full.
+            self._buffer_full()
+
+    @micropython.native
+    def _buffer_full(self):
+        # Queue the full write buffer to be sent and switch to the next buffer, unless all other
+        # buffers are waiting to be sent, in which case the data is discarded and the buffer
+        # reused.  The chunk number is incremented either way so the host detects lost chunks.
+        self.chunk_number = (self.chunk_number + 1) & 0xFFFF
+        if self.n_ready < self.n_buffers - 1:
+            self.buffer_chunk_numbers[self.write_buf] = self.chunk_number
+            self.write_buf = (self.write_buf + 1) % self.n_buffers
+            self.n_ready += 1
+        else:
+            self.n_overruns += 1
 
     @micropython.native
     def _send_buffer(self):
-        # Send full buffer to host computer. Each chunk of data sent to computer is
+        # Send oldest full buffer to host computer. Each chunk of data sent to computer is
         # preceded by a 5 byte header containing the byte b'\x07' indicating the
         # start of a chunk, then the chunk_number and checksum encoded as 2 byte integers.
-        self.chunk_number = (self.chunk_number + 1) & 0xFFFF
-        self.chunk_header[0] = self.chunk_number
-        self.chunk_header[1] = sum(self.buffer_data_mv[self.send_buf]) & 0xFFFF  # Checksum
-        self.usb_serial.write(b"\x07")
-        self.usb_serial.write(self.chunk_header)
-        self.usb_serial.send(self.sample_buffers[self.send_buf])
-        self.buffer_ready = False
+        # If sending overruns, the number of buffers discarded modulo 2**16 follows the checksum.
+        # If sending timestamps, the time of the first sample in the chunk (us, modulo 2**30)
+        # follows as two 2 byte integers (low then high).  Header values after the checksum are
+        # included in the checksum.  If compressing, the chunk is delta encoded by _compress_buffer.
+        self.chunk_header[0] = self.buffer_chunk_numbers[self.send_buf]
+        checksum = sum(self.buffer_data_mv[self.send_buf])
+        if self.send_overruns:
+            self.chunk_header[2] = self.n_overruns & 0xFFFF
+            checksum += self.chunk_header[2]
+        if self.timestamps:
+            self.chunk_header[self.timestamp_ind] = self.buffer_start_us[self.send_buf] & 0xFFFF
+            self.chunk_header[self.timestamp_ind + 1] = self.buffer_start_us[self.send_buf] >> 16
+            checksum += self.chunk_header[self.timestamp_ind] + self.chunk_header[self.timestamp_ind + 1]
+        self.chunk_header[1] = checksum & 0xFFFF
+        if self.compress:
+            n_bits = _compress_buffer(
+                self.sample_buffers[self.send_buf],
+                self.compressed_buffer,
+                self.buffer_size,
+                self.sample_stride,
+                self.chunk_header,
+                len(self.chunk_header),
+            )
+            self.usb_serial.send(self.compressed_mvs[n_bits])
+        else:
+            self.usb_serial.write(b"\x07")
+            self.usb_serial.write(self.chunk_header)
+            self.usb_serial.send(self.sample_buffers[self.send_buf])
+        self.send_buf = (self.send_buf + 1) % self.n_buffers
+        irq_state = pyb.disable_irq()  # Prevent ISR modifying n_ready during update.
+        self.n_ready -= 1
+        pyb.enable_irq(irq_state)
+
+    def mem_free(self):
+        # Return the number of bytes of free heap memory, used by the host to choose n_buffers.
+        gc.collect()
+        return gc.mem_free()
+
+
+@micropython.viper
+def _oversampled(buf, n: int) -> int:
+    # Return the sum of the first n values in buf divided by 8.
+    b = ptr16(buf)
+    total = 0
+    i = 0
+    while i < n:
+        total += b[i]
+        i += 1
+    return total >> 3
+
+
+@micropython.viper
+def _compress_buffer(buf, out, n_values: int, stride: int, header, n_header: int) -> int:
+    # Delta encode buffer into out, return the number of bits used for each difference.  The
+    # compressed chunk is the byte b'\x06', the n_header 2 byte integers of the chunk header
+    # (see _send_buffer), the number of bits per difference as a 1 byte integer, the first
+    # stride values as 2 byte integers, then the difference between each subsequent value and
+    # the value stride before it, modulo 2**16, zigzag encoded and bit packed least significant
+    # bit first.  Values vary slowly so differences need fewer bits than values.
+    b = ptr16(buf)
+    h = ptr16(header)
+    o = ptr8(out)
+    # Find number of bits needed for largest difference.
+    max_zz = 0
+    i = stride
+    while i < n_values:
+        d = ((b[i] - b[i - stride] + 0x8000) & 0xFFFF) - 0x8000
+        zz = (d << 1) ^ (d >> 31)  # Zigzag encoding maps small negative and positive ints to small ints.
+        if zz > max_zz:
+            max_zz = zz
+        i += 1
+    n_bits = 0
+    while (1 << n_bits) <= max_zz:
+        n_bits += 1
+    # Write header and first sample.
+    o[0] = 0x06
+    i = 0
+    while i < n_header:
+        o[1 + 2 * i] = h[i]
+        o[2 + 2 * i] = h[i] >> 8
+        i += 1
+    j = 1 + 2 * n_header
+    o[j] = n_bits
+    j += 1
+    i = 0
+    while i < stride:
+        o[j] = b[i]
+        o[j + 1] = b[i] >> 8
+        j += 2
+        i += 1
+    # Write bit packed differences.
+    acc = 0  # Bits not yet written.
+    acc_bits = 0  # Number of bits in acc.
+    while i < n_values:
+        d = ((b[i] - b[i - stride] + 0x8000) & 0xFFFF) - 0x8000
+        acc |= ((d << 1) ^ (d >> 31)) << acc_bits
+        acc_bits += n_bits
+        while acc_bits >= 8:
+            o[j] = acc
+            acc >>= 8
+            acc_bits -= 8
+            j += 1
+        i += 1
+    if acc_bits > 0:
+        o[j] = acc
+    return n_bits